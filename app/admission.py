@@ -0,0 +1,177 @@
+import math
+import os
+import time
+from dotenv import load_dotenv
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from metrics import metrics
+import security
+
+load_dotenv()
+
+# Requests per second and burst size allowed per API key; a rate of 0 turns rate limiting off
+RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', 50))
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', 100))
+# Bounds of the adaptive concurrency limit; a maximum of 0 turns it off
+ADMISSION_MIN_CONCURRENCY = int(os.getenv('ADMISSION_MIN_CONCURRENCY', 4))
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', 200))
+# Smoothed request latency in seconds above which the concurrency limit backs off
+ADMISSION_TARGET_LATENCY = float(os.getenv('ADMISSION_TARGET_LATENCY', 0.25))
+
+# Paths that must keep answering under overload
+EXEMPT_PATHS = {"/metrics", "/admin/reload", "/admin/profile"}
+
+
+class TokenBucket:
+    """Refills at `rate` tokens per second up to `capacity`; each request takes one."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now):
+        """
+        Take a token if one is available.
+
+        :return: 0 if a token was taken, otherwise seconds until the next one.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Caps requests in flight with a limit adapted to latency by AIMD.
+
+    Every request that completes with the smoothed latency under the target
+    grows the limit by 1/limit (about one per round of requests); a slow or
+    failed one shrinks it by `backoff`, at most once per smoothed latency so
+    one burst of slow completions does not collapse it. Requests beyond the
+    limit are refused instead of queued. All calls come from the event loop,
+    so no locking is needed.
+    """
+
+    def __init__(self, minimum=ADMISSION_MIN_CONCURRENCY, maximum=ADMISSION_MAX_CONCURRENCY,
+                 target_latency=ADMISSION_TARGET_LATENCY, backoff=0.9, smoothing=0.2, initial=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.limit = float(initial if initial is not None else max(minimum, maximum // 4))
+        self.inflight = 0
+        self.latency = 0.0
+        self.decreased_at = 0.0
+
+    def try_acquire(self):
+        if self.inflight >= int(self.limit):
+            return False
+        self.inflight += 1
+        return True
+
+    def release(self, latency, failed=False, now=None):
+        self.inflight -= 1
+        self.latency += self.smoothing * (latency - self.latency)
+        now = time.monotonic() if now is None else now
+        if failed or self.latency > self.target_latency:
+            if now - self.decreased_at >= self.latency:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.decreased_at = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def retry_after(self):
+        """Seconds a refused client should wait: about one request's worth of latency."""
+        return max(1, math.ceil(self.latency))
+
+
+class AdmissionController:
+    """Per-API-key token buckets in front of one adaptive concurrency limit."""
+
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST, concurrency=None):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.concurrency = concurrency if concurrency is not None else (
+            AdaptiveConcurrencyLimit() if ADMISSION_MAX_CONCURRENCY > 0 else None
+        )
+
+    def check_rate(self, api_key, now=None):
+        """
+        :return: 0 if the key may make a request now, otherwise seconds to wait.
+        """
+        # Unknown keys are left to authenticate() to reject, so they never get a bucket
+        if self.rate <= 0 or api_key not in security.VALID_API_KEYS:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(api_key)
+        if bucket is None:
+            bucket = self.buckets[api_key] = TokenBucket(self.rate, self.burst, now)
+        return bucket.take(now)
+
+
+def too_many_requests(detail, retry_after):
+    return JSONResponse(
+        {"detail": detail}, status_code=429, headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware shedding load with 429 and Retry-After before any work is done.
+
+    A request is refused when its API key is out of tokens, or when the
+    adaptive concurrency limit is reached; admitted requests report their
+    latency back to the limit when they complete.
+    """
+
+    def __init__(self, app, controller=None):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # Defaults to the module's controller, looked up per request so it can be replaced
+        controller = self.controller or admission
+        wait = controller.check_rate(Headers(scope=scope).get("x-api-key"))
+        if wait > 0:
+            metrics.rate_limited.inc()
+            await too_many_requests("Rate limit exceeded", wait)(scope, receive, send)
+            return
+
+        limit = controller.concurrency
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        if not limit.try_acquire():
+            metrics.overloaded.inc()
+            await too_many_requests("Server is busy", limit.retry_after())(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        status_code = 500
+
+        async def recording_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            limit.release(time.monotonic() - started, failed=status_code >= 500)
+
+
+admission = AdmissionController()
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import struct
+import zlib
+
+# Memcached binary protocol, see
+# https://github.com/memcached/memcached/wiki/BinaryProtocolRevamped
+HEADER = struct.Struct('!BBHBBHLLQ')
+REQUEST_MAGIC = 0x80
+RESPONSE_MAGIC = 0x81
+
+OP_GET = 0x00
+OP_SET = 0x01
+OP_ADD = 0x02
+OP_DELETE = 0x04
+OP_NOOP = 0x0a
+OP_GETKQ = 0x0d
+OP_SETQ = 0x11
+OP_SASL_AUTH = 0x21
+
+STATUS_OK = 0x00
+STATUS_KEY_NOT_FOUND = 0x01
+STATUS_KEY_EXISTS = 0x02
+STATUS_NOT_STORED = 0x05
+
+# Value flags, compatible with python-binary-memcached
+FLAG_COMPRESSED = 1 << 3
+FLAG_BINARY = 1 << 4
+
+STORE_EXTRAS = struct.Struct('!LL')
+
+
+class MemcachedError(Exception):
+    """Raised when memcached returns an unexpected status."""
+
+    def __init__(self, status, message=''):
+        super().__init__(f"Memcached error {status:#x}: {message}")
+        self.status = status
+
+
+def encode_value(value):
+    """Return (flags, bytes) for a str or bytes value."""
+    if isinstance(value, bytes):
+        return FLAG_BINARY, value
+    return 0, str(value).encode('utf-8')
+
+
+def decode_value(flags, value):
+    if flags & FLAG_COMPRESSED:
+        value = zlib.decompress(value)
+    if flags & FLAG_BINARY:
+        return value
+    return value.decode('utf-8')
+
+
+def pack_request(opcode, key=b'', value=b'', extras=b'', opaque=0):
+    body_length = len(key) + len(extras) + len(value)
+    return HEADER.pack(
+        REQUEST_MAGIC, opcode, len(key), len(extras), 0, 0, body_length, opaque, 0
+    ) + extras + key + value
+
+
+def pack_store(opcode, key, value, time, opaque=0):
+    flags, data = encode_value(value)
+    return pack_request(opcode, key, data, STORE_EXTRAS.pack(flags, int(time)), opaque)
+
+
+class Connection:
+    """A single memcached connection speaking the binary protocol."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host, port, ssl=None, username=None, password=None):
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl, server_hostname=host if ssl else None
+        )
+        connection = cls(reader, writer)
+        if username and password:
+            await connection.authenticate(username, password)
+        return connection
+
+    async def authenticate(self, username, password):
+        credentials = f"\x00{username}\x00{password}".encode('utf-8')
+        self.writer.write(pack_request(OP_SASL_AUTH, b'PLAIN', credentials))
+        await self.writer.drain()
+        _, status, _, _, body = await self.read_response()
+        if status != STATUS_OK:
+            raise MemcachedError(status, body.decode('utf-8', 'replace'))
+
+    async def read_response(self):
+        """Return (opcode, status, key, flags, value) for the next response."""
+        header = await self.reader.readexactly(HEADER.size)
+        magic, opcode, key_length, extras_length, _, status, body_length, _, _ = HEADER.unpack(header)
+        if magic != RESPONSE_MAGIC:
+            raise MemcachedError(0xff, "invalid response magic")
+        body = await self.reader.readexactly(body_length) if body_length else b''
+        extras = body[:extras_length]
+        key = body[extras_length:extras_length + key_length]
+        value = body[extras_length + key_length:]
+        flags = struct.unpack('!L', extras[:4])[0] if extras_length >= 4 else 0
+        return opcode, status, key, flags, value
+
+    async def request(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+        return await self.read_response()
+
+    async def pipeline(self, data):
+        """
+        Send quiet requests followed by a NOOP and collect responses until the NOOP
+        comes back. Quiet commands only answer on a hit (GETKQ) or an error (SETQ).
+        """
+        self.writer.write(data + pack_request(OP_NOOP))
+        await self.writer.drain()
+        responses = []
+        while True:
+            response = await self.read_response()
+            if response[0] == OP_NOOP:
+                return responses
+            responses.append(response)
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncMemcachedClient:
+    """
+    Asyncio memcached client with a bounded connection pool.
+
+    Every operation is bounded by `timeout` seconds; a connection that times out
+    or errors is discarded rather than returned to the pool.
+    """
+
+    def __init__(self, host, port, username=None, password=None, ssl=None, pool_size=10, timeout=1.0):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.ssl = ssl
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._loop = None
+        self._idle = []
+        self._slots = None
+
+    async def _acquire(self):
+        # Connections and the pool semaphore belong to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._idle = []
+            self._slots = asyncio.Semaphore(self.pool_size)
+
+        await self._slots.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+            return await Connection.open(self.host, self.port, self.ssl, self.username, self.password)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, connection, reusable):
+        if reusable:
+            self._idle.append(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    async def _run(self, operation):
+        async def run():
+            connection = await self._acquire()
+            try:
+                result = await operation(connection)
+            except BaseException:
+                self._release(connection, False)
+                raise
+            self._release(connection, True)
+            return result
+
+        return await asyncio.wait_for(run(), self.timeout)
+
+    async def get(self, key):
+        async def operation(connection):
+            _, status, _, flags, value = await connection.request(pack_request(OP_GET, key.encode()))
+            if status == STATUS_KEY_NOT_FOUND:
+                return None
+            if status != STATUS_OK:
+                raise MemcachedError(status)
+            return decode_value(flags, value)
+        return await self._run(operation)
+
+    async def _store(self, opcode, key, value, time):
+        async def operation(connection):
+            _, status, _, _, _ = await connection.request(pack_store(opcode, key.encode(), value, time))
+            if status in (STATUS_KEY_EXISTS, STATUS_NOT_STORED):
+                return False
+            if status != STATUS_OK:
+                raise MemcachedError(status)
+            return True
+        return await self._run(operation)
+
+    async def set(self, key, value, time=0):
+        return await self._store(OP_SET, key, value, time)
+
+    async def add(self, key, value, time=0):
+        return await self._store(OP_ADD, key, value, time)
+
+    async def delete(self, key):
+        async def operation(connection):
+            _, status, _, _, _ = await connection.request(pack_request(OP_DELETE, key.encode()))
+            if status not in (STATUS_OK, STATUS_KEY_NOT_FOUND):
+                raise MemcachedError(status)
+            return status == STATUS_OK
+        return await self._run(operation)
+
+    async def get_multi(self, keys):
+        """Fetch many keys in one pipelined round-trip."""
+        if not keys:
+            return {}
+
+        async def operation(connection):
+            data = b''.join(pack_request(OP_GETKQ, key.encode()) for key in keys)
+            found = {}
+            for _, status, key, flags, value in await connection.pipeline(data):
+                if status == STATUS_OK:
+                    found[key.decode()] = decode_value(flags, value)
+            return found
+        return await self._run(operation)
+
+    async def set_multi(self, mappings, time=0):
+        """Store many keys in one pipelined round-trip."""
+        if not mappings:
+            return True
+
+        async def operation(connection):
+            data = b''.join(
+                pack_store(OP_SETQ, key.encode(), value, time) for key, value in mappings.items()
+            )
+            failures = await connection.pipeline(data)
+            for _, status, _, _, _ in failures:
+                logging.warning(f"Memcached set_multi item failed with status {status:#x}")
+            return not failures
+        return await self._run(operation)
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop().close()
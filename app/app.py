@@ -1,59 +1,99 @@
 # Standard library imports
-import json
-import hashlib
+import asyncio
+import os
+from contextlib import asynccontextmanager
 
 # Third-party imports
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Depends, Query, status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from starlette.concurrency import run_in_threadpool
 import logging
 import uvicorn
 
 # Local application imports
 from utils import (
     find_nearest_station, 
-    get_google_maps_directions, 
-    load_all_stations, 
     setup_logging, 
-    load_outliers, 
-    is_distant_location, 
+    closest_outlier_key,
     round_coordinates, 
-    determine_service_area
+    nearest_station_features,
+    station_feature,
+    location_cache_key,
+    directions_cache_key,
+    NEAREST_STATION_CACHE_TTL
 )
 
-from security import authenticate, SecurityHeadersMiddleware
-from models import LocationRequest
-from cache import memcached_client
-from middlewares import limit_request_size, log_requests
+from datasets import DatasetManager
+from security import authenticate, authenticate_admin, SecurityHeadersMiddleware
+from models import LocationRequest, BatchLocationRequest, KNearestRequest, RadiusRequest
+from cache import tiered_cache
+from directions import directions_client
+from directions_cache import cached_directions
+from responses import (
+    JSONBytesResponse,
+    dumps,
+    nearest_station_body,
+    distant_body,
+    with_directions,
+    batch_body,
+    feature_collection_body
+)
+from middlewares import RequestSizeLimitMiddleware, AccessLogMiddleware
+from admission import AdmissionControlMiddleware
+from warming import CacheWarmer
+from profiling import ServerTimingMiddleware, ProfilerBusy, profile, PROFILE_MAX_SECONDS
 from metrics import metrics 
 
 
 load_dotenv()
 setup_logging()
 
+# Networks come from a config file (see networks.json). Each network's stations
+# are memory-mapped from the compiled snapshot (see find_outermost_stations.py)
+# when present, otherwise parsed with its configured loader. Locations are
+# routed to the closest network hull; beyond its buffer they are answered with
+# the closest outermost station instead. With SHARED_SNAPSHOT set, every
+# network is compiled once into that file and all workers memory-map it.
+# The datasets can be reloaded without a restart (see datasets.DatasetManager).
+datasets = DatasetManager(os.getenv('NETWORKS_CONFIG', '../networks.json'), os.getenv('SHARED_SNAPSHOT'))
 try:
-    septa_stations, dc_metro_stations = load_all_stations(
-        '../SEPTARegionalRailStations2016/doc.kml',
-        '../Metro_Stations_Regional.geojson'
-    )
+    datasets.load()
 except Exception as e:
-    logging.error(f"Failed to load station data: {e}")
-    septa_stations, dc_metro_stations = [], [] 
+    logging.error(f"Failed to load networks config: {e}")
 
-septa_outliers = load_outliers('../septa_outermost_stations.json')
-dc_metro_outliers = load_outliers('../dc_metro_outermost_stations.json')
+# In-process cache entries for locations outside every service area
+DISTANT_KEY_PREFIX = "distant:"
 
+@asynccontextmanager
+async def lifespan(app):
+    # Optionally pick up dataset changes on disk without an admin call
+    watch_interval = float(os.getenv('DATASET_WATCH_INTERVAL', 0))
+    watcher = asyncio.create_task(app.state.datasets.watch(watch_interval)) if watch_interval > 0 else None
+    # Warm the cache for the most requested locations, then keep the hot list up to date
+    warmer = app.state.warmer
+    warming = asyncio.create_task(warmer.run(app.state.datasets, app.state)) if warmer.enabled else None
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    if warming is not None:
+        warming.cancel()
+        try:
+            warmer.save()
+        except OSError as e:
+            logging.error(f"Failed to save hot locations: {e}")
+    await app.state.directions_client.close()
+    await app.state.cache.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Middleware setup
-app.state.memcached_client = memcached_client
-app.state.septa_outliers = septa_outliers
-app.state.dc_metro_outliers = dc_metro_outliers
-logging.info(f"Loaded outliers for SEPTA: {septa_outliers}")
-logging.info(f"Loaded outliers for DC Metro: {dc_metro_outliers}")
+app.state.cache = tiered_cache
+app.state.directions_client = directions_client
+app.state.datasets = datasets
+app.state.warmer = CacheWarmer()
+for network in datasets.registry:
+    logging.info(f"Loaded {network.label} with {len(network.stations.stations)} stations, outliers: {network.outliers}")
 
 app.add_middleware(
     CORSMiddleware,
@@ -62,96 +102,326 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Admission control sheds load before any work is done; refusals still get
+# the security headers and an access log entry
+app.add_middleware(AdmissionControlMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
-app.middleware("http")(limit_request_size)
-app.middleware("http")(log_requests)
+app.add_middleware(RequestSizeLimitMiddleware)
+# Stage timings for the request, as a Server-Timing header (admin keys only by default)
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(AccessLogMiddleware)
+
+async def fetch_directions(location, body, mode='walking', version=None):
+    """
+    Fetch directions to the station in a nearest-station body, going through the cache first.
+
+    :param version: Dataset version the body was computed from.
+    :return: Serialized directions, ready to splice into the body.
+    """
+    directions_key = directions_cache_key(location, mode, version)
+    return await cached_directions(
+        app.state.cache, app.state.directions_client, directions_key, location, body, mode
+    )
 
 @app.post("/nearest_station", dependencies=[Depends(authenticate)])
 async def nearest_station(request: LocationRequest):
 
-    metrics.api_calls += 1 
+    metrics.api_calls.inc()
+    # The whole request is answered from the generation current when it arrived
+    registry = app.state.datasets.registry
     rounded_location = round_coordinates((request.latitude, request.longitude), precision=4)
-    location_key = hashlib.sha256(json.dumps(rounded_location).encode('utf-8')).hexdigest()
+    location_key = location_cache_key(rounded_location, registry.version)
+    app.state.warmer.record(rounded_location, request.include_directions)
 
     try:
-        # Determine the service area (SEPTA or DC Metro)
-        stations, outliers = determine_service_area(
-            rounded_location, septa_stations, septa_outliers, 
-            dc_metro_stations, dc_metro_outliers
-        )
+        # Repeat lookups are answered from the in-process cache without any I/O
+        with metrics.stage("cache_get"):
+            cached_body = app.state.cache.get_local(location_key)
+            distant_body_bytes = None
+            if cached_body is None:
+                distant_body_bytes = app.state.cache.get_local(DISTANT_KEY_PREFIX + location_key)
+
+        if cached_body is None and distant_body_bytes is None:
+            # Determine the service area (SEPTA or DC Metro) and whether the location is too distant
+            with metrics.stage("region_resolve"):
+                region, is_distant, _ = registry.resolve(rounded_location)
+            if region is None:
+                metrics.failed_responses.inc()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Station data is not available."
+                )
+            stations = region.stations
+            if is_distant:
+                # Select the nearest outlier based on proximity
+                with metrics.stage("nearest_compute"):
+                    outlier_key = closest_outlier_key(rounded_location, region.outliers)
+                with metrics.stage("serialize"):
+                    distant_body_bytes = distant_body(region.outliers[outlier_key])
+                app.state.cache.set_local(DISTANT_KEY_PREFIX + location_key, distant_body_bytes)
+            else:
+                # Try to fetch the result from the cache
+                with metrics.stage("cache_get"):
+                    cached_body = await app.state.cache.get(location_key)
+
+        if distant_body_bytes is not None:
+            metrics.successful_responses.inc()
+            return JSONBytesResponse(distant_body_bytes)
 
-        # Check if the location is too distant
-        is_distant, closest_outlier_key = is_distant_location(rounded_location, outliers)
-        if is_distant:
-            # Select the nearest outlier based on proximity
-            nearest_station_geojson = outliers[closest_outlier_key]
-
-            response_data = {
-                "status": "success",
-                "nearest_station": nearest_station_geojson,
-                "directions": "Location is too far away for directions" 
-            }
-
-            metrics.successful_responses += 1 
-            metrics.log_metrics()
-            return JSONResponse(content=response_data)
-
-        # Try to fetch the result from the cache
-        cached_result = await run_in_threadpool(app.state.memcached_client.get, location_key)
-        if cached_result:
-            metrics.cache_hits += 1 
-            nearest_station_geojson = json.loads(cached_result)
+        if cached_body:
+            metrics.cache_hits.inc()
         else:
-            metrics.cache_misses += 1  
+            metrics.cache_misses.inc()
 
-            # Find the nearest station
-            nearest_station_geojson = find_nearest_station(rounded_location, stations, app.state.memcached_client)
+            # Find the nearest station; this also caches the serialized body
+            cached_body = await find_nearest_station(
+                rounded_location, stations, app.state.cache, version=registry.version
+            )
 
-            if nearest_station_geojson is None:
-                metrics.failed_responses += 1 
+            if cached_body is None:
+                metrics.failed_responses.inc()
                 raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail="Another process is handling this request, please try again shortly."
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Station data is not available."
                 )
 
-            # Cache the result
-            await run_in_threadpool(
-                app.state.memcached_client.set,
-                location_key,
-                json.dumps(nearest_station_geojson),
-                84600
-            )
-
-        response_data = {
-            "status": "success",
-            "nearest_station": nearest_station_geojson,
-            "directions": None
-        }
+        body = cached_body
 
         # Only fetch directions if the location is not too distant
-        if request.include_directions and not is_distant:
-            directions = await run_in_threadpool(
-                get_google_maps_directions, 
-                rounded_location, 
-                nearest_station_geojson, 
-                'walking', 
-                app.state.memcached_client
-            )
-            response_data["directions"] = directions
+        if request.include_directions:
+            directions = await fetch_directions(rounded_location, body, version=registry.version)
+            with metrics.stage("serialize"):
+                body = with_directions(body, directions)
 
-        metrics.successful_responses += 1 
-        metrics.log_metrics()
-        return JSONResponse(content=response_data)
+        metrics.successful_responses.inc()
+        return JSONBytesResponse(body)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error processing nearest_station request: {e}")
-        metrics.failed_responses += 1 
-        metrics.log_metrics() 
+        metrics.failed_responses.inc()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while processing your request."
+        )
+
+@app.post("/nearest_stations", dependencies=[Depends(authenticate)])
+async def nearest_stations(request: BatchLocationRequest):
+
+    metrics.api_calls.inc()
+    registry = app.state.datasets.registry
+    # Each result is a serialized item body; the batch body is joined from them
+    results = [None] * len(request.locations)
+
+    # Reject invalid coordinates per item instead of failing the whole batch
+    pending = []
+    for i, location in enumerate(request.locations):
+        if -90 <= location.latitude <= 90 and -180 <= location.longitude <= 180:
+            pending.append(i)
+        else:
+            results[i] = dumps({"status": "error", "detail": "Invalid coordinates."})
+
+    rounded_locations = {
+        i: round_coordinates((request.locations[i].latitude, request.locations[i].longitude), precision=4)
+        for i in pending
+    }
+
+    try:
+        # Resolve service areas for the whole batch at once
+        with metrics.stage("region_resolve"):
+            areas = dict(zip(pending, registry.resolve_many(
+                [rounded_locations[i] for i in pending]
+            )))
+
+        nearby = [i for i in pending if not areas[i][1]]
+        keys = {i: location_cache_key(rounded_locations[i], registry.version) for i in nearby}
+        for i in nearby:
+            app.state.warmer.record(rounded_locations[i], request.locations[i].include_directions)
+
+        # One multi-get for every cacheable location in the batch
+        cached = {}
+        if keys:
+            try:
+                with metrics.stage("cache_get"):
+                    cached = await app.state.cache.get_multi(list(set(keys.values())))
+            except Exception as e:
+                logging.error(f"Batch cache lookup failed: {e}")
+
+        to_cache = {}
+        # Cache misses by region, then by cache key, so repeats are computed once
+        misses = {}
+        for i in pending:
+            region, is_distant, _ = areas[i]
+            if region is None:
+                results[i] = dumps({"status": "error", "detail": "No stations available for this location."})
+                continue
+            if is_distant:
+                outlier_key = closest_outlier_key(rounded_locations[i], region.outliers)
+                results[i] = distant_body(region.outliers[outlier_key])
+                continue
+
+            key = keys[i]
+            if key in cached:
+                metrics.cache_hits.inc()
+                results[i] = cached[key]
+            else:
+                group = misses.setdefault(region.name, (region, {}))[1]
+                if key not in group:
+                    metrics.cache_misses.inc()
+                group.setdefault(key, []).append(i)
+
+        # One vectorized nearest-station pass per region for all of its misses
+        for region, by_key in misses.values():
+            with metrics.stage("nearest_compute"):
+                features = nearest_station_features(
+                    [rounded_locations[items[0]] for items in by_key.values()], region.stations
+                )
+            for (key, items), feature in zip(by_key.items(), features):
+                if feature is None:
+                    body = dumps({"status": "error", "detail": "No stations available for this location."})
+                else:
+                    with metrics.stage("serialize"):
+                        body = to_cache[key] = nearest_station_body(feature)
+                for i in items:
+                    results[i] = body
+
+        found = [i for i in nearby if keys[i] in cached or keys[i] in to_cache]
+
+        # One multi-set for everything computed in this batch
+        if to_cache:
+            try:
+                await app.state.cache.set_multi(to_cache, NEAREST_STATION_CACHE_TTL)
+            except Exception as e:
+                logging.error(f"Batch cache write failed: {e}")
+
+        for i in found:
+            if request.locations[i].include_directions:
+                try:
+                    results[i] = with_directions(
+                        results[i], await fetch_directions(rounded_locations[i], results[i], version=registry.version)
+                    )
+                except Exception as e:
+                    logging.error(f"Error fetching directions for batch item {i}: {e}")
+                    results[i] = dumps({"status": "error", "detail": "Failed to fetch directions."})
+
+        metrics.successful_responses.inc()
+        with metrics.stage("serialize"):
+            body = batch_body(results)
+        return JSONBytesResponse(body)
+
+    except Exception as e:
+        logging.error(f"Error processing nearest_stations request: {e}")
+        metrics.failed_responses.inc()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while processing your request."
         )
 
 
+def query_features(found):
+    """Turn (network, station index, distance) query results into GeoJSON Features."""
+    return [
+        station_feature(
+            network.stations.stations[i], distance,
+            network=network.name, attributes=network.table.attributes(i)
+        )
+        for network, i, distance in found
+    ]
+
+def check_network(registry, name):
+    if name is not None and registry.get(name) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown network {name}.")
+
+@app.post("/stations/nearest", dependencies=[Depends(authenticate)])
+async def k_nearest_stations(request: KNearestRequest):
+
+    metrics.api_calls.inc()
+    registry = app.state.datasets.registry
+    check_network(registry, request.network)
+    with metrics.stage("nearest_compute"):
+        found = registry.k_nearest(
+            (request.latitude, request.longitude), request.k, request.filters, request.network
+        )
+    with metrics.stage("serialize"):
+        body = feature_collection_body(query_features(found))
+    metrics.successful_responses.inc()
+    return JSONBytesResponse(body)
+
+@app.post("/stations/within", dependencies=[Depends(authenticate)])
+async def stations_within(request: RadiusRequest):
+
+    metrics.api_calls.inc()
+    registry = app.state.datasets.registry
+    check_network(registry, request.network)
+    with metrics.stage("nearest_compute"):
+        found = registry.within(
+            (request.latitude, request.longitude), request.radius_miles, request.filters, request.network
+        )
+    with metrics.stage("serialize"):
+        body = feature_collection_body(
+            query_features(found[:request.limit]), truncated=len(found) > request.limit
+        )
+    metrics.successful_responses.inc()
+    return JSONBytesResponse(body)
+
+@app.get("/networks", dependencies=[Depends(authenticate)])
+async def networks():
+    registry = app.state.datasets.registry
+    return JSONResponse(content={
+        "version": registry.version,
+        "networks": [network.describe() for network in registry],
+    })
+
+
+@app.post("/admin/reload", dependencies=[Depends(authenticate_admin)])
+async def reload_datasets():
+    """Rebuild the station networks from disk in the background and swap them in."""
+    try:
+        reloaded = await app.state.datasets.reload()
+    except Exception as e:
+        logging.error(f"Failed to reload networks: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to reload station data."
+        )
+    registry = app.state.datasets.registry
+    return JSONResponse(content={
+        "reloaded": reloaded,
+        "version": registry.version,
+        "networks": [network.describe() for network in registry],
+    })
+
+
+@app.get("/admin/profile", dependencies=[Depends(authenticate_admin)])
+async def profile_process(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    include_idle: bool = False,
+):
+    """
+    Sample this worker's stacks while it serves live traffic.
+
+    :return: Collapsed stacks, one `frame;frame;... count` line each, for flamegraph.pl or speedscope.
+    """
+    try:
+        profiler = await profile(seconds, interval_ms / 1000, include_idle)
+    except ProfilerBusy:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running.")
+    return PlainTextResponse(profiler.collapsed(), headers={"X-Profile-Samples": str(profiler.samples)})
+
+
+@app.get("/cache/stats", dependencies=[Depends(authenticate)])
+async def cache_stats():
+    return JSONResponse(content=app.state.cache.stats())
+
+
+@app.get("/metrics", dependencies=[Depends(authenticate)])
+async def prometheus_metrics():
+    """Counters and per-stage latency histograms in the Prometheus text format, summed over all workers."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
+    # log_config=None keeps the queue-based logging set up by setup_logging
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True, log_config=None)
@@ -1,19 +1,324 @@
 import bmemcached
 import os
+import ssl
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
-from utils import setup_logging
+from starlette.concurrency import run_in_threadpool
+from aiomemcached import AsyncMemcachedClient
 import logging
 
 load_dotenv()
-setup_logging
 
-try:
-    memcached_client = bmemcached.Client(
-        f"{os.getenv('MEMCACHED_HOST')}:{os.getenv('MEMCACHED_PORT')}",
-        username=os.getenv('MEMCACHED_USERNAME'),
-        password=os.getenv('MEMCACHED_PASSWORD')
+L1_CACHE_SIZE = int(os.getenv('L1_CACHE_SIZE', 10000))
+L1_CACHE_TTL = int(os.getenv('L1_CACHE_TTL', 3600))
+L1_NEGATIVE_TTL = int(os.getenv('L1_NEGATIVE_TTL', 5))
+MEMCACHED_RETRY_INTERVAL = int(os.getenv('MEMCACHED_RETRY_INTERVAL', 30))
+
+# Stored in the L1 for keys that memcached is known not to have
+NEGATIVE = object()
+
+
+class LRUCache:
+    """Thread-safe in-process cache with LRU eviction and per-entry TTL."""
+
+    def __init__(self, maxsize=L1_CACHE_SIZE, ttl=L1_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._data[key]
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Store a value, capping the TTL at the cache's own TTL."""
+        ttl = self.ttl if not ttl else min(ttl, self.ttl)
+        with self._lock:
+            self._store(key, value, ttl)
+        return True
+
+    def add(self, key, value, ttl=None):
+        """Store a value only if the key is not already present."""
+        ttl = self.ttl if not ttl else min(ttl, self.ttl)
+        with self._lock:
+            if self._lookup(key, time.monotonic()) is not None:
+                return False
+            self._store(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        return True
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class TieredCache:
+    """
+    In-process LRU (L1) in front of memcached (L2).
+
+    Exposes the subset of the memcached client interface the service uses, as
+    coroutines. get_local and set_local touch only the L1 and never block. When
+    memcached is missing or failing it degrades to L1-only and retries the L2
+    after MEMCACHED_RETRY_INTERVAL seconds.
+    """
+
+    def __init__(self, local, remote=None, negative_ttl=L1_NEGATIVE_TTL, retry_interval=MEMCACHED_RETRY_INTERVAL):
+        self.local = local
+        self.remote = remote
+        self.negative_ttl = negative_ttl
+        self.retry_interval = retry_interval
+        self._remote_down_until = 0.0
+        self.remote_hits = 0
+        self.remote_misses = 0
+        self.remote_errors = 0
+
+    def _remote_available(self):
+        return self.remote is not None and time.monotonic() >= self._remote_down_until
+
+    def _remote_connected(self):
+        # bmemcached swallows connection errors, so check its sockets directly
+        servers = getattr(self.remote, 'servers', None)
+        return servers is None or any(server.connection is not None for server in servers)
+
+    async def _call_remote(self, operation, *args):
+        """Run a memcached operation, returning (succeeded, result)."""
+        if not self._remote_available():
+            return False, None
+        try:
+            result = await getattr(self.remote, operation)(*args)
+        except Exception as e:
+            self._remote_failed(operation, e)
+            return False, None
+        if not self._remote_connected():
+            self._remote_failed(operation, "no memcached server is reachable")
+            return False, None
+        return True, result
+
+    def _remote_failed(self, operation, error):
+        self.remote_errors += 1
+        self._remote_down_until = time.monotonic() + self.retry_interval
+        logging.error(f"Memcached {operation} failed, using in-process cache only: {error}")
+
+    def get_local(self, key):
+        """Return a positive L1 entry without any network I/O, or None."""
+        value = self.local.get(key)
+        return None if value is NEGATIVE else value
+
+    def set_local(self, key, value, time=0):
+        """Store a value in the L1 only."""
+        return self.local.set(key, value, time)
+
+    async def get(self, key):
+        value = self.local.get(key)
+        if value is NEGATIVE:
+            return None
+        if value is not None:
+            return value
+
+        ok, value = await self._call_remote('get', key)
+        if not ok:
+            return None
+        if value is None:
+            self.remote_misses += 1
+            self.local.set(key, NEGATIVE, self.negative_ttl)
+        else:
+            self.remote_hits += 1
+            self.local.set(key, value)
+        return value
+
+    async def get_remote(self, key):
+        """Read a key from memcached even if the L1 holds a negative entry for it."""
+        ok, value = await self._call_remote('get', key)
+        if ok and value is not None:
+            self.remote_hits += 1
+            self.local.set(key, value)
+            return value
+        return self.get_local(key)
+
+    async def set(self, key, value, time=0):
+        self.local.set(key, value, time)
+        await self._call_remote('set', key, value, time)
+        return True
+
+    async def add(self, key, value, time=0):
+        # Locks have to be visible to other replicas, so they live in memcached when possible
+        ok, added = await self._call_remote('add', key, value, time)
+        if ok:
+            return added
+        return self.local.add(key, value, time)
+
+    async def delete(self, key):
+        self.local.delete(key)
+        await self._call_remote('delete', key)
+        return True
+
+    async def get_multi(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is NEGATIVE:
+                continue
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if missing:
+            ok, remote_found = await self._call_remote('get_multi', missing)
+            if not ok:
+                return found
+            remote_found = remote_found or {}
+            for key in missing:
+                if key in remote_found:
+                    self.remote_hits += 1
+                    self.local.set(key, remote_found[key])
+                    found[key] = remote_found[key]
+                else:
+                    self.remote_misses += 1
+                    self.local.set(key, NEGATIVE, self.negative_ttl)
+        return found
+
+    async def set_multi(self, mappings, time=0):
+        for key, value in mappings.items():
+            self.local.set(key, value, time)
+        await self._call_remote('set_multi', mappings, time)
+        return True
+
+    async def close(self):
+        """Close the memcached client's connections, e.g. at shutdown."""
+        if self.remote is not None:
+            await self.remote.close()
+
+    def stats(self):
+        return {
+            "l1": self.local.stats(),
+            "l2": {
+                "enabled": self.remote is not None,
+                "available": self._remote_available(),
+                "hits": self.remote_hits,
+                "misses": self.remote_misses,
+                "errors": self.remote_errors,
+            },
+        }
+
+
+class ThreadedMemcachedClient:
+    """Coroutine interface over a blocking bmemcached.Client, run in the threadpool."""
+
+    def __init__(self, client):
+        self.client = client
+        self.servers = client.servers
+
+    async def get(self, key):
+        return await run_in_threadpool(self.client.get, key)
+
+    async def set(self, key, value, time=0):
+        return await run_in_threadpool(self.client.set, key, value, time)
+
+    async def add(self, key, value, time=0):
+        return await run_in_threadpool(self.client.add, key, value, time)
+
+    async def delete(self, key):
+        return await run_in_threadpool(self.client.delete, key)
+
+    async def get_multi(self, keys):
+        return await run_in_threadpool(self.client.get_multi, keys)
+
+    async def set_multi(self, mappings, time=0):
+        return await run_in_threadpool(self.client.set_multi, mappings, time)
+
+    async def close(self):
+        await run_in_threadpool(self.client.disconnect_all)
+
+
+def create_memcached_client():
+    """
+    Build the memcached client from the MEMCACHED_* environment variables.
+
+    MEMCACHED_BACKEND selects the native asyncio client ('async', the default) or
+    the blocking bmemcached client run in the threadpool ('bmemcached').
+    Returns None when MEMCACHED_HOST is not set.
+    """
+    host = os.getenv('MEMCACHED_HOST')
+    if not host:
+        logging.warning("MEMCACHED_HOST is not set, using the in-process cache only.")
+        return None
+
+    port = os.getenv('MEMCACHED_PORT', '11211')
+    username = os.getenv('MEMCACHED_USERNAME')
+    password = os.getenv('MEMCACHED_PASSWORD')
+    tls_context = ssl.create_default_context() if os.getenv('MEMCACHED_USE_SSL', '').lower() in ('1', 'true', 'yes') else None
+
+    if os.getenv('MEMCACHED_BACKEND', 'async').lower() == 'bmemcached':
+        return ThreadedMemcachedClient(bmemcached.Client(
+            f"{host}:{port}",
+            username=username,
+            password=password,
+            tls_context=tls_context
+        ))
+
+    return AsyncMemcachedClient(
+        host,
+        port,
+        username=username,
+        password=password,
+        ssl=tls_context,
+        pool_size=int(os.getenv('MEMCACHED_POOL_SIZE', 10)),
+        timeout=float(os.getenv('MEMCACHED_TIMEOUT', 0.5))
     )
-    logging.info("Memcached client initialized successfully.")
+
+
+try:
+    memcached_client = create_memcached_client()
+    if memcached_client is not None:
+        logging.info("Memcached client initialized successfully.")
 except Exception as e:
     logging.error(f"Failed to initialize memcached client: {e}")
     memcached_client = None
+
+tiered_cache = TieredCache(LRUCache(), memcached_client)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from networks import config_fingerprint, load_registry, load_shared_registry, NetworkRegistry
+
+
+def dataset_version(fingerprint):
+    """Short dataset version carried in cache keys, taken from a config fingerprint."""
+    return fingerprint[:12]
+
+
+class DatasetManager:
+    """
+    Holds the live generation of the station networks and swaps in new ones.
+
+    A reload builds the next NetworkRegistry in a worker thread while requests
+    keep being answered from the current one, then replaces it with a single
+    assignment. Handlers read `registry` once per request, so requests in
+    flight finish on the generation they started with. Every generation has
+    a version derived from the config and the files it names, which cache keys
+    include so that results computed from an older dataset are never served.
+    """
+
+    def __init__(self, config_path, shared_snapshot=None):
+        self.config_path = config_path
+        self.shared_snapshot = shared_snapshot
+        self.registry = NetworkRegistry([])
+        self.fingerprint = None
+        self.reloads = 0
+        # Created on first use so it belongs to the serving event loop
+        self._lock = None
+
+    @property
+    def version(self):
+        return self.registry.version
+
+    def build(self):
+        """Load a new generation from the config, without installing it."""
+        fingerprint = config_fingerprint(self.config_path)
+        if self.shared_snapshot:
+            registry = load_shared_registry(self.config_path, self.shared_snapshot, fingerprint)
+        else:
+            registry = load_registry(self.config_path, fingerprint=fingerprint)
+        registry.version = dataset_version(fingerprint)
+        return registry, fingerprint
+
+    def load(self):
+        """Load and install the first generation, blocking."""
+        self.registry, self.fingerprint = self.build()
+        return self.registry
+
+    def changed(self):
+        """Whether the config or a file it names has changed since the live generation was loaded."""
+        try:
+            return config_fingerprint(self.config_path) != self.fingerprint
+        except Exception as e:
+            logging.error(f"Failed to check networks config {self.config_path}: {e}")
+            return False
+
+    async def reload(self, force=True):
+        """
+        Build a new generation in the background and swap it in.
+
+        A generation that loads no networks while the current one has some is
+        rejected, so a half-written dataset cannot take the service down.
+
+        :param force: Rebuild even if nothing changed on disk.
+        :return: True if a new generation was installed.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            # Checking hashes every source file, so it runs off the event loop like the build
+            if not force and not await loop.run_in_executor(None, self.changed):
+                return False
+            registry, fingerprint = await loop.run_in_executor(None, self.build)
+            if not len(registry) and len(self.registry):
+                logging.error(f"Reload of {self.config_path} loaded no networks, keeping version {self.version}")
+                return False
+            previous, self.registry, self.fingerprint = self.version, registry, fingerprint
+            self.reloads += 1
+            logging.info(
+                f"Reloaded networks {', '.join(network.name for network in registry)}: "
+                f"version {previous} -> {registry.version}"
+            )
+            return True
+
+    async def watch(self, interval):
+        """Reload whenever the dataset files change, checking every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload(force=False)
+            except Exception as e:
+                logging.error(f"Failed to reload networks: {e}")
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+DIRECTIONS_UNAVAILABLE = "Directions are temporarily unavailable"
+
+# Google statuses that mean the upstream itself is unhealthy, as opposed to a
+# request that simply has no route
+UPSTREAM_FAILURE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR", "REQUEST_DENIED"}
+
+
+class DirectionsUnavailable(Exception):
+    """Raised when directions cannot be fetched and a degraded response should be returned."""
+
+
+class UpstreamFailure(DirectionsUnavailable):
+    """Raised when the Directions API itself failed or timed out; counts against the circuit breaker."""
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures. While open,
+    calls are rejected until `reset_timeout` seconds pass, then a single trial
+    call is let through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self):
+        """
+        End a call without an outcome, e.g. one cancelled by a client disconnect.
+        A half-open trial call hands its slot back so the next call can try.
+        """
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning("Directions circuit breaker opened.")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class DirectionsClient:
+    """
+    Async Google Maps Directions client with keep-alive connection pooling, a
+    per-request timeout, a concurrency cap and a circuit breaker.
+    """
+
+    def __init__(self, base_url=None, api_key=None, timeout=None, max_concurrency=None, breaker=None):
+        self.base_url = base_url or os.getenv('GOOGLE_MAPS_DIRECTIONS_URL', DEFAULT_DIRECTIONS_URL)
+        self.api_key = api_key if api_key is not None else os.getenv('GOOGLE_MAPS_API_KEY')
+        self.timeout = timeout if timeout is not None else float(os.getenv('DIRECTIONS_TIMEOUT', 5.0))
+        self.max_concurrency = (
+            max_concurrency if max_concurrency is not None else int(os.getenv('DIRECTIONS_MAX_CONCURRENCY', 20))
+        )
+        self.breaker = breaker or CircuitBreaker(
+            int(os.getenv('DIRECTIONS_BREAKER_THRESHOLD', 5)),
+            float(os.getenv('DIRECTIONS_BREAKER_RESET', 30.0)),
+        )
+        self._loop = None
+        self._client = None
+        self._slots = None
+
+    def _ensure_client(self):
+        # The pool and semaphore belong to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+            )
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def get_directions(self, start, end, mode='walking'):
+        """
+        Get directions from a location to a station.
+
+        :param start: Tuple (latitude, longitude) of the start location.
+        :param end: GeoJSON Feature of the destination station.
+        :param mode: Mode of transportation, e.g., 'walking', 'driving', 'transit'.
+        :return: JSON response from the Directions API.
+        :raises DirectionsUnavailable: If the circuit is open or the upstream fails.
+        """
+        if not self.breaker.allow():
+            raise DirectionsUnavailable("circuit open")
+
+        # Only upstream errors and timeouts count as failures. Every other way
+        # out (cancellation, no free slot) still releases a half-open trial,
+        # or the circuit would wait forever for it to report back.
+        try:
+            directions = await self._request(start, end, mode)
+        except UpstreamFailure:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return directions
+
+    async def _request(self, start, end, mode):
+        client = self._ensure_client()
+        params = {
+            "origin": f"{start[0]},{start[1]}",
+            "destination": f"{end['geometry']['coordinates'][1]},{end['geometry']['coordinates'][0]}",
+            "mode": mode,
+            "key": self.api_key or '',
+        }
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise DirectionsUnavailable("too many concurrent directions requests")
+
+        try:
+            response = await client.get(self.base_url, params=params)
+            response.raise_for_status()
+            directions = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logging.error(f"Directions request failed: {e!r}")
+            raise UpstreamFailure(str(e))
+        finally:
+            self._slots.release()
+
+        if not isinstance(directions, dict):
+            logging.error(f"Directions API returned a {type(directions).__name__} instead of an object")
+            raise UpstreamFailure("unexpected response")
+        if directions.get("status") in UPSTREAM_FAILURE_STATUSES:
+            logging.error(f"Directions API returned {directions.get('status')}")
+            raise UpstreamFailure(directions.get("status"))
+        return directions
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+
+directions_client = DirectionsClient()
@@ -0,0 +1,191 @@
+import asyncio
+import html
+import logging
+import math
+import os
+import random
+import re
+import struct
+import time
+import zlib
+from collections import namedtuple
+from dotenv import load_dotenv
+from directions import DirectionsUnavailable, DIRECTIONS_UNAVAILABLE
+from metrics import metrics
+from responses import dumps, nearest_station_from_body
+
+load_dotenv()
+
+# Entries are served as fresh for the soft TTL (spread by +/- the jitter
+# fraction so entries written together do not all expire together), then
+# served stale while one background refresh runs, until memcached drops them
+# at the hard TTL
+DIRECTIONS_SOFT_TTL = int(os.getenv('DIRECTIONS_SOFT_TTL', 86400))
+DIRECTIONS_HARD_TTL = int(os.getenv('DIRECTIONS_HARD_TTL', 7 * 86400))
+DIRECTIONS_TTL_JITTER = float(os.getenv('DIRECTIONS_TTL_JITTER', 0.1))
+# Scales how early, relative to the time Google took to answer, an entry may be refreshed
+DIRECTIONS_EARLY_EXPIRY_BETA = float(os.getenv('DIRECTIONS_EARLY_EXPIRY_BETA', 1.0))
+# How long one replica may hold the right to refresh an entry
+DIRECTIONS_REFRESH_LOCK_TTL = int(os.getenv('DIRECTIONS_REFRESH_LOCK_TTL', 30))
+
+# Entry layout: magic, fresh-until (epoch seconds), upstream fetch seconds, zlib-compressed JSON
+# (DZ2 keeps Google's field shapes; DZ1 entries are treated as misses)
+ENTRY_MAGIC = b"DZ2"
+ENTRY_HEADER = struct.Struct("!3sdd")
+
+STEP_FIELDS = ("html_instructions", "distance", "duration", "travel_mode", "maneuver", "transit_details")
+LEG_FIELDS = ("distance", "duration", "start_address", "end_address", "start_location", "end_location")
+
+DirectionsEntry = namedtuple("DirectionsEntry", ["directions", "fresh_until", "fetch_seconds"])
+
+_TAGS = re.compile(r"<[^>]+>")
+_SPACES = re.compile(r"\s+")
+
+# Background refreshes in flight in this process, by cache key
+_refreshes = {}
+
+
+def plain_text(instructions):
+    """Turn Google's HTML step instructions into plain text."""
+    return _SPACES.sub(" ", html.unescape(_TAGS.sub(" ", instructions))).strip()
+
+
+def _pick(source, fields):
+    return {field: source[field] for field in fields if field in source}
+
+
+def trim_directions(directions):
+    """
+    Keep only the parts of a Directions API response the service returns.
+
+    Drops geocoded waypoints, per-step polylines and route bounds. Everything
+    kept stays under Google's names and in Google's shapes, so clients parsing
+    the Directions API format keep working; steps also get a plain-text copy
+    of `html_instructions` as `instructions`.
+    """
+    routes = []
+    for route in directions.get("routes", []):
+        trimmed_route = {"summary": route.get("summary", "")}
+        if "overview_polyline" in route:
+            trimmed_route["overview_polyline"] = _pick(route["overview_polyline"], ("points",))
+        trimmed_route["legs"] = [
+            {
+                **_pick(leg, LEG_FIELDS),
+                "steps": [
+                    {**_pick(step, STEP_FIELDS), "instructions": plain_text(step.get("html_instructions", ""))}
+                    for step in leg.get("steps", [])
+                ],
+            }
+            for leg in route.get("legs", [])
+        ]
+        routes.append(trimmed_route)
+    return {"status": directions.get("status"), "routes": routes}
+
+
+def encode_entry(directions, fetch_seconds, now=None, soft_ttl=None, jitter=None):
+    """
+    Pack serialized directions into a compressed cache entry.
+
+    :param directions: Serialized (trimmed) directions JSON.
+    :param fetch_seconds: How long the upstream took, used for early expiration.
+    :return: Entry bytes for the cache.
+    """
+    now = time.time() if now is None else now
+    soft_ttl = DIRECTIONS_SOFT_TTL if soft_ttl is None else soft_ttl
+    jitter = DIRECTIONS_TTL_JITTER if jitter is None else jitter
+    fresh_until = now + soft_ttl * (1 + random.uniform(-jitter, jitter))
+    return ENTRY_HEADER.pack(ENTRY_MAGIC, fresh_until, fetch_seconds) + zlib.compress(directions, 6)
+
+
+def decode_entry(data):
+    """
+    Unpack a cache entry.
+
+    :return: DirectionsEntry, or None for a missing entry or one in an older format.
+    """
+    if not data or not data.startswith(ENTRY_MAGIC):
+        return None
+    _, fresh_until, fetch_seconds = ENTRY_HEADER.unpack_from(data)
+    return DirectionsEntry(zlib.decompress(data[ENTRY_HEADER.size:]), fresh_until, fetch_seconds)
+
+
+def needs_refresh(entry, now=None, beta=None):
+    """
+    Whether an entry should be refreshed: once it is stale, or, with a
+    probability that grows as its soft expiry approaches, a little before.
+
+    This is probabilistic early expiration ("XFetch"): each read treats the
+    entry as expired `fetch_seconds * beta * -ln(U)` seconds early, so busy
+    keys are refreshed just ahead of time by one reader instead of all at once.
+    """
+    now = time.time() if now is None else now
+    beta = DIRECTIONS_EARLY_EXPIRY_BETA if beta is None else beta
+    return now - entry.fetch_seconds * beta * math.log(1.0 - random.random()) >= entry.fresh_until
+
+
+async def fetch_and_store(cache, client, key, location, destination, mode='walking'):
+    """
+    Fetch directions from the upstream and cache them.
+
+    :return: Serialized, trimmed directions.
+    :raises DirectionsUnavailable: If the upstream fails.
+    """
+    started = time.perf_counter()
+    with metrics.stage("directions_fetch"):
+        directions = await client.get_directions(location, destination, mode)
+    fetch_seconds = time.perf_counter() - started
+    with metrics.stage("serialize"):
+        directions = dumps(trim_directions(directions))
+        entry = encode_entry(directions, fetch_seconds)
+    await cache.set(key, entry, DIRECTIONS_HARD_TTL)
+    return directions
+
+
+async def refresh(cache, client, key, location, destination, mode, seen):
+    """Refresh an entry in the background, unless another replica already has or is doing so."""
+    latest = decode_entry(await cache.get_remote(key))
+    if latest is not None and latest.fresh_until > seen.fresh_until:
+        return
+    lock_key = f"refresh:{key}"
+    if not await cache.add(lock_key, "1", time=DIRECTIONS_REFRESH_LOCK_TTL):
+        return
+    try:
+        metrics.directions_refreshes.inc()
+        await fetch_and_store(cache, client, key, location, destination, mode)
+    except DirectionsUnavailable as e:
+        logging.error(f"Background directions refresh failed, serving stale entry: {e}")
+    finally:
+        await cache.delete(lock_key)
+
+
+def schedule_refresh(cache, client, key, location, destination, mode, seen):
+    if key in _refreshes:
+        return
+    task = asyncio.ensure_future(refresh(cache, client, key, location, destination, mode, seen))
+    _refreshes[key] = task
+    task.add_done_callback(lambda _: _refreshes.pop(key, None))
+
+
+async def cached_directions(cache, client, key, location, body, mode='walking'):
+    """
+    Directions from a location to the station in a nearest-station body, from the cache when possible.
+
+    Stale entries are returned as they are while a background task refreshes them.
+
+    :param cache: Async cache client (TieredCache).
+    :param client: DirectionsClient.
+    :param key: Cache key, see utils.directions_cache_key.
+    :param body: Nearest-station body the directions are for.
+    :return: Serialized directions, ready to splice into the body.
+    """
+    with metrics.stage("cache_get"):
+        entry = decode_entry(await cache.get(key))
+    if entry is not None:
+        if needs_refresh(entry):
+            schedule_refresh(cache, client, key, location, nearest_station_from_body(body), mode, entry)
+        return entry.directions
+
+    try:
+        return await fetch_and_store(cache, client, key, location, nearest_station_from_body(body), mode)
+    except DirectionsUnavailable:
+        return dumps(DIRECTIONS_UNAVAILABLE)
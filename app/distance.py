@@ -0,0 +1,194 @@
+import os
+import numpy as np
+from geopy.distance import geodesic
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EARTH_RADIUS_MILES = 3958.7613
+METERS_PER_MILE = 1609.344
+
+# WGS-84 ellipsoid, as used by geopy.distance.geodesic
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+EXACT = 'exact'
+FAST = 'fast'
+
+# Maximum error against geopy.distance.geodesic that each mode is verified to
+# stay within: absolute miles for the ellipsoidal solver, relative for the
+# spherical approximation.
+ACCURACY_TOLERANCE = {
+    EXACT: 1e-6,
+    FAST: 0.005,
+}
+
+
+def get_distance_mode():
+    """Return the configured distance mode ('exact' or 'fast'), defaulting to 'exact'."""
+    mode = os.getenv('DISTANCE_MODE', EXACT).lower()
+    return mode if mode in ACCURACY_TOLERANCE else EXACT
+
+
+class CoordinateArray:
+    """Station coordinates held as contiguous float64 latitude and longitude arrays."""
+
+    def __init__(self, latitudes, longitudes):
+        self.latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+        self.longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+
+    @classmethod
+    def from_stations(cls, stations):
+        """Build a CoordinateArray from a sequence of station dicts."""
+        return cls(
+            [station['latitude'] for station in stations],
+            [station['longitude'] for station in stations],
+        )
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def take(self, indices):
+        """Return a new CoordinateArray with only the given positions."""
+        return CoordinateArray(self.latitudes[indices], self.longitudes[indices])
+
+
+def haversine_miles(location, latitudes, longitudes):
+    """
+    Great-circle distances from one point to many targets on a spherical Earth.
+
+    :param location: Tuple (latitude, longitude) in degrees.
+    :param latitudes: Array of target latitudes in degrees.
+    :param longitudes: Array of target longitudes in degrees.
+    :return: Array of distances in miles.
+    """
+    lat1 = np.radians(location[0])
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - np.radians(location[1])
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def vincenty_miles(location, latitudes, longitudes, tolerance=1e-12, max_iterations=200):
+    """
+    Ellipsoidal (WGS-84) distances from one point to many targets using Vincenty's
+    inverse formula. Targets where the iteration fails to converge (nearly
+    antipodal points) fall back to geopy's geodesic solver.
+
+    :param location: Tuple (latitude, longitude) in degrees; arrays broadcast against the targets.
+    :param latitudes: Array of target latitudes in degrees.
+    :param longitudes: Array of target longitudes in degrees.
+    :param tolerance: Convergence threshold on lambda, in radians.
+    :param max_iterations: Maximum number of iterations.
+    :return: Array of distances in miles.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+
+    L = np.radians(longitudes - location[1])
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(location[0])))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(latitudes)))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt(
+                (cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2
+            )
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(
+                cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha
+            )
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_next = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged |= np.abs(lam_next - lam) < tolerance
+            if converged.all():
+                break
+            # Freeze converged targets so each result is independent of the others in the batch
+            lam = np.where(converged, lam, lam_next)
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (
+            cos_2sigma_m + B / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+        miles = WGS84_B * A * (sigma - delta_sigma) / METERS_PER_MILE
+
+    fallback = ~converged | ~np.isfinite(miles)
+    if fallback.any():
+        lat1, lon1, lat2, lon2 = np.broadcast_arrays(location[0], location[1], latitudes, longitudes)
+        miles = np.array(miles)
+        for i in zip(*np.nonzero(fallback)):
+            miles[i] = geodesic((lat1[i], lon1[i]), (lat2[i], lon2[i])).miles
+    return miles
+
+
+def distances_miles(location, coordinates, mode=None):
+    """
+    Distances from one point to every coordinate in a single vectorized call.
+
+    :param location: Tuple (latitude, longitude) in degrees.
+    :param coordinates: CoordinateArray of targets.
+    :param mode: 'exact' for ellipsoidal distances, 'fast' for spherical; defaults to DISTANCE_MODE.
+    :return: Array of distances in miles.
+    """
+    mode = mode or get_distance_mode()
+    if mode == FAST:
+        return haversine_miles(location, coordinates.latitudes, coordinates.longitudes)
+    return vincenty_miles(location, coordinates.latitudes, coordinates.longitudes)
+
+
+def pairwise_distances_miles(latitudes, longitudes, coordinates, mode=None):
+    """
+    Distances from many points to every coordinate in a single vectorized call.
+
+    :param latitudes: Array of point latitudes in degrees.
+    :param longitudes: Array of point longitudes in degrees.
+    :param coordinates: CoordinateArray of targets.
+    :param mode: 'exact' for ellipsoidal distances, 'fast' for spherical; defaults to DISTANCE_MODE.
+    :return: Array of shape (points, targets) with distances in miles.
+    """
+    location = (
+        np.asarray(latitudes, dtype=np.float64)[:, np.newaxis],
+        np.asarray(longitudes, dtype=np.float64)[:, np.newaxis],
+    )
+    return distances_miles(location, coordinates, mode)
+
+
+def max_error_miles(location, coordinates, mode):
+    """
+    Compare a distance mode against geopy's geodesic solver.
+
+    :return: Tuple of (max absolute error in miles, max relative error).
+    """
+    computed = distances_miles(location, coordinates, mode)
+    reference = np.array([
+        geodesic(location, (lat, lon)).miles
+        for lat, lon in zip(coordinates.latitudes, coordinates.longitudes)
+    ])
+    absolute = np.abs(computed - reference)
+    relative = np.where(reference > 0, absolute / np.where(reference > 0, reference, 1.0), 0.0)
+    return float(absolute.max(initial=0.0)), float(relative.max(initial=0.0))
+
+
+def verify_accuracy(location, coordinates, mode):
+    """Return True if a mode stays within its ACCURACY_TOLERANCE of geopy for these targets."""
+    absolute, relative = max_error_miles(location, coordinates, mode)
+    if mode == FAST:
+        return relative <= ACCURACY_TOLERANCE[FAST]
+    return absolute <= ACCURACY_TOLERANCE[EXACT]
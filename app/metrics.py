@@ -1,23 +1,229 @@
-import logging
+import bisect
+import contextvars
+import glob
+import os
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Request stages timed by the stage latency histogram
+STAGES = ("auth", "region_resolve", "cache_get", "lease_wait", "nearest_compute", "directions_fetch", "serialize")
+
+# Upper bounds in seconds; the last bucket is +Inf
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# List of (stage, seconds) for the current request, set only while it is being
+# timed for a Server-Timing header (see profiling.ServerTimingMiddleware)
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class MetricsRegistry:
+    """
+    Every metric's samples, stored in one float64 array of slots.
+
+    Metrics claim their slots when they are defined, so the layout is the same
+    in every process running this code. With a multiprocess directory (the
+    METRICS_MULTIPROC_DIR environment variable) each process keeps its slots
+    in a memory-mapped file named after its pid, and a scrape from any worker
+    sums the files of every worker that ever ran, as counters and histograms
+    are cumulative. All updates go through one lock, so they are safe from
+    threads as well as coroutines.
+    """
+
+    def __init__(self, multiproc_dir=None):
+        self.multiproc_dir = multiproc_dir
+        self.metrics = []
+        self.size = 0
+        self._lock = threading.Lock()
+        self._values = None
+        if hasattr(os, 'register_at_fork'):
+            # A forked worker (e.g. under gunicorn --preload) must not write to its parent's file
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._values = None
+
+    def claim(self, metric, count):
+        """Reserve `count` slots for a metric, returning the first one."""
+        if self._values is not None:
+            raise RuntimeError("Metrics must be defined before any are recorded")
+        self.metrics.append(metric)
+        start = self.size
+        self.size += count
+        return start
+
+    def path_for(self, pid):
+        return os.path.join(self.multiproc_dir, f"metrics_{pid}.db")
+
+    @property
+    def values(self):
+        if self._values is None:
+            if self.multiproc_dir:
+                os.makedirs(self.multiproc_dir, exist_ok=True)
+                path = self.path_for(os.getpid())
+                if not os.path.exists(path) or os.path.getsize(path) != self.size * 8:
+                    np.zeros(self.size, dtype=np.float64).tofile(path)
+                self._values = np.memmap(path, dtype=np.float64, mode='r+', shape=(self.size,))
+            else:
+                self._values = np.zeros(self.size, dtype=np.float64)
+        return self._values
+
+    def add(self, slot, amount):
+        values = self.values
+        with self._lock:
+            values[slot] += amount
+
+    def collect(self):
+        """Return the samples summed over every process sharing the multiprocess directory."""
+        if not self.multiproc_dir:
+            return self.values.copy()
+        total = self.values.copy()
+        own = self.path_for(os.getpid())
+        for path in glob.glob(os.path.join(self.multiproc_dir, "metrics_*.db")):
+            if path == own or os.path.getsize(path) != self.size * 8:
+                continue
+            total += np.fromfile(path, dtype=np.float64)
+        return total
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        values = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+
+def _format(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self, registry, name, documentation):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.slot = registry.claim(self, 1)
+
+    def inc(self, amount=1):
+        self.registry.add(self.slot, amount)
+
+    def render(self, values):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {_format(values[self.slot])}",
+        ]
+
+
+class Histogram:
+    """
+    Observations counted into fixed buckets, one series per value of a label.
+
+    Each series stores a count per bucket (not cumulative) and the sum of the
+    observations; cumulative bucket counts are computed when rendering.
+    """
+
+    def __init__(self, registry, name, documentation, label, label_values, buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.width = len(self.buckets) + 2
+        self.series = {value: i for i, value in enumerate(label_values)}
+        self.start = registry.claim(self, self.width * len(self.series))
+
+    def observe(self, label_value, seconds):
+        base = self.start + self.series[label_value] * self.width
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        values = self.registry.values
+        with self.registry._lock:
+            values[base + bucket] += 1
+            values[base + self.width - 1] += seconds
+
+    def time(self, label_value):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, label_value)
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_value, i in self.series.items():
+            base = self.start + i * self.width
+            counts = np.cumsum(values[base:base + self.width - 1])
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                lines.append(f'{self.name}_bucket{{{label},le="{_format(bound)}"}} {_format(count)}')
+            lines.append(f"{self.name}_sum{{{label}}} {_format(values[base + self.width - 1])}")
+            lines.append(f"{self.name}_count{{{label}}} {_format(counts[-1])}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_value", "started")
+
+    def __init__(self, histogram, label_value):
+        self.histogram = histogram
+        self.label_value = label_value
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.label_value, elapsed)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((self.label_value, elapsed))
+        return False
+
 
 class Metrics:
-    _instance = None
-
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(Metrics, cls).__new__(cls)
-            cls._instance.cache_hits = 0
-            cls._instance.cache_misses = 0
-            cls._instance.api_calls = 0
-            cls._instance.successful_responses = 0
-            cls._instance.failed_responses = 0
-        return cls._instance
-
-    def log_metrics(self):
-        logging.info(f"Logging Metrics - Cache Hits: {self.cache_hits}")
-        logging.info(f"Logging Metrics - Cache Misses: {self.cache_misses}")
-        logging.info(f"Logging Metrics - API Calls: {self.api_calls}")
-        logging.info(f"Logging Metrics - Successful Responses: {self.successful_responses}")
-        logging.info(f"Logging Metrics - Failed Responses: {self.failed_responses}")
-
-metrics = Metrics()
+    """The service's metrics, exposed on /metrics."""
+
+    def __init__(self, multiproc_dir=None):
+        self.registry = MetricsRegistry(multiproc_dir)
+        self.api_calls = Counter(self.registry, "nearest_station_api_calls_total", "API requests received.")
+        self.successful_responses = Counter(
+            self.registry, "nearest_station_successful_responses_total", "Requests answered successfully."
+        )
+        self.failed_responses = Counter(
+            self.registry, "nearest_station_failed_responses_total", "Requests that failed."
+        )
+        self.cache_hits = Counter(self.registry, "nearest_station_cache_hits_total", "Nearest-station cache hits.")
+        self.cache_misses = Counter(
+            self.registry, "nearest_station_cache_misses_total", "Nearest-station cache misses."
+        )
+        self.rate_limited = Counter(
+            self.registry, "nearest_station_rate_limited_total", "Requests refused because their API key ran out of tokens."
+        )
+        self.overloaded = Counter(
+            self.registry, "nearest_station_overloaded_total", "Requests shed at the adaptive concurrency limit."
+        )
+        self.directions_refreshes = Counter(
+            self.registry, "nearest_station_directions_refreshes_total",
+            "Stale or soon-to-expire directions refreshed in the background."
+        )
+        self.stage_seconds = Histogram(
+            self.registry, "nearest_station_stage_seconds", "Time spent in each request stage.",
+            "stage", STAGES
+        )
+
+    def stage(self, name):
+        """Context manager timing a request stage, e.g. `with metrics.stage("cache_get"):`."""
+        return self.stage_seconds.time(name)
+
+    def render(self):
+        return self.registry.render()
+
+
+metrics = Metrics(os.getenv('METRICS_MULTIPROC_DIR'))
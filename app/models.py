@@ -1,6 +1,33 @@
-from pydantic import BaseModel
+import os
+from typing import Dict, List, Optional, Union
+from pydantic import BaseModel, Field
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 1000))
+MAX_QUERY_RESULTS = int(os.getenv('MAX_QUERY_RESULTS', 100))
+# Radius queries are complete up to the smallest network buffer (100 miles by default)
+MAX_QUERY_RADIUS_MILES = float(os.getenv('MAX_QUERY_RADIUS_MILES', 50))
 
 class LocationRequest(BaseModel):
     latitude: float
     longitude: float
     include_directions: bool = False
+
+class BatchLocationRequest(BaseModel):
+    locations: List[LocationRequest] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class StationQuery(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    # Attribute name -> value or list of values, e.g. {"LINE": "red"}
+    filters: Dict[str, Union[str, List[str]]] = Field(default_factory=dict)
+    network: Optional[str] = None
+
+class KNearestRequest(StationQuery):
+    k: int = Field(5, ge=1, le=MAX_QUERY_RESULTS)
+
+class RadiusRequest(StationQuery):
+    radius_miles: float = Field(..., gt=0, le=MAX_QUERY_RADIUS_MILES)
+    limit: int = Field(MAX_QUERY_RESULTS, ge=1, le=MAX_QUERY_RESULTS)
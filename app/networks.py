@@ -0,0 +1,328 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from regions import ServiceRegion, RegionResolver
+from snapshot import find_extremes, load_snapshot, station_location, write_snapshot
+from spatial import StationIndex
+from table import StationTable
+from utils import load_kml_data, load_geojson_data, load_outliers
+
+DEFAULT_BUFFER_MILES = 100
+
+# Source loaders by name. Each takes the resolved source path and the network's
+# config entry and returns a list of station dicts.
+LOADERS = {}
+
+
+def register_loader(name):
+    """Register a station loader under a name usable as a network's `loader`."""
+    def decorator(loader):
+        LOADERS[name] = loader
+        return loader
+    return decorator
+
+
+@register_loader('kml')
+def load_kml_network(path, entry):
+    return load_kml_data(path)
+
+
+@register_loader('geojson')
+def load_geojson_network(path, entry):
+    return load_geojson_data(path, entry.get('name_property', 'NAME'))
+
+
+class Network(ServiceRegion):
+    """A transit network: its station index, outermost stations, hull and config metadata."""
+
+    def __init__(self, name, stations, outliers, label=None, buffer_miles=DEFAULT_BUFFER_MILES, metadata=None):
+        super().__init__(name, stations.coordinates, buffer_miles, stations, outliers)
+        self.label = label or name
+        self.metadata = metadata or {}
+        self._table = None
+
+    @property
+    def table(self):
+        """Attribute table for filtered queries, built the first time one reaches this network."""
+        if self._table is None:
+            self._table = StationTable(self.stations.stations)
+        return self._table
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "label": self.label,
+            "stations": len(self.stations.stations),
+            "buffer_miles": self.buffer_miles,
+            "metadata": self.metadata,
+        }
+
+
+class NetworkRegistry(RegionResolver):
+    """Every configured network, routed to through an R-tree over the networks' bounds."""
+
+    def __init__(self, networks, version=None):
+        super().__init__(networks)
+        self.networks = {network.name: network for network in networks}
+        # Dataset version carried in cache keys, see datasets.DatasetManager
+        self.version = version
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def get(self, name):
+        return self.networks.get(name)
+
+    def query_networks(self, location, network=None):
+        """
+        Networks a station query at a location searches.
+
+        Every station within a network's buffer of the location belongs to a
+        network whose bounds contain the location, so radius queries up to the
+        smallest buffer are complete.
+
+        :raises KeyError: If a network name is given and it is not loaded.
+        """
+        if network is not None:
+            return [self.networks[network]]
+        return [self.regions[r] for r in self.candidates(location)]
+
+    def k_nearest(self, location, k, filters=None, network=None, mode=None):
+        """
+        Find the k nearest stations matching attribute filters.
+
+        :return: List of (network, station index, distance in miles), closest first.
+        """
+        found = []
+        for candidate in self.query_networks(location, network):
+            indices, distances = candidate.stations.k_nearest(location, k, mode, candidate.table.mask(filters))
+            found.extend((candidate, int(i), float(d)) for i, d in zip(indices, distances))
+        found.sort(key=lambda item: item[2])
+        return found[:k]
+
+    def within(self, location, radius_miles, filters=None, network=None, mode=None):
+        """
+        Find every station within a radius matching attribute filters.
+
+        :return: List of (network, station index, distance in miles), closest first.
+        """
+        found = []
+        for candidate in self.query_networks(location, network):
+            indices, distances = candidate.stations.within(
+                location, radius_miles, mode, candidate.table.mask(filters)
+            )
+            found.extend((candidate, int(i), float(d)) for i, d in zip(indices, distances))
+        found.sort(key=lambda item: item[2])
+        return found
+
+
+def read_config(path):
+    """
+    Read a networks config file.
+
+    :param path: Path to the JSON config.
+    :return: Tuple of (config dict, directory that relative paths in it resolve against).
+    """
+    with open(path) as f:
+        config = json.load(f)
+    return config, os.path.dirname(os.path.abspath(path))
+
+
+def load_source_stations(entry, base_dir):
+    """Load a network's stations with its configured source loader."""
+    loader = LOADERS.get(entry['loader'])
+    if loader is None:
+        raise ValueError(f"Unknown loader {entry['loader']!r} for network {entry['name']}")
+    return loader(os.path.join(base_dir, entry['path']), entry)
+
+
+def load_network(entry, base_dir, snapshots, fingerprint=None):
+    """
+    Build one network from its config entry.
+
+    Networks found in the config's snapshot, or configured with the `snapshot`
+    loader, reuse the snapshot's memory-mapped stations, coordinates, KD-tree,
+    tile map and outliers; the others are parsed from their source files.
+
+    :param entry: Network config entry.
+    :param base_dir: Directory that relative paths resolve against.
+    :param snapshots: Dict of path to loaded Snapshot (or None), shared between entries.
+    :param fingerprint: config_fingerprint of the config. When given, the
+        config's snapshot is only used if it was built from these sources.
+    """
+    name = entry['name']
+    snapshot_path = entry['path'] if entry['loader'] == 'snapshot' else entry.get('snapshot')
+    compiled = None
+    if snapshot_path:
+        snapshot_path = os.path.join(base_dir, snapshot_path)
+        if snapshot_path not in snapshots:
+            snapshots[snapshot_path] = load_snapshot(snapshot_path)
+        snapshot = snapshots[snapshot_path]
+        if snapshot is not None and entry['loader'] != 'snapshot' and fingerprint is not None \
+                and snapshot.created != fingerprint:
+            logging.warning(
+                f"Snapshot {snapshot_path} was not built from the current sources, loading network {name} "
+                f"from them instead; rerun find_outermost_stations.py to rebuild it"
+            )
+            snapshot = None
+        if snapshot is not None:
+            compiled = snapshot.networks.get(entry.get('network', name))
+
+    if compiled is not None:
+        index = StationIndex(compiled.stations, compiled.tile_map, compiled.coordinates, compiled.kd_tree)
+        outliers = compiled.outliers
+    elif entry['loader'] == 'snapshot':
+        raise ValueError(f"Network {name} is not in snapshot {snapshot_path}")
+    else:
+        stations = load_source_stations(entry, base_dir)
+        index = StationIndex(stations)
+        if entry.get('outliers'):
+            outliers = load_outliers(os.path.join(base_dir, entry['outliers']))
+        else:
+            outliers = {key: station_location(stations[i]) for key, i in find_extremes(stations).items()} if stations else {}
+
+    return Network(
+        name, index, outliers,
+        label=entry.get('label'),
+        buffer_miles=entry.get('buffer_miles', DEFAULT_BUFFER_MILES),
+        metadata=entry.get('metadata'),
+    )
+
+
+def load_registry(path, snapshot=None, fingerprint=None, use_snapshots=True):
+    """
+    Load every network in a networks config file.
+
+    A network that fails to load is logged and left out rather than taking the
+    others down with it. The config's snapshot is only used if it was built
+    from the current sources (see config_fingerprint), so an edited source
+    file is never shadowed by an old snapshot.
+
+    :param path: Path to the JSON config.
+    :param snapshot: Optional compiled snapshot every network is read from
+        instead of its configured source, e.g. one written by compile_registry.
+    :param fingerprint: config_fingerprint(path), if the caller already has it.
+    :param use_snapshots: Set to False to parse every network from its source
+        files, ignoring the config's snapshot.
+    :return: NetworkRegistry.
+    """
+    config, base_dir = read_config(path)
+    if snapshot is None and fingerprint is None and use_snapshots:
+        fingerprint = config_fingerprint(path)
+    snapshots = {}
+    networks = []
+    for entry in config.get('networks', []):
+        entry = dict(entry)
+        if use_snapshots:
+            entry.setdefault('snapshot', config.get('snapshot'))
+        else:
+            entry.pop('snapshot', None)
+        if snapshot is not None:
+            entry.update(loader='snapshot', path=os.path.abspath(snapshot))
+            entry.pop('network', None)
+        try:
+            networks.append(load_network(entry, base_dir, snapshots, fingerprint))
+        except Exception as e:
+            logging.error(f"Failed to load network {entry.get('name')}: {e}")
+    return NetworkRegistry(networks)
+
+
+def config_fingerprint(path):
+    """
+    Hash a networks config together with the contents of every source file it
+    names, so the same data gets the same fingerprint on every checkout and
+    build, and compiled snapshots can tell whether they are stale.
+
+    Snapshots the config names are left out: they are checked against this
+    fingerprint rather than part of it.
+    """
+    config, base_dir = read_config(path)
+    files = []
+    for entry in config.get('networks', []):
+        files.extend([entry.get('path'), entry.get('outliers')])
+
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8'))
+    for name in files:
+        if not name:
+            continue
+        digest.update(f"{name}:".encode('utf-8'))
+        try:
+            with open(os.path.join(base_dir, name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        except OSError:
+            digest.update(b"missing")
+        digest.update(b";")
+    return digest.hexdigest()
+
+
+def compile_registry(path, output, fingerprint=None):
+    """
+    Compile every network in a config into one snapshot, with KD-trees and tile maps.
+
+    The file is written beside the output and renamed over it, so processes
+    that already mapped the old one keep reading it undisturbed. Networks are
+    parsed from their source files rather than the config's snapshot, and
+    outliers are recomputed from the stations, as find_outermost_stations.py does.
+
+    :param path: Path to the JSON config.
+    :param output: Snapshot path to write.
+    :param fingerprint: Build label stored in the snapshot, defaults to config_fingerprint(path).
+    :return: Number of bytes written.
+    """
+    registry = load_registry(path, use_snapshots=False)
+    partial = f"{output}.{os.getpid()}.tmp"
+    try:
+        size = write_snapshot(
+            partial,
+            {network.name: list(network.stations.stations) for network in registry},
+            created=fingerprint or config_fingerprint(path),
+            tile_options={},
+        )
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return size
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on a lock file for the duration of the block."""
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_shared_registry(path, shared_path, fingerprint=None):
+    """
+    Load every network from one compiled snapshot shared by all worker processes.
+
+    The first process to get here (the gunicorn master under --preload, or
+    else the first worker to start) compiles the config into shared_path
+    while the others wait on a lock, then every process memory-maps the same
+    file. Its pages live once in the page cache, so each worker only adds a
+    few arrays of bookkeeping. Put it on a memory-backed filesystem such as
+    /dev/shm. It is recompiled when the config or a file it names changes.
+
+    :param path: Path to the JSON config.
+    :param shared_path: Path of the shared snapshot.
+    :param fingerprint: config_fingerprint(path), if the caller already has it.
+    :return: NetworkRegistry.
+    """
+    fingerprint = fingerprint or config_fingerprint(path)
+    with file_lock(f"{shared_path}.lock"):
+        snapshot = load_snapshot(shared_path)
+        if snapshot is None or snapshot.created != fingerprint:
+            size = compile_registry(path, shared_path, fingerprint)
+            logging.info(f"Compiled networks into shared snapshot {shared_path} ({size} bytes)")
+    return load_registry(path, snapshot=shared_path)
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dotenv import load_dotenv
+from starlette.datastructures import Headers
+from metrics import request_timings
+import security
+
+load_dotenv()
+
+# Who gets a Server-Timing header: "off", "admin" (requests made with an admin API key) or "all"
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'admin').lower()
+# Longest profile an admin can ask for, in seconds
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+
+# Leaf frames of a thread that is waiting rather than working: the event loop
+# polling for I/O, or a worker thread parked on a lock
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait")}
+
+
+def server_timing_header(timings, total):
+    """
+    Format request stage timings as a Server-Timing header value.
+
+    Repeated stages are summed and listed in the order they first ran; durations are in milliseconds.
+
+    :param timings: List of (stage, seconds).
+    :param total: Seconds the whole request took.
+    """
+    durations = {}
+    for stage, seconds in timings:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in durations.items())
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding a Server-Timing header with the request's stage timings.
+
+    Stages are the ones timed with metrics.stage(). Only requests allowed by
+    SERVER_TIMING are timed; for the rest this is a single check.
+    """
+
+    def __init__(self, app, mode=None):
+        self.app = app
+        self.mode = mode
+
+    def enabled(self, scope):
+        mode = self.mode or SERVER_TIMING
+        if mode == "all":
+            return True
+        if mode == "admin" and security.ADMIN_API_KEYS:
+            return Headers(scope=scope).get("x-api-key") in security.ADMIN_API_KEYS
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                header = server_timing_header(timings, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread in the process at a fixed interval.
+
+    Runs in its own thread only while a profile is being taken, so it costs
+    nothing otherwise. Stacks are counted in the collapsed format read by
+    flamegraph.pl and speedscope: one `root;...;leaf count` line per stack.
+    """
+
+    def __init__(self, interval=0.005, include_idle=False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.sample(names.get(thread_id, str(thread_id)), frame)
+            self.samples += 1
+
+    def sample(self, thread_name, frame):
+        code = frame.f_code
+        if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+            return
+        labels = []
+        while frame is not None:
+            labels.append(frame_label(frame))
+            frame = frame.f_back
+        labels.append(thread_name)
+        self.stacks[";".join(reversed(labels))] += 1
+
+    def collapsed(self):
+        """Return the counted stacks in the collapsed-stack format, most frequent first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+_profile_lock = threading.Lock()
+
+
+async def profile(seconds, interval=0.005, include_idle=False):
+    """
+    Profile the process for `seconds` while it keeps serving requests.
+
+    :return: The SamplingProfiler, with its stacks and sample count.
+    :raises ProfilerBusy: If a profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        profiler = SamplingProfiler(interval, include_idle)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+        return profiler
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,189 @@
+import math
+import numpy as np
+from distance import CoordinateArray, EARTH_RADIUS_MILES, haversine_miles
+from rtree import RTree
+
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * math.pi / 180
+
+
+def convex_hull(points):
+    """
+    Return the convex hull of 2D points in counter-clockwise order (monotone chain).
+
+    :param points: Iterable of (x, y) tuples.
+    :return: List of hull vertices without repeating the first one.
+    """
+    points = sorted(set(points))
+    if len(points) <= 2:
+        return points
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+class ServiceRegion:
+    """
+    A network's convex hull, buffered by `buffer_miles`.
+
+    The hull is built in an equirectangular projection centred on the network,
+    which is accurate to well under a percent across a metro area. Distances
+    from outside the hull are measured on the sphere to the nearest hull point.
+    """
+
+    def __init__(self, name, coordinates, buffer_miles=100, stations=None, outliers=None):
+        self.name = name
+        self.buffer_miles = buffer_miles
+        self.stations = stations
+        self.outliers = outliers
+
+        coordinates = coordinates if isinstance(coordinates, CoordinateArray) else CoordinateArray.from_stations(coordinates)
+        self.empty = not len(coordinates)
+        if self.empty:
+            # A network that failed to load is infinitely far from everything
+            coordinates = CoordinateArray([0.0], [0.0])
+        self.lat0 = float(coordinates.latitudes.mean())
+        self.lon0 = float(coordinates.longitudes.mean())
+        self.cos_lat0 = math.cos(math.radians(self.lat0))
+
+        x, y = self.project(coordinates.latitudes, coordinates.longitudes)
+        hull = convex_hull(zip(x.tolist(), y.tolist()))
+        # Closed ring: vertex i to vertex i + 1 is an edge
+        self.hull_x = np.array([p[0] for p in hull] + [hull[0][0]])
+        self.hull_y = np.array([p[1] for p in hull] + [hull[0][1]])
+
+        # Bounding box of everything within the buffer, for the region R-tree
+        lat_pad = buffer_miles / MILES_PER_DEGREE
+        self.south = float(coordinates.latitudes.min()) - lat_pad
+        self.north = float(coordinates.latitudes.max()) + lat_pad
+        widest = math.cos(math.radians(min(max(abs(self.south), abs(self.north)), 89.0)))
+        lon_pad = buffer_miles / (MILES_PER_DEGREE * widest)
+        self.west = float(coordinates.longitudes.min()) - lon_pad
+        self.east = float(coordinates.longitudes.max()) + lon_pad
+
+    def project(self, latitudes, longitudes):
+        x = (np.asarray(longitudes, dtype=np.float64) - self.lon0) * self.cos_lat0 * MILES_PER_DEGREE
+        y = (np.asarray(latitudes, dtype=np.float64) - self.lat0) * MILES_PER_DEGREE
+        return x, y
+
+    def unproject(self, x, y):
+        return self.lat0 + y / MILES_PER_DEGREE, self.lon0 + x / (self.cos_lat0 * MILES_PER_DEGREE)
+
+    @property
+    def bounds(self):
+        """Bounding box of everything within the buffer, as (south, west, north, east)."""
+        return (self.south, self.west, self.north, self.east)
+
+    def distances_miles(self, latitudes, longitudes):
+        """
+        Distances in miles from locations to the hull, 0 for locations inside it.
+
+        :param latitudes: Array of latitudes.
+        :param longitudes: Array of longitudes, same shape.
+        :return: Array of distances.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if self.empty:
+            return np.full(len(latitudes), np.inf)
+        x, y = self.project(latitudes, longitudes)
+        x, y = x[:, np.newaxis], y[:, np.newaxis]
+
+        ax, ay = self.hull_x[:-1], self.hull_y[:-1]
+        ex, ey = self.hull_x[1:] - ax, self.hull_y[1:] - ay
+        px, py = x - ax, y - ay
+
+        # Closest point on every edge, then the closest edge
+        lengths = ex * ex + ey * ey
+        t = np.clip((px * ex + py * ey) / np.where(lengths > 0, lengths, 1.0), 0.0, 1.0)
+        cx, cy = ax + t * ex, ay + t * ey
+        nearest = ((x - cx) ** 2 + (y - cy) ** 2).argmin(axis=1)
+        rows = np.arange(len(latitudes))
+        hull_lats, hull_lons = self.unproject(cx[rows, nearest], cy[rows, nearest])
+        distances = haversine_miles((latitudes, longitudes), hull_lats, hull_lons)
+
+        # Counter-clockwise hull: inside means left of (or on) every edge
+        if len(ax) >= 3:
+            inside = np.all(ex * py - ey * px >= 0, axis=1)
+            distances = np.where(inside, 0.0, distances)
+        return distances
+
+
+class RegionResolver:
+    """
+    Assigns locations to the closest service region and flags those beyond every region's buffer.
+
+    Regions are found through an R-tree over their buffered bounding boxes, so
+    only the few regions near a location are measured no matter how many are loaded.
+    """
+
+    def __init__(self, regions):
+        self.regions = list(regions)
+        self._indexed = [r for r, region in enumerate(self.regions) if not region.empty]
+        self.tree = RTree([self.regions[r].bounds for r in self._indexed])
+
+    def candidates(self, location):
+        """Positions of the regions whose buffer may contain the location, or the single closest one."""
+        found = self.tree.query_point(location[0], location[1])
+        if not found:
+            nearest = self.tree.nearest(location[0], location[1])
+            found = [] if nearest is None else [nearest]
+        return [self._indexed[i] for i in found]
+
+    def resolve(self, location):
+        """
+        :param location: Tuple of (latitude, longitude).
+        :return: Tuple (region, is_distant, distance_miles).
+        """
+        return self.resolve_many([location])[0]
+
+    def resolve_many(self, locations):
+        """
+        Resolve many locations in one vectorized pass per candidate region.
+
+        Locations outside every region's bounding box are beyond every buffer;
+        they are measured against the region with the closest box so the
+        closest one can still be reported.
+
+        :param locations: List of (latitude, longitude) tuples.
+        :return: List of (region, is_distant, distance_miles) tuples, one per location;
+            region is None when no region has stations.
+        """
+        if not locations:
+            return []
+
+        latitudes = np.array([location[0] for location in locations], dtype=np.float64)
+        longitudes = np.array([location[1] for location in locations], dtype=np.float64)
+        selected = {}
+        for i, location in enumerate(locations):
+            for r in self.candidates(location):
+                selected.setdefault(r, []).append(i)
+
+        best_distances = np.full(len(locations), np.inf)
+        best_regions = np.zeros(len(locations), dtype=np.intp)
+        for r in sorted(selected):
+            points = np.array(selected[r])
+            distances = self.regions[r].distances_miles(latitudes[points], longitudes[points])
+            closer = distances < best_distances[points]
+            best_distances[points[closer]] = distances[closer]
+            best_regions[points[closer]] = r
+
+        results = []
+        for r, distance in zip(best_regions, best_distances):
+            if not np.isfinite(distance):
+                # No region has any stations
+                results.append((None, True, float(distance)))
+                continue
+            region = self.regions[r]
+            results.append((region, bool(distance > region.buffer_miles), float(distance)))
+        return results
@@ -0,0 +1,50 @@
+import orjson
+from fastapi.responses import Response
+
+# Cached nearest-station bodies are serialized with directions last, so
+# directions can be spliced in without parsing the body again
+NULL_DIRECTIONS = b'"directions":null}'
+
+TOO_FAR_FOR_DIRECTIONS = "Location is too far away for directions"
+
+
+class JSONBytesResponse(Response):
+    """Response for a body that is already serialized JSON."""
+    media_type = "application/json"
+
+
+def dumps(data):
+    return orjson.dumps(data)
+
+
+def nearest_station_body(nearest_station, directions=None):
+    """Serialize a nearest-station response body."""
+    return orjson.dumps({
+        "status": "success",
+        "nearest_station": nearest_station,
+        "directions": directions
+    })
+
+
+def distant_body(outlier):
+    """Serialize the response body for a location outside every service area."""
+    return nearest_station_body(outlier, TOO_FAR_FOR_DIRECTIONS)
+
+
+def with_directions(body, directions):
+    """Splice serialized directions into a body built by nearest_station_body(..., None)."""
+    return body[:-len(NULL_DIRECTIONS)] + b'"directions":' + directions + b'}'
+
+
+def nearest_station_from_body(body):
+    return orjson.loads(body)["nearest_station"]
+
+
+def feature_collection_body(features, **members):
+    """Serialize a GeoJSON FeatureCollection, with optional foreign members such as `truncated`."""
+    return orjson.dumps({"type": "FeatureCollection", "features": features, **members})
+
+
+def batch_body(items):
+    """Join serialized per-item bodies into a batch response body."""
+    return b'{"status":"success","results":[' + b','.join(items) + b']}'
@@ -0,0 +1,88 @@
+import heapq
+import math
+import numpy as np
+
+
+class RTree:
+    """
+    Static R-tree over latitude/longitude boxes, bulk-loaded with Sort-Tile-Recursive.
+
+    Boxes are (south, west, north, east) tuples; query results are box positions.
+    """
+
+    def __init__(self, boxes, node_size=8):
+        self.node_size = node_size
+        self.count = len(boxes)
+        # levels[0] holds the boxes themselves; each higher level holds one
+        # bounding box per node and the [start, end) range of its children
+        bounds = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        order = self._sort_tile(bounds)
+        self.ids = order
+        self.levels = [(bounds[order], None)]
+        while len(self.levels[-1][0]) > 1:
+            self.levels.append(self._pack(self.levels[-1][0]))
+
+    def _sort_tile(self, bounds):
+        """Order boxes into vertical slices by longitude, then by latitude inside each slice."""
+        if not len(bounds):
+            return np.zeros(0, dtype=np.intp)
+        centres_lat = (bounds[:, 0] + bounds[:, 2]) / 2
+        centres_lon = (bounds[:, 1] + bounds[:, 3]) / 2
+        leaves = math.ceil(len(bounds) / self.node_size)
+        slice_size = self.node_size * math.ceil(math.sqrt(leaves))
+        by_lon = np.argsort(centres_lon, kind='stable')
+        slices = [by_lon[i:i + slice_size] for i in range(0, len(by_lon), slice_size)]
+        return np.concatenate([s[np.argsort(centres_lat[s], kind='stable')] for s in slices])
+
+    def _pack(self, bounds):
+        starts = np.arange(0, len(bounds), self.node_size)
+        ends = np.minimum(starts + self.node_size, len(bounds))
+        parents = np.array([
+            [bounds[s:e, 0].min(), bounds[s:e, 1].min(), bounds[s:e, 2].max(), bounds[s:e, 3].max()]
+            for s, e in zip(starts, ends)
+        ])
+        return parents, np.stack([starts, ends], axis=1)
+
+    def __len__(self):
+        return self.count
+
+    def query_point(self, latitude, longitude):
+        """Return the positions of every box containing the point."""
+        if not self.count:
+            return []
+        found = []
+        stack = [(len(self.levels) - 1, 0)]
+        while stack:
+            level, node = stack.pop()
+            south, west, north, east = self.levels[level][0][node]
+            if not (south <= latitude <= north and west <= longitude <= east):
+                continue
+            if level == 0:
+                found.append(int(self.ids[node]))
+            else:
+                start, end = self.levels[level][1][node]
+                stack.extend((level - 1, child) for child in range(start, end))
+        return found
+
+    @staticmethod
+    def _box_distance(box, latitude, longitude):
+        """Approximate miles from a point to a box, a lower bound good enough for ranking."""
+        south, west, north, east = box
+        dlat = max(south - latitude, 0.0, latitude - north)
+        dlon = max(west - longitude, 0.0, longitude - east)
+        return 69.05 * math.hypot(dlat, dlon * math.cos(math.radians(latitude)))
+
+    def nearest(self, latitude, longitude):
+        """Return the position of the box closest to the point, or None if the tree is empty."""
+        if not self.count:
+            return None
+        top = len(self.levels) - 1
+        heap = [(0.0, top, 0)]
+        while heap:
+            _, level, node = heapq.heappop(heap)
+            if level == 0:
+                return int(self.ids[node])
+            bounds, children = self.levels[level - 1][0], self.levels[level][1][node]
+            for child in range(*children):
+                heapq.heappush(heap, (self._box_distance(bounds[child], latitude, longitude), level - 1, child))
+        return None
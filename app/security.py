@@ -1,18 +1,56 @@
 from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
 import os
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()
+
+SECURITY_HEADERS = [
+    (b"content-security-policy", b"default-src 'self'; script-src 'self'; style-src 'self';"),
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+]
+SECURITY_HEADER_NAMES = {name for name, _ in SECURITY_HEADERS}
+
+
+class SecurityHeadersMiddleware:
+    """ASGI middleware adding the security headers to every HTTP response as it starts."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = [
+                    (name, value) for name, value in message.get("headers", [])
+                    if name.lower() not in SECURITY_HEADER_NAMES
+                ]
+                message["headers"] = headers + SECURITY_HEADERS
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+def parse_api_keys(value):
+    """Parse a comma-separated list of API keys into a set, ignoring blanks."""
+    return frozenset(key.strip() for key in (value or '').split(',') if key.strip())
+
+
+# Parsed once at startup rather than on every request
+VALID_API_KEYS = parse_api_keys(os.getenv('VALID_API_KEYS'))
+ADMIN_API_KEYS = parse_api_keys(os.getenv('ADMIN_API_KEYS'))
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        response.headers["Content-Security-Policy"] = "default-src 'self'; script-src 'self'; style-src 'self';"
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        return response
 
 def authenticate(request: Request):
-    valid_api_keys = os.getenv('VALID_API_KEYS', '').split(',')
-    api_key = request.headers.get('X-API-KEY')
-    if api_key not in valid_api_keys:
-        raise HTTPException(status_code=401, detail="Unauthorized: Invalid API Key")
+    with metrics.stage("auth"):
+        if request.headers.get('X-API-KEY') not in VALID_API_KEYS:
+            raise HTTPException(status_code=401, detail="Unauthorized: Invalid API Key")
+
+def authenticate_admin(request: Request):
+    if request.headers.get('X-API-KEY') not in ADMIN_API_KEYS:
+        raise HTTPException(status_code=403, detail="Forbidden: Admin API Key required")
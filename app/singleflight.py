@@ -0,0 +1,37 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one in-flight task.
+
+    Callers that arrive while a call is running await the same result instead of
+    starting their own. A caller that is cancelled does not cancel the shared
+    work for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, fn, *args):
+        """
+        Run `await fn(*args)` once per key at a time and share its result.
+
+        :param key: Hashable key identifying the work.
+        :param fn: Coroutine function to run.
+        :return: The result of fn, shared across concurrent callers.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
@@ -0,0 +1,260 @@
+import json
+import logging
+import struct
+from collections.abc import Sequence
+import numpy as np
+from distance import CoordinateArray
+from spatial import build_kd_tree
+from tiles import MAX_STATIONS, TileMap, compute_tile_map, coordinates_checksum
+
+# File layout: MAGIC, a HEADER with the table of contents length, the table of
+# contents as JSON, then 8-byte aligned binary sections. Offsets in the table
+# of contents are relative to the start of the file.
+SNAPSHOT_MAGIC = b'NSSNAP01'
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct('<8sII')
+ALIGNMENT = 8
+
+OUTLIER_EXTREMES = {
+    "northernmost": ('latitude', max),
+    "southernmost": ('latitude', min),
+    "easternmost": ('longitude', max),
+    "westernmost": ('longitude', min),
+}
+
+
+def find_extremes(stations):
+    """Return the positions of the northernmost, southernmost, easternmost and westernmost stations."""
+    positions = range(len(stations))
+    return {
+        key: pick(positions, key=lambda i: stations[i][field])
+        for key, (field, pick) in OUTLIER_EXTREMES.items()
+    }
+
+
+def station_location(station):
+    """Return a station's name and coordinates without its other attributes, as stored for outliers."""
+    return {"name": station["name"], "longitude": station["longitude"], "latitude": station["latitude"]}
+
+
+def offsets_for(encoded):
+    """Return the uint32 start offsets (plus the end) of byte strings stored back to back."""
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return offsets
+
+
+class SnapshotStations(Sequence):
+    """
+    A network's stations as a read-only sequence of station dicts, decoded
+    from the memory map on access so that no per-process copy is kept.
+    """
+
+    def __init__(self, network):
+        self._network = network
+
+    def __len__(self):
+        return len(self._network)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._network.station(j) for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("station index out of range")
+        return self._network.station(i)
+
+
+class NetworkSnapshot:
+    """One network's stations, extremes, tile map and KD-tree, backed by the snapshot's memory map."""
+
+    def __init__(self, name, coordinates, name_offsets, name_blob, extremes, tile_map,
+                 property_offsets=None, property_blob=None, kd_tree=None):
+        self.name = name
+        self.coordinates = coordinates
+        self._name_offsets = name_offsets
+        self._name_blob = name_blob
+        self._property_offsets = property_offsets
+        self._property_blob = property_blob
+        self.extremes = extremes
+        self.tile_map = tile_map
+        self.kd_tree = kd_tree
+        self.stations = SnapshotStations(self)
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def station_name(self, i):
+        start, end = self._name_offsets[i], self._name_offsets[i + 1]
+        return bytes(self._name_blob[start:end]).decode('utf-8')
+
+    def station_properties(self, i):
+        start, end = self._property_offsets[i], self._property_offsets[i + 1]
+        return json.loads(bytes(self._property_blob[start:end]).decode('utf-8'))
+
+    def station(self, i):
+        station = {
+            "name": self.station_name(i),
+            "longitude": float(self.coordinates.longitudes[i]),
+            "latitude": float(self.coordinates.latitudes[i]),
+        }
+        if self._property_offsets is not None:
+            station["properties"] = self.station_properties(i)
+        return station
+
+    @property
+    def outliers(self):
+        """Outlier stations in the same shape as the *_outermost_stations.json files."""
+        return {key: station_location(self.station(i)) for key, i in self.extremes.items()}
+
+
+class Snapshot:
+    def __init__(self, path, version, created, networks):
+        self.path = path
+        self.version = version
+        self.created = created
+        self.networks = networks
+
+
+def write_snapshot(path, networks, created=None, tile_options=None):
+    """
+    Compile station networks into a single versioned snapshot file.
+
+    :param path: Output file path.
+    :param networks: Dict of network name to a list of station dicts, in load order.
+    :param created: Optional build label stored in the table of contents.
+    :param tile_options: Keyword arguments for compute_tile_map, or None to skip tile maps.
+    :return: Number of bytes written.
+    """
+    sections = []
+    toc = {"version": SNAPSHOT_VERSION, "created": created, "networks": {}}
+
+    for name, stations in networks.items():
+        coordinates = CoordinateArray.from_stations(stations)
+        encoded_names = [station['name'].encode('utf-8') for station in stations]
+        name_offsets = offsets_for(encoded_names)
+
+        entry = {
+            "count": len(stations),
+            "checksum": coordinates_checksum(coordinates),
+            "extremes": find_extremes(stations) if stations else {},
+            "sections": {},
+        }
+        arrays = {
+            "latitudes": coordinates.latitudes,
+            "longitudes": coordinates.longitudes,
+            "name_offsets": name_offsets,
+            "names": np.frombuffer(b''.join(encoded_names), dtype=np.uint8),
+        }
+        arrays["kd_order"], kd_vectors = build_kd_tree(coordinates)
+        arrays["kd_vectors"] = kd_vectors.reshape(-1)
+        if any('properties' in station for station in stations):
+            encoded_properties = [
+                json.dumps(station.get('properties', {}), separators=(',', ':')).encode('utf-8')
+                for station in stations
+            ]
+            arrays["property_offsets"] = offsets_for(encoded_properties)
+            arrays["properties"] = np.frombuffer(b''.join(encoded_properties), dtype=np.uint8)
+        if tile_options is not None and len(stations) > MAX_STATIONS:
+            # Tile candidates are stored as uint16; the KD-tree alone serves bigger networks
+            logging.warning(f"Network {name} has {len(stations)} stations, more than the {MAX_STATIONS} "
+                            f"a tile map can index, so it is compiled without one")
+        elif tile_options is not None and stations:
+            tile_map = compute_tile_map(stations, **tile_options)
+            entry["tiles"] = list(tile_map.params())
+            arrays["tile_offsets"] = tile_map.offsets
+            arrays["tile_indices"] = tile_map.indices
+
+        for section, array in arrays.items():
+            entry["sections"][section] = [len(sections), str(array.dtype), len(array)]
+            sections.append(np.ascontiguousarray(array))
+        toc["networks"][name] = entry
+
+    # Offsets depend on the table of contents length, so lay it out once with
+    # placeholders and then fill in the real offsets
+    def layout(toc_length):
+        offset = HEADER.size + toc_length
+        offsets = []
+        for array in sections:
+            offset += -offset % ALIGNMENT
+            offsets.append(offset)
+            offset += array.nbytes
+        return offsets
+
+    def render(offsets):
+        rendered = json.loads(json.dumps(toc))
+        for entry in rendered["networks"].values():
+            for section in entry["sections"].values():
+                section[0] = offsets[section[0]]
+        return json.dumps(rendered, separators=(',', ':')).encode('utf-8')
+
+    toc_bytes = render(layout(0))
+    while True:
+        offsets = layout(len(toc_bytes))
+        rendered = render(offsets)
+        if len(rendered) == len(toc_bytes):
+            toc_bytes = rendered
+            break
+        toc_bytes = rendered
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(toc_bytes)))
+        f.write(toc_bytes)
+        for offset, array in zip(offsets, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(array.tobytes())
+        return f.tell()
+
+
+def open_snapshot(path):
+    """
+    Memory-map a snapshot written by write_snapshot.
+
+    :raises ValueError: If the file is not a snapshot of a supported version.
+    """
+    with open(path, 'rb') as f:
+        magic, version, toc_length = HEADER.unpack(f.read(HEADER.size))
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} station snapshot")
+        toc = json.loads(f.read(toc_length).decode('utf-8'))
+
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def section(entry, name):
+        offset, dtype, length = entry["sections"][name]
+        dtype = np.dtype(dtype)
+        return data[offset:offset + dtype.itemsize * length].view(dtype)
+
+    networks = {}
+    for name, entry in toc["networks"].items():
+        coordinates = CoordinateArray(section(entry, "latitudes"), section(entry, "longitudes"))
+        tile_map = None
+        if "tiles" in entry:
+            tile_map = TileMap(
+                *entry["tiles"], section(entry, "tile_offsets"), section(entry, "tile_indices")
+            )
+        properties = (
+            (section(entry, "property_offsets"), section(entry, "properties"))
+            if "properties" in entry["sections"] else (None, None)
+        )
+        kd_tree = None
+        if "kd_order" in entry["sections"]:
+            kd_tree = (section(entry, "kd_order"), section(entry, "kd_vectors").reshape(-1, 3))
+        networks[name] = NetworkSnapshot(
+            name, coordinates, section(entry, "name_offsets"), section(entry, "names"),
+            entry["extremes"], tile_map, *properties, kd_tree=kd_tree
+        )
+    return Snapshot(path, version, toc.get("created"), networks)
+
+
+def load_snapshot(path):
+    """Load a station snapshot, or return None if it is missing or unreadable."""
+    try:
+        return open_snapshot(path)
+    except FileNotFoundError:
+        logging.info(f"No station snapshot at {path}, parsing the source files instead.")
+    except Exception as e:
+        logging.error(f"Error loading station snapshot at {path}: {e}")
+    return None
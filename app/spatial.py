@@ -0,0 +1,308 @@
+import heapq
+import math
+import numpy as np
+from distance import CoordinateArray, EARTH_RADIUS_MILES, distances_miles
+
+# Geodesic (ellipsoidal) and great-circle distances differ by less than 0.5%,
+# so every station that could beat the best chord match lies within this
+# margin of it on the sphere.
+SPHERE_ERROR_MARGIN = 1.01
+
+
+def to_unit_vector(latitude, longitude):
+    """Convert a latitude/longitude pair in degrees to a 3D unit vector."""
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+
+def chord_for_miles(miles):
+    """Return the unit-sphere chord length spanning a great-circle distance in miles."""
+    theta = min(miles / EARTH_RADIUS_MILES, math.pi)
+    return 2.0 * math.sin(theta / 2.0)
+
+
+def unit_vectors(coordinates):
+    """Convert a CoordinateArray to an (n, 3) array of unit vectors, matching to_unit_vector."""
+    return np.array(
+        [to_unit_vector(latitude, longitude)
+         for latitude, longitude in zip(coordinates.latitudes.tolist(), coordinates.longitudes.tolist())],
+        dtype=np.float64,
+    ).reshape(-1, 3)
+
+
+def build_kd_tree(coordinates):
+    """
+    Lay a balanced KD-tree over the stations' unit vectors out as flat arrays.
+
+    The tree is implicit: the node for the range [lo, hi) of the arrays is at
+    its midpoint, its children are the ranges on either side, and it splits on
+    axis depth % 3. Being plain arrays, the tree can be stored in a snapshot
+    and memory-mapped by every worker instead of rebuilt in each one.
+
+    :param coordinates: CoordinateArray of the stations.
+    :return: Tuple of (order, vectors): the station index of each node as
+        uint32, and the node unit vectors as a float64 (n, 3) array.
+    """
+    vectors = unit_vectors(coordinates)
+    points = vectors.tolist()
+    order = list(range(len(points)))
+    stack = [(0, len(order), 0)]
+    while stack:
+        lo, hi, axis = stack.pop()
+        if hi - lo <= 1:
+            continue
+        order[lo:hi] = sorted(order[lo:hi], key=lambda i: points[i][axis])
+        mid = (lo + hi) // 2
+        stack.append((lo, mid, (axis + 1) % 3))
+        stack.append((mid + 1, hi, (axis + 1) % 3))
+    order = np.array(order, dtype=np.uint32)
+    return order, vectors[order]
+
+
+class StationIndex:
+    """
+    KD-tree over stations projected onto the unit sphere.
+
+    Chord distance between unit vectors is monotonic in great-circle distance,
+    so the tree narrows a lookup down to a handful of candidates which are then
+    ranked in one vectorized distance call. An optional precomputed TileMap
+    answers lookups inside its area with a tile read and a tiny refinement.
+    """
+
+    def __init__(self, stations, tile_map=None, coordinates=None, kd_tree=None):
+        self.stations = stations
+        self.coordinates = coordinates if coordinates is not None else CoordinateArray.from_stations(stations)
+        self.tile_map = tile_map
+        order, vectors = kd_tree if kd_tree is not None else build_kd_tree(self.coordinates)
+        self.kd_tree = (order, vectors)
+        # Traversal reads single elements, which memoryviews return as plain
+        # Python numbers far faster than numpy scalar indexing
+        self._order = memoryview(np.ascontiguousarray(order, dtype=np.uint32))
+        self._vectors = memoryview(np.ascontiguousarray(vectors, dtype=np.float64).reshape(-1))
+        self.size = len(self._order)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _nearest_chord(self, target):
+        """Return the index of the station with the smallest chord distance to target."""
+        order, vectors = self._order, self._vectors
+        best_distance, best_index = float('inf'), None
+        stack = [(0, self.size, 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            base = 3 * mid
+            dx = target[0] - vectors[base]
+            dy = target[1] - vectors[base + 1]
+            dz = target[2] - vectors[base + 2]
+            distance = dx * dx + dy * dy + dz * dz
+            index = order[mid]
+            if distance < best_distance or (distance == best_distance and index < best_index):
+                best_distance, best_index = distance, index
+            diff = target[axis] - vectors[base + axis]
+            child = (axis + 1) % 3
+            near, far = ((lo, mid, child), (mid + 1, hi, child)) if diff < 0 else ((mid + 1, hi, child), (lo, mid, child))
+            if diff * diff <= best_distance:
+                stack.append(far)
+            stack.append(near)
+        return best_index
+
+    def _within_chord(self, target, radius):
+        """Return the indices of all stations within the given chord radius of target."""
+        order, vectors = self._order, self._vectors
+        limit = radius * radius + 1e-12
+        found = []
+        stack = [(0, self.size, 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            base = 3 * mid
+            dx = target[0] - vectors[base]
+            dy = target[1] - vectors[base + 1]
+            dz = target[2] - vectors[base + 2]
+            if dx * dx + dy * dy + dz * dz <= limit:
+                found.append(order[mid])
+            diff = target[axis] - vectors[base + axis]
+            child = (axis + 1) % 3
+            if diff < 0 or diff * diff <= limit:
+                stack.append((lo, mid, child))
+            if diff >= 0 or diff * diff <= limit:
+                stack.append((mid + 1, hi, child))
+        return found
+
+    def _k_nearest_chord(self, target, k, mask=None):
+        """Return the indices of the k stations with the smallest chord distance to target, among those in mask."""
+        order, vectors = self._order, self._vectors
+        # Max-heap of the best k as (-distance, -index), so ties keep the lower index
+        best = []
+        stack = [(0, self.size, 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            base = 3 * mid
+            index = order[mid]
+            if mask is None or mask[index]:
+                dx = target[0] - vectors[base]
+                dy = target[1] - vectors[base + 1]
+                dz = target[2] - vectors[base + 2]
+                item = (-(dx * dx + dy * dy + dz * dz), -index)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+            diff = target[axis] - vectors[base + axis]
+            child = (axis + 1) % 3
+            near, far = ((lo, mid, child), (mid + 1, hi, child)) if diff < 0 else ((mid + 1, hi, child), (lo, mid, child))
+            if len(best) < k or diff * diff <= -best[0][0]:
+                stack.append(far)
+            stack.append(near)
+        return [-index for _, index in best]
+
+    def _candidates_within(self, target, miles, mask):
+        candidates = np.array(
+            sorted(self._within_chord(target, chord_for_miles(miles * SPHERE_ERROR_MARGIN))),
+            dtype=np.intp,
+        )
+        return candidates if mask is None else candidates[mask[candidates]]
+
+    def k_nearest(self, location, k, mode=None, mask=None):
+        """
+        Find the k stations nearest to a location.
+
+        :param location: Tuple (latitude, longitude) of the location.
+        :param k: Number of stations to return.
+        :param mode: Distance mode passed to distances_miles.
+        :param mask: Optional boolean array; only stations where it is True are considered.
+        :return: Tuple of (indices, distances in miles) arrays, closest first.
+        """
+        if not self.size or k <= 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+
+        target = to_unit_vector(location[0], location[1])
+        seeds = self._k_nearest_chord(target, k, mask)
+        if not seeds:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+        # Every true top-k station is within the farthest chord seed's distance
+        bound = distances_miles(location, self.coordinates.take(seeds), mode).max()
+        indices, distances = self._rank(location, self._candidates_within(target, bound, mask), mode)
+        return indices[:k], distances[:k]
+
+    def within(self, location, radius_miles, mode=None, mask=None):
+        """
+        Find every station within a radius of a location.
+
+        :param location: Tuple (latitude, longitude) of the location.
+        :param radius_miles: Search radius in miles.
+        :param mode: Distance mode passed to distances_miles.
+        :param mask: Optional boolean array; only stations where it is True are considered.
+        :return: Tuple of (indices, distances in miles) arrays, closest first.
+        """
+        if not self.size:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+
+        target = to_unit_vector(location[0], location[1])
+        indices, distances = self._rank(
+            location, self._candidates_within(target, radius_miles, mask), mode
+        )
+        inside = distances <= radius_miles
+        return indices[inside], distances[inside]
+
+    def _rank(self, location, candidates, mode):
+        """Sort candidate indices (in ascending order) by distance, ties by index."""
+        distances = distances_miles(location, self.coordinates.take(candidates), mode)
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest(self, location, mode=None):
+        """
+        Find the station nearest to a location.
+
+        Ties are broken by load order, matching a linear scan over the stations.
+
+        :param location: Tuple (latitude, longitude) of the location.
+        :param mode: Distance mode passed to distances_miles.
+        :return: Tuple of (station, distance in miles), or (None, inf) if the index is empty.
+        """
+        if not self.size:
+            return None, float('inf')
+
+        if self.tile_map is not None:
+            candidates = self.tile_map.lookup(location)
+            if candidates is not None:
+                return self._closest(location, candidates, mode)
+
+        target = to_unit_vector(location[0], location[1])
+        best = self._nearest_chord(target)
+        bound = distances_miles(location, self.coordinates.take([best]), mode)[0]
+        candidates = np.array(
+            sorted(self._within_chord(target, chord_for_miles(bound * SPHERE_ERROR_MARGIN))),
+            dtype=np.intp,
+        )
+        return self._closest(location, candidates, mode)
+
+    def nearest_many(self, locations, mode=None):
+        """
+        Find the station nearest to each of many locations.
+
+        Gives the same answers as calling nearest() for each location, but the
+        distance calls of every stage are made once for the whole batch.
+
+        :param locations: List of (latitude, longitude) tuples.
+        :param mode: Distance mode passed to distances_miles.
+        :return: List of (station, distance in miles) tuples, or (None, inf) if the index is empty.
+        """
+        if not self.size or not locations:
+            return [(None, float('inf'))] * len(locations)
+
+        latitudes = np.array([location[0] for location in locations], dtype=np.float64)
+        longitudes = np.array([location[1] for location in locations], dtype=np.float64)
+        candidates = [None] * len(locations)
+        pending = []
+        for i, location in enumerate(locations):
+            if self.tile_map is not None:
+                candidates[i] = self.tile_map.lookup(location)
+                if candidates[i] is not None:
+                    continue
+            target = to_unit_vector(location[0], location[1])
+            pending.append((i, target, self._nearest_chord(target)))
+
+        if pending:
+            rows = np.array([i for i, _, _ in pending], dtype=np.intp)
+            bounds = distances_miles(
+                (latitudes[rows], longitudes[rows]),
+                self.coordinates.take(np.array([best for _, _, best in pending], dtype=np.intp)),
+                mode,
+            )
+            for (i, target, _), bound in zip(pending, bounds):
+                candidates[i] = np.array(
+                    sorted(self._within_chord(target, chord_for_miles(bound * SPHERE_ERROR_MARGIN))),
+                    dtype=np.intp,
+                )
+
+        counts = np.array([len(c) for c in candidates])
+        rows = np.repeat(np.arange(len(locations)), counts)
+        flat = np.concatenate(candidates)
+        distances = distances_miles((latitudes[rows], longitudes[rows]), self.coordinates.take(flat), mode)
+
+        results = []
+        start = 0
+        for count in counts:
+            closest = start + int(np.argmin(distances[start:start + count]))
+            results.append((self.stations[flat[closest]], float(distances[closest])))
+            start += count
+        return results
+
+    def _closest(self, location, candidates, mode):
+        """Rank candidate indices (in ascending order) by distance and return the closest."""
+        distances = distances_miles(location, self.coordinates.take(candidates), mode)
+        closest = int(np.argmin(distances))
+        return self.stations[candidates[closest]], float(distances[closest])
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+def attribute_tokens(value):
+    """
+    Return the lowercase tokens an attribute value matches on.
+
+    Comma-separated values such as a station's "red, green, yellow" lines match
+    each item as well as the whole value.
+    """
+    if value is None:
+        return set()
+    value = str(value).strip().lower()
+    tokens = {value}
+    if ',' in value:
+        tokens.update(token.strip() for token in value.split(',') if token.strip())
+    return tokens
+
+
+class StationTable:
+    """
+    Station attributes stored by column, in the same order as the station index.
+
+    Equality filters are answered from per-column inverted indexes (token ->
+    sorted int32 row ids), built the first time a column is filtered on. Row
+    masks are only materialised for the tokens a filter asks for, so an index
+    over a unique column such as name stays proportional to the row count.
+    """
+
+    def __init__(self, stations):
+        self.count = len(stations)
+        columns = {"name": [station['name'] for station in stations]}
+        for i, station in enumerate(stations):
+            for key, value in (station.get('properties') or {}).items():
+                columns.setdefault(key, [None] * self.count)[i] = value
+        self.columns = {key: np.array(values, dtype=object) for key, values in columns.items()}
+        # Filters name columns case-insensitively
+        self._column_names = {key.lower(): key for key in self.columns}
+        self._postings = {}
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        key = self._column_names.get(name.lower())
+        return None if key is None else self.columns[key]
+
+    def _column_postings(self, name):
+        key = self._column_names.get(name.lower())
+        if key is None:
+            return None
+        if key not in self._postings:
+            rows = {}
+            for i, value in enumerate(self.columns[key]):
+                for token in attribute_tokens(value):
+                    rows.setdefault(token, []).append(i)
+            # Rows are visited in order, so every list is already sorted
+            self._postings[key] = {token: np.array(ids, dtype=np.int32) for token, ids in rows.items()}
+        return self._postings[key]
+
+    def mask(self, filters):
+        """
+        Return a boolean row mask for attribute filters, or None when there are none.
+
+        :param filters: Dict of column name to a value or list of values; a row
+            matches a column if it matches any of the values, and must match every column.
+        """
+        if not filters:
+            return None
+        mask = np.ones(self.count, dtype=bool)
+        for name, values in filters.items():
+            postings = self._column_postings(name)
+            if postings is None:
+                return np.zeros(self.count, dtype=bool)
+            matched = np.zeros(self.count, dtype=bool)
+            for value in values if isinstance(values, (list, tuple)) else [values]:
+                token = str(value).strip().lower()
+                if token in postings:
+                    matched[postings[token]] = True
+            mask &= matched
+        return mask
+
+    def attributes(self, i):
+        """Return the non-empty attributes of row i, excluding the name."""
+        return {
+            key: column[i] for key, column in self.columns.items()
+            if key != "name" and column[i] is not None
+        }
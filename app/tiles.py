@@ -0,0 +1,118 @@
+import zlib
+import numpy as np
+from distance import CoordinateArray, haversine_miles
+
+# A tile map is `rows * cols + 1` uint32 offsets plus the uint16 station indices
+# of every tile back to back (tile i owns offsets[i]:offsets[i + 1]), stored in
+# the station snapshot. A tile with no candidates had too many to store and
+# falls back to the index.
+MAX_STATIONS = 0xFFFF
+
+# Same reasoning as spatial.SPHERE_ERROR_MARGIN: spherical and ellipsoidal
+# distances differ by under 0.5%, so this margin keeps the candidate sets exact.
+SPHERE_ERROR_MARGIN = 1.01
+
+
+def coordinates_checksum(coordinates):
+    """CRC32 over the station coordinates, used to match a tile map to its dataset."""
+    return zlib.crc32(coordinates.latitudes.tobytes() + coordinates.longitudes.tobytes())
+
+
+def build_tile_candidates(coordinates, lat0, lon0, cell, rows, cols, max_candidates):
+    """
+    For every tile, find the stations that can be nearest to some point inside it.
+
+    A station s can only be nearest to a point p in a tile with centre c and
+    half-diagonal r if d(c, s) - r <= d(p, s) <= d(p, best) <= d(c, best) + r, so
+    anything farther than d(c, best) + 2r from the centre is pruned.
+
+    :return: Tuple of (offsets, indices) arrays.
+    """
+    offsets = np.zeros(rows * cols + 1, dtype=np.uint32)
+    indices = []
+    total = 0
+
+    for row in range(rows):
+        south = lat0 + row * cell
+        centre_lat = south + cell / 2
+        # The farthest corner is on the edge nearer the equator, where the tile is widest
+        wide_lat = south if abs(south) < abs(south + cell) else south + cell
+        half_diagonal = haversine_miles(
+            (centre_lat, 0.0), np.array([wide_lat]), np.array([cell / 2])
+        )[0]
+
+        centre_lons = lon0 + (np.arange(cols) + 0.5) * cell
+        distances = haversine_miles(
+            (centre_lat, centre_lons[:, np.newaxis]), coordinates.latitudes, coordinates.longitudes
+        )
+        limits = (distances.min(axis=1) + 2 * half_diagonal) * SPHERE_ERROR_MARGIN
+        for col in range(cols):
+            found = np.flatnonzero(distances[col] <= limits[col])
+            if len(found) <= max_candidates:
+                indices.append(found.astype(np.uint16))
+                total += len(found)
+            offsets[row * cols + col + 1] = total
+    return offsets, np.concatenate(indices) if indices else np.zeros(0, dtype=np.uint16)
+
+
+def compute_tile_map(stations, cell=0.01, buffer=0.25, max_candidates=16):
+    """
+    Precompute a tile map for a network.
+
+    :param stations: List of station dicts, in the order the service loads them.
+    :param cell: Tile size in degrees of latitude and longitude.
+    :param buffer: Degrees of padding around the stations' bounding box.
+    :param max_candidates: Maximum candidates stored per tile; busier tiles fall back to the index.
+    :return: TileMap held in memory.
+    """
+    coordinates = CoordinateArray.from_stations(stations)
+    if len(coordinates) > MAX_STATIONS:
+        raise ValueError(f"Tile maps support at most {MAX_STATIONS} stations")
+
+    lat0 = float(np.floor((coordinates.latitudes.min() - buffer) / cell) * cell)
+    lon0 = float(np.floor((coordinates.longitudes.min() - buffer) / cell) * cell)
+    rows = int(np.ceil((coordinates.latitudes.max() + buffer - lat0) / cell))
+    cols = int(np.ceil((coordinates.longitudes.max() + buffer - lon0) / cell))
+
+    offsets, indices = build_tile_candidates(coordinates, lat0, lon0, cell, rows, cols, max_candidates)
+    return TileMap(
+        lat0, lon0, cell, rows, cols, max_candidates,
+        len(coordinates), coordinates_checksum(coordinates), offsets, indices
+    )
+
+
+class TileMap:
+    """Read-only tile map over a network, usually memory-mapped from a station snapshot."""
+
+    def __init__(self, lat0, lon0, cell, rows, cols, max_candidates, station_count, checksum, offsets, indices):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.cell = cell
+        self.rows = rows
+        self.cols = cols
+        self.max_candidates = max_candidates
+        self.station_count = station_count
+        self.checksum = checksum
+        self.offsets = offsets
+        self.indices = indices
+
+    def params(self):
+        """Return the grid parameters in the order the snapshot stores them."""
+        return (self.lat0, self.lon0, self.cell, self.rows, self.cols,
+                self.max_candidates, self.station_count, self.checksum)
+
+    def lookup(self, location):
+        """
+        Return the candidate station indices for a location, or None if the
+        location is outside the map or its tile has too many candidates.
+        """
+        row = int((location[0] - self.lat0) // self.cell)
+        col = int((location[1] - self.lon0) // self.cell)
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return None
+        tile = row * self.cols + col
+        start, end = self.offsets[tile], self.offsets[tile + 1]
+        if start == end:
+            return None
+        return self.indices[start:end].astype(np.intp)
+
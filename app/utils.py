@@ -1,38 +1,49 @@
-from geopy.distance import geodesic
 from pykml import parser
-import hashlib
+import asyncio
+import atexit
+import html
 import json
+import queue
+import re
 import os
-import requests
+import sys
 from dotenv import load_dotenv
 import logging
-import time
+from logging.handlers import QueueHandler, QueueListener
+from spatial import StationIndex
+from singleflight import SingleFlight
+from distance import CoordinateArray, distances_miles, pairwise_distances_miles
+from responses import nearest_station_body
+from metrics import metrics
 
 load_dotenv()
 
-def load_all_stations(septa_kml_path, dc_metro_geojson_path):
-    """
-    Load SEPTA and DC Metro stations from KML and GeoJSON files.
+OUTLIER_KEYS = ('northernmost', 'southernmost', 'easternmost', 'westernmost')
 
-    :param septa_kml_path: Path to the SEPTA KML file.
-    :param dc_metro_geojson_path: Path to the DC Metro GeoJSON file.
-    :return: Tuple containing lists of SEPTA and DC Metro stations.
-    """
-    try:
-        septa_stations = load_kml_data(septa_kml_path)
-        dc_metro_stations = load_geojson_data(dc_metro_geojson_path)
-        return septa_stations, dc_metro_stations
-    except Exception as e:
-        logging.error(f"Error loading stations: {e}")
-        return [], []
+# Seconds a computed nearest-station body is cached for, by single and batch lookups alike
+NEAREST_STATION_CACHE_TTL = 86400
+
+# Coalesces concurrent nearest-station lookups for the same location
+nearest_station_flights = SingleFlight()
 
+# Attribute rows in the HTML table of a KML placemark description
+KML_ATTRIBUTE_ROW = re.compile(r'<td>([^<]*)</td>\s*<td>([^<]*)</td>')
+
+def kml_description_properties(description):
+    """Parse the attribute table of a KML placemark description into a dict."""
+    if not description:
+        return {}
+    return {
+        html.unescape(key).strip(): html.unescape(value).strip()
+        for key, value in KML_ATTRIBUTE_ROW.findall(description)
+    }
 
 def load_kml_data(filepath):
     """
     Load station data from a KML file.
 
     :param filepath: Path to the KML file.
-    :return: List of stations with name, longitude, and latitude.
+    :return: List of stations with name, longitude, latitude and the description's attributes.
     """
     stations = []
     try:
@@ -41,10 +52,12 @@ def load_kml_data(filepath):
             for placemark in doc.Document.Folder.Placemark:
                 name = placemark.name.text
                 coords = placemark.Point.coordinates.text.strip().split(',')
+                description = placemark.description.text if hasattr(placemark, 'description') else None
                 stations.append({
                     "name": name,
                     "longitude": float(coords[0]),
-                    "latitude": float(coords[1])
+                    "latitude": float(coords[1]),
+                    "properties": kml_description_properties(description)
                 })
     except FileNotFoundError:
         print(f"Error: KML file not found at {filepath}")
@@ -52,12 +65,13 @@ def load_kml_data(filepath):
         print(f"Error parsing KML file at {filepath}: {e}")
     return stations
 
-def load_geojson_data(filepath):
+def load_geojson_data(filepath, name_property='NAME'):
     """
     Load station data from a GeoJSON file.
 
     :param filepath: Path to the GeoJSON file.
-    :return: List of stations with name, longitude, and latitude.
+    :param name_property: Feature property holding the station name.
+    :return: List of stations with name, longitude, latitude and the feature's properties.
     """
     stations = []
     try:
@@ -65,11 +79,12 @@ def load_geojson_data(filepath):
             geojson = json.load(f)
             for feature in geojson['features']:
                 coords = feature['geometry']['coordinates']
-                name = feature['properties']['NAME']
+                name = feature['properties'][name_property]
                 stations.append({
                     "name": name,
                     "longitude": coords[0],
-                    "latitude": coords[1]
+                    "latitude": coords[1],
+                    "properties": feature['properties']
                 })
     except FileNotFoundError:
         print(f"Error: GeoJSON file not found at {filepath}")
@@ -79,147 +94,207 @@ def load_geojson_data(filepath):
         print(f"Error parsing GeoJSON file at {filepath}: {e}")
     return stations
 
-def find_nearest_station(location, stations, memcached_client, max_retries=3, retry_delay=0.5):
+def nearest_station_feature(location, stations):
     """
-    Find the nearest station to a given location and cache the result.
+    Find the nearest station to a location without touching the cache.
 
     :param location: Tuple (latitude, longitude) of the user's location.
-    :param stations: List of station data.
-    :param memcached_client: Memcached client for caching.
-    :param max_retries: Maximum number of retries to acquire a cache lock.
-    :param retry_delay: Delay between retries if lock is not acquired.
-    :return: JSON object representing the nearest station.
+    :param stations: StationIndex, or a list of station data to index.
+    :return: GeoJSON Feature for the nearest station, or None if there are no stations.
     """
-    location_key = hashlib.md5(json.dumps(location).encode()).hexdigest()
-    lock_key = f"lock:{location_key}"
-
-    for _ in range(max_retries):
-
-        if memcached_client.add(lock_key, "locked", time=10):
-            try:
-                # Check the cache
-                cached_result = memcached_client.get(location_key)
-                if cached_result:
-                    return json.loads(cached_result)
-
-                # Calculate nearest station
-                nearest_station = None
-                min_distance = float('inf')
-                for station in stations:
-                    station_location = (station['latitude'], station['longitude'])
-                    distance = geodesic(location, station_location).miles
-                    if distance < min_distance:
-                        min_distance = distance
-                        nearest_station = station
-
-                result = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [nearest_station['longitude'], nearest_station['latitude']]
-                    },
-                    "properties": {
-                        "name": nearest_station['name'],
-                        "distance_miles": min_distance
-                    }
-                }
-                # Cache the result
-                memcached_client.set(location_key, json.dumps(result), time=86400)
-                return result
-            finally:
-                # Release the lock
-                memcached_client.delete(lock_key)
-        else:
-            # If lock not acquired, wait and retry
-            time.sleep(retry_delay)
-
-    logging.warning(f"Could not acquire lock for location {location} after {max_retries} attempts.")
-    return None
-
-def get_google_maps_directions(start, end, mode='walking', memcached_client=None):
+    station_index = stations if isinstance(stations, StationIndex) else StationIndex(stations)
+    nearest_station, min_distance = station_index.nearest(location)
+    if nearest_station is None:
+        return None
+
+    return station_feature(nearest_station, min_distance)
+
+def nearest_station_features(locations, stations):
     """
-    Get directions from Google Maps Directions API and cache the result.
+    Batch version of nearest_station_feature with identical answers.
 
-    :param start: Tuple (latitude, longitude) of the start location.
-    :param end: Tuple (latitude, longitude) of the end location.
-    :param mode: Mode of transportation, e.g., 'walking', 'driving', 'transit'.
-    :param memcached_client: Optional Memcached client for caching.
-    :return: JSON response from Google Maps API with directions.
+    :param locations: List of (latitude, longitude) tuples.
+    :param stations: StationIndex, or a list of station data to index.
+    :return: List of GeoJSON Features (or None where there are no stations), one per location.
     """
-    start_coords = f"{start[0]},{start[1]}"
-    end_coords = f"{end['geometry']['coordinates'][1]},{end['geometry']['coordinates'][0]}"
-    
-    directions_key = hashlib.sha256(f"{start_coords}_{end_coords}_{mode}".encode('utf-8')).hexdigest()
-    
-    if memcached_client:
-        cached_directions = memcached_client.get(directions_key)
-        if cached_directions:
-            return json.loads(cached_directions)
-    
-    directions_url = (
-        f"https://maps.googleapis.com/maps/api/directions/json"
-        f"?origin={start_coords}"
-        f"&destination={end_coords}"
-        f"&mode={mode}"
-        f"&key={os.getenv('GOOGLE_MAPS_API_KEY')}"
-    )
-    
-    response = requests.get(directions_url)
-    directions = response.json()
+    station_index = stations if isinstance(stations, StationIndex) else StationIndex(stations)
+    return [
+        None if station is None else station_feature(station, distance)
+        for station, distance in station_index.nearest_many(locations)
+    ]
 
-    if memcached_client:
-        memcached_client.set(directions_key, json.dumps(directions), time=86400)
-    
-    return directions
+def station_feature(station, distance_miles, **properties):
+    """
+    Build a GeoJSON Feature for a station.
 
-def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        datefmt='%Y-%m-%d %H:%M:%S',
-        handlers=[
-            logging.FileHandler("app.log"),
-            logging.StreamHandler()
-        ]
-    )
-    
-    uvicorn_log_config = {
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "default": {
-                "format": "%(asctime)s - %(levelname)s - %(message)s",
-            },
-            "uvicorn": {
-                "format": "%(levelname)s - %(message)s", 
-            },
-        },
-        "handlers": {
-            "default": {
-                "formatter": "default",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
-            },
-            "file": {
-                "formatter": "default",
-                "class": "logging.FileHandler",
-                "filename": "app.log",
-            },
-            "uvicorn": {
-                "formatter": "uvicorn",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
-            },
-        },
-        "loggers": {
-            "": {"handlers": ["default", "file"], "level": "INFO"},
-            "uvicorn": {"handlers": ["uvicorn", "file"], "level": "INFO", "propagate": False},
-            "uvicorn.error": {"handlers": ["default", "file"], "level": "INFO", "propagate": True},
-            "uvicorn.access": {"handlers": ["default", "file"], "level": "INFO", "propagate": False},
+    :param station: Station dict with name, longitude and latitude.
+    :param distance_miles: Distance from the query location.
+    :param properties: Extra feature properties, e.g. network and attributes.
+    """
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [station['longitude'], station['latitude']]
         },
+        "properties": {
+            "name": station['name'],
+            "distance_miles": distance_miles,
+            **properties
+        }
     }
 
-    logging.config.dictConfig(uvicorn_log_config)
+async def find_nearest_station(location, stations, cache, use_lease=None, lease_ttl=None, lease_wait=None,
+                               version=None):
+    """
+    Find the nearest station to a given location and cache the serialized response body.
+
+    Concurrent calls for the same location in this process share one computation.
+    With NEAREST_STATION_LEASE enabled, replicas also take a short memcached lease
+    so only one of them computes a location; the others wait briefly for its
+    result and compute it themselves if it has not appeared.
+
+    :param location: Tuple (latitude, longitude) of the user's location.
+    :param stations: StationIndex, or a list of station data to index.
+    :param cache: Async cache client (TieredCache) used for the result and the lease.
+    :param use_lease: Whether to take a cross-replica lease, defaults to NEAREST_STATION_LEASE.
+    :param lease_ttl: Lease expiry in seconds, defaults to NEAREST_STATION_LEASE_TTL.
+    :param lease_wait: Seconds to wait for another replica's result, defaults to NEAREST_STATION_LEASE_WAIT.
+    :param version: Dataset version of the stations, part of the cache key.
+    :return: Response body bytes (see responses.nearest_station_body), or None if there are no stations.
+    """
+    station_index = stations if isinstance(stations, StationIndex) else StationIndex(stations)
+    location_key = location_cache_key(location, version)
+    if use_lease is None:
+        use_lease = os.getenv('NEAREST_STATION_LEASE', 'false').lower() in ('1', 'true', 'yes')
+    if lease_ttl is None:
+        lease_ttl = int(os.getenv('NEAREST_STATION_LEASE_TTL', 10))
+    if lease_wait is None:
+        lease_wait = float(os.getenv('NEAREST_STATION_LEASE_WAIT', 0.05))
+
+    return await nearest_station_flights.do(
+        location_key, _resolve_nearest_station,
+        location, station_index, cache, location_key, use_lease, lease_ttl, lease_wait
+    )
+
+async def _resolve_nearest_station(location, station_index, cache, location_key, use_lease, lease_ttl, lease_wait):
+    with metrics.stage("cache_get"):
+        cached_result = await cache.get(location_key)
+    if cached_result:
+        return cached_result
+
+    lease_key = f"lease:{location_key}"
+    holds_lease = False
+    if use_lease:
+        with metrics.stage("lease_wait"):
+            holds_lease = await cache.add(lease_key, "leased", time=lease_ttl)
+            if not holds_lease:
+                # Another replica is computing this location; give it a moment instead of duplicating work
+                await asyncio.sleep(lease_wait)
+                cached_result = await cache.get_remote(location_key)
+        if not holds_lease and cached_result:
+            return cached_result
+
+    try:
+        with metrics.stage("nearest_compute"):
+            feature = nearest_station_feature(location, station_index)
+        if feature is None:
+            return None
+        with metrics.stage("serialize"):
+            body = nearest_station_body(feature)
+        await cache.set(location_key, body, time=NEAREST_STATION_CACHE_TTL)
+        return body
+    finally:
+        if holds_lease:
+            await cache.delete(lease_key)
+
+def format_location(location):
+    """Format a location for cache keys; 4 decimals matches the rounding used for lookups."""
+    # Adding 0.0 turns -0.0 into 0.0 so both round to the same key
+    return f"{location[0] + 0.0:.4f},{location[1] + 0.0:.4f}"
+
+def directions_cache_key(start, mode='walking', version=None):
+    """
+    Return the cache key for directions from a rounded location to its nearest station.
+
+    The destination is not part of the key because it is determined by the start
+    and the dataset version.
+    """
+    if version:
+        return f"d:{version}:{format_location(start)}:{mode}"
+    return f"d:{format_location(start)}:{mode}"
+
+class LogFormatter(logging.Formatter):
+    """
+    Plain text lines, except for records whose message is a dict (such as the
+    access log), which are written as one JSON object per line.
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(levelname)s - %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
+
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            entry = {"time": self.formatTime(record, self.datefmt), "level": record.levelname, "logger": record.name}
+            entry.update(record.msg)
+            return json.dumps(entry, default=str)
+        return super().format(record)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Hands records to the logging thread as they are. Formatting is left to
+    that thread too, and when the queue is full records are dropped and
+    counted instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_log_listener = None
+
+
+def setup_logging():
+    """
+    Route every log record through a queue to a background thread that writes
+    it to stdout and LOG_FILE (default app.log), so request handlers never
+    block on disk or console writes. Safe to call more than once; only the
+    first call configures anything.
+
+    :return: The QueueListener running the logging thread.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return _log_listener
+
+    formatter = LogFormatter()
+    handlers = [logging.StreamHandler(sys.stdout), logging.FileHandler(os.getenv('LOG_FILE', 'app.log'))]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = BackgroundQueueHandler(queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', 10000))))
+    for name in ("", "uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = [queue_handler]
+        logger.setLevel(logging.INFO)
+        logger.propagate = name == ""
+
+    _log_listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(_log_listener.stop)
+    return _log_listener
 
 def load_outliers(file_path):
     """
@@ -242,56 +317,47 @@ def load_outliers(file_path):
     return {}
 
 
-def is_distant_location(location, outliers, threshold=100):
+def outlier_coordinates(outliers):
+    """Return the outlier stations as a CoordinateArray, in OUTLIER_KEYS order."""
+    return CoordinateArray.from_stations([outliers[key] for key in OUTLIER_KEYS])
+
+
+def closest_outlier_key(location, outliers, mode=None):
     """
-    Determine if a location is too distant from the closest outlier station.
-    
-    :param location: Tuple of (latitude, longitude) for the location to check.
+    Return the key of the outlier station closest to a location.
+
+    :param location: Tuple of (latitude, longitude).
     :param outliers: Dictionary of outlier stations (northernmost, southernmost, easternmost, westernmost).
-    :param threshold: Distance threshold in miles (default is 200 miles).
-    :return: (bool, str) A tuple indicating if the location is distant and the key of the closest outlier.
+    :param mode: Distance mode ('exact' or 'fast'), defaults to DISTANCE_MODE.
     """
-    distances = {
-        "northernmost": geodesic(location, (outliers['northernmost']['latitude'], outliers['northernmost']['longitude'])).miles,
-        "southernmost": geodesic(location, (outliers['southernmost']['latitude'], outliers['southernmost']['longitude'])).miles,
-        "easternmost": geodesic(location, (outliers['easternmost']['latitude'], outliers['easternmost']['longitude'])).miles,
-        "westernmost": geodesic(location, (outliers['westernmost']['latitude'], outliers['westernmost']['longitude'])).miles,
-    }
-    closest_outlier = min(distances, key=distances.get)
-    return distances[closest_outlier] > threshold, closest_outlier
+    distances = distances_miles(location, outlier_coordinates(outliers), mode)
+    return OUTLIER_KEYS[int(distances.argmin())]
 
 
-def round_coordinates(location, precision=3):
-    """Rounds the latitude and longitude to a given precision."""
-    return (round(location[0], precision), round(location[1], precision))
+def closest_outlier_keys(locations, outliers, mode=None):
+    """Batch version of closest_outlier_key with one distance call for every location."""
+    if not locations:
+        return []
+    distances = pairwise_distances_miles(
+        [location[0] for location in locations],
+        [location[1] for location in locations],
+        outlier_coordinates(outliers),
+        mode,
+    )
+    return [OUTLIER_KEYS[int(i)] for i in distances.argmin(axis=1)]
 
 
-def determine_service_area(location, septa_stations, septa_outliers, dc_metro_stations, dc_metro_outliers):
+def location_cache_key(rounded_location, version=None):
     """
-    Determine whether the location is closer to SEPTA or DC Metro and return corresponding stations and outliers.
-    
-    :param location: Tuple of (latitude, longitude) for the location to check.
-    :param septa_stations: List of SEPTA stations.
-    :param septa_outliers: Dictionary of SEPTA outliers.
-    :param dc_metro_stations: List of DC Metro stations.
-    :param dc_metro_outliers: Dictionary of DC Metro outliers.
-    :return: Tuple containing the stations list and outliers for the nearest service area.
+    Return the cache key for a nearest-station response body at a rounded location.
+
+    :param version: Dataset version the body was computed from, if any.
     """
-    septa_distance = min(
-        geodesic(location, (septa_outliers['northernmost']['latitude'], septa_outliers['northernmost']['longitude'])).miles,
-        geodesic(location, (septa_outliers['southernmost']['latitude'], septa_outliers['southernmost']['longitude'])).miles,
-        geodesic(location, (septa_outliers['easternmost']['latitude'], septa_outliers['easternmost']['longitude'])).miles,
-        geodesic(location, (septa_outliers['westernmost']['latitude'], septa_outliers['westernmost']['longitude'])).miles,
-    )
+    if version:
+        return f"n:{version}:{format_location(rounded_location)}"
+    return f"n:{format_location(rounded_location)}"
 
-    dc_metro_distance = min(
-        geodesic(location, (dc_metro_outliers['northernmost']['latitude'], dc_metro_outliers['northernmost']['longitude'])).miles,
-        geodesic(location, (dc_metro_outliers['southernmost']['latitude'], dc_metro_outliers['southernmost']['longitude'])).miles,
-        geodesic(location, (dc_metro_outliers['easternmost']['latitude'], dc_metro_outliers['easternmost']['longitude'])).miles,
-        geodesic(location, (dc_metro_outliers['westernmost']['latitude'], dc_metro_outliers['westernmost']['longitude'])).miles,
-    )
 
-    if septa_distance <= dc_metro_distance:
-        return septa_stations, septa_outliers
-    else:
-        return dc_metro_stations, dc_metro_outliers
\ No newline at end of file
+def round_coordinates(location, precision=3):
+    """Rounds the latitude and longitude to a given precision."""
+    return (round(location[0], precision), round(location[1], precision))
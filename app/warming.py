@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from operator import itemgetter
+from dotenv import load_dotenv
+from admission import TokenBucket
+from directions import DirectionsUnavailable
+from directions_cache import decode_entry, fetch_and_store, DIRECTIONS_REFRESH_LOCK_TTL
+from networks import file_lock
+from responses import nearest_station_from_body
+from utils import find_nearest_station, location_cache_key, directions_cache_key
+
+load_dotenv()
+
+# Number of hot locations to track, persist and warm; 0 (the default) turns tracking and warming off
+CACHE_WARM_TOP_K = int(os.getenv('CACHE_WARM_TOP_K', 0))
+# Seconds between saving the hot list and warming from it; 0 warms only at startup
+CACHE_WARM_INTERVAL = float(os.getenv('CACHE_WARM_INTERVAL', 900))
+# Where the hot list is persisted across restarts
+CACHE_WARM_FILE = os.getenv('CACHE_WARM_FILE', '../hot_locations.json')
+# Whether to also warm directions, and how many Google calls per second each worker may make for it
+CACHE_WARM_DIRECTIONS = os.getenv('CACHE_WARM_DIRECTIONS', 'false').lower() in ('1', 'true', 'yes')
+CACHE_WARM_UPSTREAM_RATE = float(os.getenv('CACHE_WARM_UPSTREAM_RATE', 1.0))
+# Counts are multiplied by this after every warming cycle, so popularity fades
+CACHE_WARM_DECAY = float(os.getenv('CACHE_WARM_DECAY', 0.5))
+
+
+class HeavyHitters:
+    """
+    Approximate counts of the most frequent keys in a stream (Misra-Gries).
+
+    Counts are kept for up to 2 * capacity keys. When that fills up, the
+    (capacity + 1)-th largest count is subtracted from every key and keys left
+    at zero or below are dropped, so recording stays O(1) amortized. Any key
+    seen more than total / (capacity + 1) times is guaranteed to be kept, and
+    counts are low by at most `error`.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.total = 0
+        self.error = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, key, count=1):
+        self.total += count
+        self.counts[key] = self.counts.get(key, 0) + count
+        if len(self.counts) > 2 * self.capacity:
+            self._compact()
+
+    def _compact(self):
+        threshold = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+        self.counts = {key: count - threshold for key, count in self.counts.items() if count > threshold}
+        self.error += threshold
+
+    def top(self, k=None):
+        """Return up to k (key, count) pairs, most frequent first."""
+        return heapq.nlargest(k or self.capacity, self.counts.items(), key=itemgetter(1))
+
+    def decay(self, factor):
+        self.counts = {key: count * factor for key, count in self.counts.items() if count * factor >= 1}
+        self.total *= factor
+        self.error *= factor
+
+
+class CacheWarmer:
+    """
+    Tracks the most requested rounded locations and pre-populates the cache with their results.
+
+    Nearest-station results are warmed for every hot location inside a
+    service area, and directions (optionally) for hot locations that asked for
+    them, with Google calls capped at `upstream_rate` per second. Workers
+    take the same memcached lock as a background directions refresh before
+    fetching, so a location is fetched once however many workers warm it.
+    The hot list is saved to `path`, merged with what other workers saved, so
+    a restarted worker can warm before it has seen any traffic.
+    """
+
+    def __init__(self, top_k=CACHE_WARM_TOP_K, path=CACHE_WARM_FILE, warm_directions=CACHE_WARM_DIRECTIONS,
+                 upstream_rate=CACHE_WARM_UPSTREAM_RATE, decay=CACHE_WARM_DECAY):
+        self.top_k = top_k
+        self.path = path
+        self.warm_directions = warm_directions
+        self.upstream_rate = upstream_rate
+        self.decay_factor = decay
+        self.locations = HeavyHitters(max(top_k, 1))
+        self.directions = HeavyHitters(max(top_k, 1))
+        self.last_run = {}
+
+    @property
+    def enabled(self):
+        return self.top_k > 0
+
+    def record(self, location, include_directions=False):
+        """Count a request for a rounded location."""
+        if not self.enabled:
+            return
+        self.locations.add(location)
+        if include_directions:
+            self.directions.add(location)
+
+    def hot_list(self):
+        return {
+            "saved": time.time(),
+            "locations": [[lat, lon, count] for (lat, lon), count in self.locations.top(self.top_k)],
+            "directions": [[lat, lon, count] for (lat, lon), count in self.directions.top(self.top_k)],
+        }
+
+    def read(self):
+        """Return the saved hot list, or None if it is missing or unreadable."""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to read hot locations from {self.path}: {e}")
+            return None
+
+    def save(self):
+        """
+        Merge the hot list into the one saved at `path` and write it back atomically.
+
+        Every worker saves to the same file, so each location keeps the larger
+        of this worker's count and the saved one. Saved counts are decayed
+        first, so locations no worker still sees fade out of the file too.
+        """
+        with file_lock(f"{self.path}.lock"):
+            hot = self.hot_list()
+            saved = self.read() or {}
+            for field in ("locations", "directions"):
+                counts = {(lat, lon): count * self.decay_factor for lat, lon, count in saved.get(field, [])}
+                for lat, lon, count in hot[field]:
+                    counts[(lat, lon)] = max(counts.get((lat, lon), 0), count)
+                top = heapq.nlargest(self.top_k, counts.items(), key=itemgetter(1))
+                hot[field] = [[lat, lon, count] for (lat, lon), count in top]
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, 'w') as f:
+                json.dump(hot, f)
+            os.replace(temporary, self.path)
+
+    def load(self):
+        """Merge a saved hot list into the counts; a missing or unreadable file is ignored."""
+        saved = self.read()
+        if saved is None:
+            return False
+        for lat, lon, count in saved.get("locations", []):
+            self.locations.add((lat, lon), count)
+        for lat, lon, count in saved.get("directions", []):
+            self.directions.add((lat, lon), count)
+        return True
+
+    async def warm(self, registry, cache, directions_client):
+        """
+        Pre-populate the cache for the hot locations, most popular first.
+
+        :return: Dict counting locations warmed, already cached, skipped as distant, and directions fetched.
+        """
+        stats = {"computed": 0, "cached": 0, "distant": 0, "directions": 0}
+        if not len(registry):
+            return stats
+        hot = [location for location, _ in self.locations.top(self.top_k)]
+        bodies = {}
+        for location in hot:
+            region, is_distant, _ = registry.resolve(location)
+            if region is None or is_distant:
+                stats["distant"] += 1
+                continue
+            key = location_cache_key(location, registry.version)
+            body = await cache.get(key)
+            if body:
+                stats["cached"] += 1
+            else:
+                body = await find_nearest_station(location, region.stations, cache, version=registry.version)
+                stats["computed"] += 1
+            bodies[location] = body
+            # Let requests in between
+            await asyncio.sleep(0)
+
+        if self.warm_directions and self.upstream_rate > 0:
+            stats["directions"] = await self._warm_directions(registry, cache, directions_client, bodies)
+        self.last_run = {"time": time.time(), **stats}
+        return stats
+
+    async def _warm_directions(self, registry, cache, directions_client, bodies):
+        bucket = TokenBucket(self.upstream_rate, 1, time.monotonic())
+        fetched = 0
+        for location, _ in self.directions.top(self.top_k):
+            body = bodies.get(location)
+            if not body:
+                continue
+            key = directions_cache_key(location, version=registry.version)
+            if decode_entry(await cache.get(key)) is not None:
+                continue
+            # Another worker (or a background refresh) is already fetching it
+            lock_key = f"refresh:{key}"
+            if not await cache.add(lock_key, "1", time=DIRECTIONS_REFRESH_LOCK_TTL):
+                continue
+            try:
+                if decode_entry(await cache.get_remote(key)) is not None:
+                    continue
+                wait = bucket.take(time.monotonic())
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = bucket.take(time.monotonic())
+                await fetch_and_store(cache, directions_client, key, location, nearest_station_from_body(body))
+            except DirectionsUnavailable as e:
+                logging.error(f"Stopped warming directions, upstream unavailable: {e}")
+                break
+            finally:
+                await cache.delete(lock_key)
+            fetched += 1
+        return fetched
+
+    async def run(self, datasets, state, interval=CACHE_WARM_INTERVAL):
+        """
+        Warm from the saved hot list at startup, then save and re-warm every `interval` seconds.
+
+        :param datasets: DatasetManager, read for the current registry on every cycle.
+        :param state: Object with `cache` and `directions_client` attributes, e.g. app.state.
+        """
+        if not self.enabled:
+            return
+        self.load()
+        while True:
+            try:
+                stats = await self.warm(datasets.registry, state.cache, state.directions_client)
+                logging.info(f"Cache warming finished: {stats}")
+            except Exception as e:
+                logging.error(f"Cache warming failed: {e}")
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+            try:
+                self.save()
+            except OSError as e:
+                logging.error(f"Failed to save hot locations to {self.path}: {e}")
+            self.locations.decay(self.decay_factor)
+            self.directions.decay(self.decay_factor)
@@ -0,0 +1,205 @@
+"""
+End-to-end load driver: the real service app driven in-process over ASGI.
+
+memcached and the Google Directions API are replaced by the fake servers
+from tests/, with injectable latency, so runs are repeatable and need no
+network. Each mix sends a
+stream of /nearest_station requests shaped to exercise one path:
+
+    cache_hit   locations answered from the cache
+    cache_miss  fresh locations inside a service area (region, nearest, memcached set)
+    distant     fresh locations far outside every service area
+    directions  fresh locations with include_directions
+    mixed       70% hit, 20% miss, 5% distant, 5% directions
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+API_KEY = 'bench-key'
+
+MIXES = {
+    "cache_hit": {"hit": 1.0},
+    "cache_miss": {"miss": 1.0},
+    "distant": {"distant": 1.0},
+    "directions": {"directions": 1.0},
+    "mixed": {"hit": 0.7, "miss": 0.2, "distant": 0.05, "directions": 0.05},
+}
+
+# (latitude, longitude, spread in degrees) around Philadelphia and DC, and Kansas
+IN_AREA = [(39.95, -75.16, 0.15), (38.9, -77.03, 0.1)]
+FAR_AWAY = [(38.5, -98.0, 2.0)]
+HOT_LOCATIONS = 64
+
+
+def import_app(admission=False):
+    """
+    Import the service app configured for benchmarking.
+
+    Rate limiting and access logs are off, and so is the adaptive concurrency
+    limit unless `admission` is set, since they would dominate the numbers.
+    """
+    os.environ.setdefault('NETWORKS_CONFIG', os.path.join(REPO_DIR, 'networks.json'))
+    os.environ.setdefault('VALID_API_KEYS', API_KEY)
+    os.environ.setdefault('LOG_FILE', os.devnull)
+    os.environ['ACCESS_LOG_SAMPLE_RATE'] = '0'
+    os.environ['RATE_LIMIT_PER_SECOND'] = '0'
+    if not admission:
+        os.environ['ADMISSION_MAX_CONCURRENCY'] = '0'
+    sys.path.insert(0, os.path.join(REPO_DIR, 'app'))
+    sys.path.insert(0, os.path.join(REPO_DIR, 'tests'))
+    # The service logs to stdout; send that to stderr so stdout stays JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as service
+    logging.getLogger().setLevel(logging.WARNING)
+    return service
+
+
+class LocationSource:
+    """Request bodies for each kind of request in a mix."""
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.seen = set()
+        self.hot = [self._fresh(IN_AREA) for _ in range(HOT_LOCATIONS)]
+
+    def _fresh(self, areas):
+        # Unique after rounding to 4 decimals, so every fresh location misses the cache
+        while True:
+            latitude, longitude, spread = self.random.choice(areas)
+            location = (
+                round(latitude + self.random.uniform(-spread, spread), 4),
+                round(longitude + self.random.uniform(-spread, spread), 4),
+            )
+            if location not in self.seen:
+                self.seen.add(location)
+                return location
+
+    def body(self, kind):
+        if kind == "hit":
+            location = self.random.choice(self.hot)
+        elif kind == "distant":
+            location = self._fresh(FAR_AWAY)
+        else:
+            location = self._fresh(IN_AREA)
+        return (
+            f'{{"latitude": {location[0]}, "longitude": {location[1]}, '
+            f'"include_directions": {"true" if kind == "directions" else "false"}}}'
+        ).encode()
+
+
+async def post(app, path, body):
+    """Send one POST over ASGI, returning the response status."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"x-api-key", API_KEY.encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def summarise(name, latencies, statuses, elapsed, **fields):
+    latencies = np.array(latencies) * 1000
+    return {
+        "suite": "load",
+        "name": name,
+        **fields,
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p95": round(float(np.percentile(latencies, 95)), 3),
+            "p99": round(float(np.percentile(latencies, 99)), 3),
+            "max": round(float(latencies.max()), 3),
+        },
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def run_mix(service, name, requests=2000, concurrency=32, memcached_latency=0.0005,
+                  directions_latency=0.05, seed=0):
+    """
+    Drive one mix against a fresh cache and stand-in backends.
+
+    :return: Result dict with requests per second, latency percentiles and status counts.
+    """
+    from aiomemcached import AsyncMemcachedClient
+    from cache import LRUCache, TieredCache
+    from directions import DirectionsClient
+    from fake_directions import FakeDirectionsServer
+    from fake_memcached import FakeMemcachedServer
+
+    memcached = await FakeMemcachedServer(latency=memcached_latency).start()
+    google = await FakeDirectionsServer(latency=directions_latency).start()
+    remote = AsyncMemcachedClient('127.0.0.1', memcached.port, pool_size=concurrency)
+    directions = DirectionsClient(google.url, api_key='bench', max_concurrency=concurrency)
+    app = service.app
+    app.state.cache = TieredCache(LRUCache(), remote)
+    app.state.directions_client = directions
+
+    source = LocationSource(seed)
+    weights = MIXES[name]
+    kinds = random.Random(seed).choices(list(weights), list(weights.values()), k=requests)
+    bodies = [source.body(kind) for kind in kinds]
+    # Warm the hot locations so "hit" requests are answered from the cache
+    for location in source.hot:
+        body = f'{{"latitude": {location[0]}, "longitude": {location[1]}}}'.encode()
+        await post(app, "/nearest_station", body)
+
+    latencies = []
+    statuses = Counter()
+    queue = iter(bodies)
+
+    async def worker():
+        for body in queue:
+            started = time.perf_counter()
+            status = await post(app, "/nearest_station", body)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await directions.close()
+        await remote.close()
+        await memcached.stop()
+        await google.stop()
+
+    return summarise(
+        name, latencies, statuses, elapsed, concurrency=concurrency,
+        memcached_latency_ms=memcached_latency * 1000, directions_latency_ms=directions_latency * 1000,
+    )
+
+
+def run_load(mixes=tuple(MIXES), requests=2000, concurrency=32, memcached_latency=0.0005,
+             directions_latency=0.05, admission=False):
+    service = import_app(admission)
+    return [
+        asyncio.run(run_mix(service, name, requests, concurrency, memcached_latency, directions_latency))
+        for name in mixes
+    ]
@@ -0,0 +1,142 @@
+"""
+Microbenchmarks for the distance, region and nearest-station functions on
+synthetic networks of any size.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from distance import CoordinateArray, EXACT, FAST, distances_miles  # noqa: E402
+from regions import RegionResolver, ServiceRegion  # noqa: E402
+from spatial import StationIndex  # noqa: E402
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+# Synthetic networks are centred on Washington, DC
+CENTRE = (38.9, -77.03)
+
+
+def synthetic_stations(count, seed=0, spread=0.5):
+    """Stations scattered around CENTRE, denser in the middle like a real network."""
+    rng = np.random.default_rng(seed)
+    latitudes = CENTRE[0] + rng.normal(0, spread / 2, count).clip(-spread * 2, spread * 2)
+    longitudes = CENTRE[1] + rng.normal(0, spread / 2, count).clip(-spread * 2, spread * 2)
+    return [
+        {"name": f"Station {i}", "latitude": float(lat), "longitude": float(lon)}
+        for i, (lat, lon) in enumerate(zip(latitudes, longitudes))
+    ]
+
+
+def query_points(count, seed=1, spread=0.6):
+    rng = np.random.default_rng(seed)
+    return [
+        (round(float(lat), 4), round(float(lon), 4))
+        for lat, lon in zip(
+            CENTRE[0] + rng.uniform(-spread, spread, count),
+            CENTRE[1] + rng.uniform(-spread, spread, count),
+        )
+    ]
+
+
+def measure(function, min_time=0.2, samples=7):
+    """
+    Time a zero-argument function.
+
+    Calls are batched so each sample lasts at least min_time / samples.
+
+    :return: Dict of per-call timings in microseconds and calls per second.
+    """
+    function()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / samples:
+            break
+        number *= 2
+
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - started) / number)
+    timings = np.array(timings) * 1e6
+    return {
+        "per_call_us": {
+            "min": round(float(timings.min()), 3),
+            "median": round(float(np.median(timings)), 3),
+            "mean": round(float(timings.mean()), 3),
+        },
+        "calls_per_s": round(1e6 / float(np.median(timings)), 1),
+    }
+
+
+def result(name, stations, **fields):
+    return {"suite": "micro", "name": name, "stations": stations, **fields}
+
+
+def bench_size(size, min_time=0.2, query_count=200):
+    """Run every microbenchmark against one synthetic network size."""
+    stations = synthetic_stations(size)
+    coordinates = CoordinateArray.from_stations(stations)
+    points = query_points(query_count)
+    location = points[0]
+    results = []
+
+    for mode in (EXACT, FAST):
+        results.append(result(
+            "distances_miles", size, mode=mode,
+            **measure(lambda: distances_miles(location, coordinates, mode), min_time)
+        ))
+
+    started = time.perf_counter()
+    index = StationIndex(stations, coordinates=coordinates)
+    build_seconds = time.perf_counter() - started
+    results.append(result("station_index_build", size, seconds=round(build_seconds, 4)))
+
+    cycle = iter(())
+
+    def next_point():
+        nonlocal cycle
+        try:
+            return next(cycle)
+        except StopIteration:
+            cycle = iter(points)
+            return next(cycle)
+
+    for mode in (EXACT, FAST):
+        results.append(result(
+            "nearest", size, mode=mode, **measure(lambda: index.nearest(next_point(), mode), min_time)
+        ))
+    results.append(result(
+        "nearest_many", size, batch=len(points),
+        **measure(lambda: index.nearest_many(points), min_time)
+    ))
+    results.append(result(
+        "k_nearest", size, k=10, **measure(lambda: index.k_nearest(next_point(), 10), min_time)
+    ))
+
+    started = time.perf_counter()
+    region = ServiceRegion("synthetic", coordinates, stations=index)
+    results.append(result("region_build", size, seconds=round(time.perf_counter() - started, 4)))
+    resolver = RegionResolver([region])
+    results.append(result(
+        "region_resolve", size, **measure(lambda: resolver.resolve(next_point()), min_time)
+    ))
+    results.append(result(
+        "region_resolve_many", size, batch=len(points),
+        **measure(lambda: resolver.resolve_many(points), min_time)
+    ))
+    return results
+
+
+def run_micro(sizes=DEFAULT_SIZES, min_time=0.2):
+    results = []
+    for size in sizes:
+        results.extend(bench_size(size, min_time))
+    return results
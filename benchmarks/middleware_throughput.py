@@ -0,0 +1,129 @@
+"""
+Compare request throughput through the old and new middleware stacks.
+
+The "before" stack reproduces the previous middlewares (a BaseHTTPMiddleware
+for the security headers plus two `app.middleware("http")` functions); the
+"after" stack is the pure-ASGI one the service uses. Both wrap the same
+trivial endpoint and are driven in-process over ASGI, so the numbers only
+reflect middleware overhead.
+
+    python benchmarks/middleware_throughput.py --requests 20000 --concurrency 32
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from middlewares import AccessLogMiddleware, RequestSizeLimitMiddleware  # noqa: E402
+from responses import JSONBytesResponse  # noqa: E402
+from security import SecurityHeadersMiddleware  # noqa: E402
+
+BODY = b'{"latitude": 38.8265, "longitude": -76.9115}'
+
+
+class OldSecurityHeadersMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        response.headers["Content-Security-Policy"] = "default-src 'self'; script-src 'self'; style-src 'self';"
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        return response
+
+
+async def old_limit_request_size(request: Request, call_next):
+    max_request_size = 1048576  # 1 MB
+    content_length = int(request.headers.get("content-length", 0))
+    if content_length > max_request_size:
+        raise HTTPException(status_code=413, detail="Request Entity Too Large")
+    return await call_next(request)
+
+
+async def old_log_requests(request: Request, call_next):
+    logger = logging.getLogger("uvicorn.access")
+    logger.info(f"Request: {request.method} {request.url} Headers: {request.headers}")
+    response = await call_next(request)
+    logger.info(f"Response status: {response.status_code}")
+    return response
+
+
+def build_app(stack):
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return JSONBytesResponse(await request.body())
+
+    if stack == "before":
+        app.add_middleware(OldSecurityHeadersMiddleware)
+        app.middleware("http")(old_limit_request_size)
+        app.middleware("http")(old_log_requests)
+    else:
+        app.add_middleware(SecurityHeadersMiddleware)
+        app.add_middleware(RequestSizeLimitMiddleware)
+        app.add_middleware(AccessLogMiddleware)
+    return app
+
+
+async def request(app):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/echo", "raw_path": b"/echo", "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(BODY)).encode()),
+                    (b"x-api-key", b"bench-key")],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000),
+    }
+    messages = [{"type": "http.request", "body": BODY, "more_body": False}]
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    assert status == [200], status
+
+
+async def run(app, requests, concurrency):
+    async def worker(count):
+        for _ in range(count):
+            await request(app)
+
+    # Warm up routing and the middleware stack before timing
+    await worker(200)
+    started = time.perf_counter()
+    share, extra = divmod(requests, concurrency)
+    await asyncio.gather(*(worker(share + (i < extra)) for i in range(concurrency)))
+    return requests / (time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--sample-rate', type=float, default=1.0,
+                        help="ACCESS_LOG_SAMPLE_RATE for the new stack; defaults to 1.0, as the old one "
+                             "logged every request")
+    args = parser.parse_args(argv)
+
+    import middlewares
+    middlewares.ACCESS_LOG_SAMPLE_RATE = args.sample_rate
+    results = {}
+    for stack in ("before", "after"):
+        results[stack] = asyncio.run(run(build_app(stack), args.requests, args.concurrency))
+        print(f"{stack:>6}: {results[stack]:,.0f} requests/s")
+    print(f"speedup: {results['after'] / results['before']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Run the micro and load benchmarks and report the results as JSON.
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --suite load --mixes cache_miss,mixed --compare before.json
+
+Results are matched to a baseline by suite, name and parameters; the
+comparison prints the throughput ratio and, for load results, p99 latencies.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+import load
+import micro
+
+# Fields that are measurements rather than parameters of a result
+MEASUREMENTS = {"per_call_us", "calls_per_s", "seconds", "rps", "latency_ms", "statuses", "requests"}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=load.REPO_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return json.dumps({k: v for k, v in result.items() if k not in MEASUREMENTS}, sort_keys=True)
+
+
+def throughput(result):
+    return result.get("calls_per_s") or result.get("rps")
+
+
+def compare(results, baseline):
+    """Print each result next to its baseline counterpart."""
+    previous = {result_key(result): result for result in baseline["results"]}
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None or not throughput(before) or not throughput(result):
+            continue
+        params = {k: v for k, v in result.items() if k not in MEASUREMENTS and k not in ("suite", "name")}
+        line = (f"{result['suite']:>5} {result['name']:<20} {json.dumps(params):<60} "
+                f"{throughput(result) / throughput(before):6.2f}x throughput")
+        if "latency_ms" in result:
+            line += f", p99 {before['latency_ms']['p99']:.1f} -> {result['latency_ms']['p99']:.1f} ms"
+        print(line, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--suite', choices=('micro', 'load', 'all'), default='all')
+    parser.add_argument('--sizes', default=','.join(map(str, micro.DEFAULT_SIZES)),
+                        help="Comma-separated synthetic network sizes for the micro suite")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds spent timing each microbenchmark")
+    parser.add_argument('--mixes', default=','.join(load.MIXES), help="Comma-separated load mixes")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per load mix")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--memcached-latency', type=float, default=0.5, help="Milliseconds per memcached round trip")
+    parser.add_argument('--directions-latency', type=float, default=50.0, help="Milliseconds per directions request")
+    parser.add_argument('--admission', action='store_true', help="Keep the adaptive concurrency limit on")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--compare', help="Baseline JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.suite in ('micro', 'all'):
+        results.extend(micro.run_micro([int(size) for size in args.sizes.split(',')], args.min_time))
+    if args.suite in ('load', 'all'):
+        results.extend(load.run_load(
+            args.mixes.split(','), args.requests, args.concurrency,
+            args.memcached_latency / 1000, args.directions_latency / 1000, args.admission,
+        ))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Label GPS points with their nearest station offline.
+
+Streams CSV or NDJSON points, shards them across a process pool that shares
+the loaded networks, and writes each input row back with its nearest station
+in input order. Answers use the same rounding, region and nearest-station
+logic as the API, so they match what /nearest_station returns.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+from networks import load_registry  # noqa: E402
+from utils import closest_outlier_keys, nearest_station_features, round_coordinates  # noqa: E402
+
+RESULT_FIELDS = ['network', 'station', 'station_latitude', 'station_longitude', 'distance_miles', 'distant', 'error']
+
+# Loaded once in the parent; forked workers share it copy-on-write
+_registry = None
+
+
+def init_worker(config_path):
+    global _registry
+    if _registry is None:
+        _registry = load_registry(config_path)
+
+
+def error_result(detail):
+    result = dict.fromkeys(RESULT_FIELDS)
+    result['error'] = detail
+    return result
+
+
+def label_locations(locations, registry=None, precision=4):
+    """
+    Find the nearest station for each location, exactly as /nearest_station does.
+
+    :param locations: List of (latitude, longitude) tuples, or None for rows that could not be parsed.
+    :param registry: NetworkRegistry, defaults to the one loaded in this process.
+    :param precision: Decimal places locations are rounded to before lookup.
+    :return: List of result dicts with the RESULT_FIELDS keys, one per location.
+    """
+    registry = registry or _registry
+    results = [None] * len(locations)
+    valid = []
+    for i, location in enumerate(locations):
+        if location is not None and -90 <= location[0] <= 90 and -180 <= location[1] <= 180:
+            valid.append(i)
+        else:
+            results[i] = error_result("Invalid coordinates.")
+
+    rounded = [round_coordinates(locations[i], precision=precision) for i in valid]
+    nearby, distant = {}, {}
+    for i, location, (network, is_distant, _) in zip(valid, rounded, registry.resolve_many(rounded)):
+        if network is None:
+            results[i] = error_result("Station data is not available.")
+        else:
+            group = distant if is_distant else nearby
+            group.setdefault(network.name, (network, []))[1].append((i, location))
+
+    # One batched outlier and nearest-station pass per network
+    for network, points in distant.values():
+        keys = closest_outlier_keys([location for _, location in points], network.outliers)
+        for (i, _), key in zip(points, keys):
+            outlier = network.outliers[key]
+            results[i] = {
+                'network': network.name,
+                'station': outlier['name'],
+                'station_latitude': outlier['latitude'],
+                'station_longitude': outlier['longitude'],
+                'distance_miles': None,
+                'distant': True,
+                'error': None,
+            }
+
+    for network, points in nearby.values():
+        features = nearest_station_features([location for _, location in points], network.stations)
+        for (i, _), feature in zip(points, features):
+            if feature is None:
+                results[i] = error_result("No stations available for this location.")
+                continue
+            longitude, latitude = feature['geometry']['coordinates']
+            results[i] = {
+                'network': network.name,
+                'station': feature['properties']['name'],
+                'station_latitude': latitude,
+                'station_longitude': longitude,
+                'distance_miles': feature['properties']['distance_miles'],
+                'distant': False,
+                'error': None,
+            }
+    return results
+
+
+def parse_location(row, lat_field, lon_field):
+    try:
+        return float(row[lat_field]), float(row[lon_field])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def detect_format(path, explicit):
+    if explicit:
+        return explicit
+    return 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def read_ndjson(f):
+    """
+    Yield one dict per non-blank NDJSON line. A line that is not a JSON object
+    is passed on as {'input': <line>}, so it gets the per-row "Invalid
+    coordinates." result a bad CSV row would instead of stopping the run.
+    """
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else {'input': line.rstrip('\r\n')}
+
+
+def read_rows(f, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        return reader, reader.fieldnames or []
+    return read_ndjson(f), None
+
+
+class RowWriter:
+    def __init__(self, f, fmt, fieldnames):
+        self.fmt = fmt
+        self.f = f
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(f, fieldnames + [field for field in RESULT_FIELDS if field not in fieldnames])
+            self.writer.writeheader()
+
+    def write(self, row, result):
+        if self.fmt == 'csv':
+            self.writer.writerow({**row, **{key: '' if value is None else value for key, value in result.items()}})
+        else:
+            self.f.write(json.dumps({**row, **result}) + '\n')
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Throughput:
+    """Counts processed rows and reports the rate to stderr at most every `interval` seconds."""
+
+    def __init__(self, interval=5.0, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.rows = 0
+        self.started = self.reported = time.monotonic()
+
+    def add(self, rows):
+        self.rows += rows
+        now = time.monotonic()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        label = "Done" if final else "Progress"
+        print(f"{label}: {self.rows} rows in {elapsed:.1f}s ({self.rows / elapsed:,.0f} rows/s)", file=self.stream)
+
+
+def pool_context():
+    # Forked workers inherit the parent's loaded networks instead of reloading them
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+
+def label_stream(rows, write, workers, chunk_size, config_path, lat_field, lon_field, throughput):
+    """
+    Label rows in input order, keeping at most two chunks per worker in flight
+    so memory stays constant however large the input is.
+    """
+    chunked = chunks(rows, chunk_size)
+
+    def locations(chunk):
+        return [parse_location(row, lat_field, lon_field) for row in chunk]
+
+    if workers <= 1:
+        for chunk in chunked:
+            for row, result in zip(chunk, label_locations(locations(chunk))):
+                write(row, result)
+            throughput.add(len(chunk))
+        return
+
+    with pool_context().Pool(workers, initializer=init_worker, initargs=(config_path,)) as pool:
+        pending = deque()
+        for chunk in chunked:
+            pending.append((chunk, pool.apply_async(label_locations, (locations(chunk),))))
+            if len(pending) >= 2 * workers:
+                done, result = pending.popleft()
+                for row, labelled in zip(done, result.get()):
+                    write(row, labelled)
+                throughput.add(len(done))
+        while pending:
+            done, result = pending.popleft()
+            for row, labelled in zip(done, result.get()):
+                write(row, labelled)
+            throughput.add(len(done))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help="CSV or NDJSON file of points, or - for stdin")
+    parser.add_argument('-o', '--output', default='-', help="Output file, or - for stdout")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help="Input and output format, defaults to the input's extension")
+    parser.add_argument('--config', default='networks.json', help="Networks config file")
+    parser.add_argument('--lat-field', default='latitude')
+    parser.add_argument('--lon-field', default='longitude')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--report-interval', type=float, default=5.0, help="Seconds between throughput reports")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global _registry
+    args = parse_args(argv)
+    fmt = detect_format(args.input, args.format)
+    _registry = load_registry(args.config)
+    throughput = Throughput(args.report_interval)
+
+    source = sys.stdin if args.input == '-' else open(args.input, newline='')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        rows, fieldnames = read_rows(source, fmt)
+        writer = RowWriter(target, fmt, fieldnames)
+        label_stream(
+            rows, writer.write, args.workers, args.chunk_size, args.config,
+            args.lat_field, args.lon_field, throughput
+        )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    throughput.report(final=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,31 @@
-import json
-from geopy.distance import geodesic
-from pykml import parser
+"""
+Build the station data files the service loads at startup.
 
-def load_kml_data(filepath):
-    stations = []
-    try:
-        with open(filepath) as f:
-            doc = parser.parse(f).getroot()
-            for placemark in doc.Document.Folder.Placemark:
-                name = placemark.name.text
-                coords = placemark.Point.coordinates.text.strip().split(',')
-                stations.append({
-                    "name": name,
-                    "longitude": float(coords[0]),
-                    "latitude": float(coords[1])
-                })
-    except Exception as e:
-        print(f"Error loading KML data: {e}")
-    return stations
+For every network in the networks config, writes its outermost-station JSON
+file and adds it to a compiled station snapshot (coordinate arrays, name
+table, extremes, KD-trees and tile maps) that the service memory-maps instead of
+parsing the KML and GeoJSON sources.
+"""
+import argparse
+import json
+import os
+import sys
 
-def load_geojson_data(filepath):
-    stations = []
-    try:
-        with open(filepath, 'r') as f:
-            geojson = json.load(f)
-            for feature in geojson['features']:
-                coords = feature['geometry']['coordinates']
-                name = feature['properties']['NAME']
-                stations.append({
-                    "name": name,
-                    "longitude": coords[0],
-                    "latitude": coords[1]
-                })
-    except Exception as e:
-        print(f"Error loading GeoJSON data: {e}")
-    return stations
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+from networks import config_fingerprint, read_config, load_source_stations  # noqa: E402
+from snapshot import write_snapshot, station_location  # noqa: E402
 
 def find_outermost_stations(stations):
     northernmost = max(stations, key=lambda s: s['latitude'])
     southernmost = min(stations, key=lambda s: s['latitude'])
     easternmost = max(stations, key=lambda s: s['longitude'])
     westernmost = min(stations, key=lambda s: s['longitude'])
-    
+
     return {
-        "northernmost": northernmost,
-        "southernmost": southernmost,
-        "easternmost": easternmost,
-        "westernmost": westernmost
+        "northernmost": station_location(northernmost),
+        "southernmost": station_location(southernmost),
+        "easternmost": station_location(easternmost),
+        "westernmost": station_location(westernmost)
     }
 
 def save_outliers_to_json(file_path, data):
@@ -57,15 +36,54 @@ def save_outliers_to_json(file_path, data):
     except Exception as e:
         print(f"Error writing to file {file_path}: {e}")
 
-def main():
-    septa_stations = load_kml_data('./SEPTARegionalRailStations2016/doc.kml')
-    dc_metro_stations = load_geojson_data('Metro_Stations_Regional.geojson')
+def save_snapshot(file_path, networks, tile_options, created=None):
+    try:
+        size = write_snapshot(file_path, networks, created=created, tile_options=tile_options)
+        counts = ", ".join(f"{name}: {len(stations)}" for name, stations in networks.items())
+        print(f"Station snapshot ({counts} stations, {size} bytes) has been written to '{file_path}'.")
+    except Exception as e:
+        print(f"Error writing snapshot {file_path}: {e}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--config', default='networks.json', help="Networks config file")
+    parser.add_argument('--output-dir', help="Directory for the output files, defaults to the config's directory")
+    parser.add_argument('--snapshot', help="Snapshot file name, defaults to the config's snapshot")
+    parser.add_argument('--no-snapshot', action='store_true', help="Only write the outermost-station JSON files")
+    parser.add_argument('--no-tiles', action='store_true', help="Leave tile maps out of the snapshot")
+    parser.add_argument('--tile-cell', type=float, default=0.01, help="Tile size in degrees")
+    parser.add_argument('--tile-buffer', type=float, default=0.25, help="Degrees of padding around each network")
+    parser.add_argument('--tile-max-candidates', type=int, default=16)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config, base_dir = read_config(args.config)
+    output_dir = args.output_dir or base_dir
 
-    septa_outermost_stations = find_outermost_stations(septa_stations)
-    dc_metro_outermost_stations = find_outermost_stations(dc_metro_stations)
+    networks = {}
+    for entry in config.get('networks', []):
+        if entry['loader'] == 'snapshot':
+            print(f"Skipping network {entry['name']}, it is loaded from a prebuilt snapshot.")
+            continue
+        stations = load_source_stations(entry, base_dir)
+        if not stations:
+            print(f"Skipping network {entry['name']}, no stations were loaded.")
+            continue
+        networks[entry['name']] = stations
+        outliers_path = entry.get('outliers') or f"{entry['name']}_outermost_stations.json"
+        save_outliers_to_json(os.path.join(output_dir, outliers_path), find_outermost_stations(stations))
 
-    save_outliers_to_json('septa_outermost_stations.json', septa_outermost_stations)
-    save_outliers_to_json('dc_metro_outermost_stations.json', dc_metro_outermost_stations)
+    if not args.no_snapshot:
+        tile_options = None if args.no_tiles else {
+            "cell": args.tile_cell,
+            "buffer": args.tile_buffer,
+            "max_candidates": args.tile_max_candidates,
+        }
+        snapshot_path = args.snapshot or config.get('snapshot') or 'stations.snapshot'
+        # Labelled with the sources' fingerprint (taken after the outlier files
+        # are written), so the service can tell when the snapshot is stale
+        save_snapshot(os.path.join(output_dir, snapshot_path), networks, tile_options, config_fingerprint(args.config))
 
 if __name__ == "__main__":
     main()
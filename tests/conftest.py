@@ -0,0 +1,71 @@
+import importlib
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+# The service modules import each other as top-level modules from app/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+# The data-build tool lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import admission  # noqa: E402
+import security  # noqa: E402
+from cache import LRUCache, TieredCache  # noqa: E402
+from warming import CacheWarmer  # noqa: E402
+
+APP_DIR = os.path.join(os.path.dirname(__file__), '..', 'app')
+
+
+class DictMemcached:
+    def __init__(self):
+        self.store = {}
+        self.calls = []
+
+    async def get(self, key):
+        self.calls.append('get')
+        return self.store.get(key)
+
+    async def set(self, key, value, time=0):
+        self.calls.append('set')
+        self.store[key] = value
+        return True
+
+    async def add(self, key, value, time=0):
+        if key in self.store:
+            return False
+        self.store[key] = value
+        return True
+
+    async def delete(self, key):
+        self.store.pop(key, None)
+        return True
+
+    async def get_multi(self, keys):
+        self.calls.append('get_multi')
+        return {key: self.store[key] for key in keys if key in self.store}
+
+    async def set_multi(self, mappings, time=0):
+        self.calls.append('set_multi')
+        self.store.update(mappings)
+        return True
+
+    async def close(self):
+        self.calls.append('close')
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setenv('VALID_API_KEYS', 'test-key')
+    monkeypatch.chdir(APP_DIR)
+    module = importlib.import_module('app')
+    # API keys are parsed once at import; set them for this test whatever order modules were imported in
+    monkeypatch.setattr(security, 'VALID_API_KEYS', frozenset({'test-key'}))
+    monkeypatch.setattr(admission, 'admission', admission.AdmissionController())
+    memcached = DictMemcached()
+    monkeypatch.setattr(module.app.state, 'cache', TieredCache(LRUCache(), memcached))
+    monkeypatch.setattr(module.app.state, 'warmer', CacheWarmer(top_k=10, path=str(tmp_path / 'hot_locations.json')))
+    with TestClient(module.app, headers={'X-API-KEY': 'test-key'}) as test_client:
+        test_client.memcached = memcached
+        yield test_client
@@ -0,0 +1,118 @@
+"""
+In-process stub for the Google Maps Directions API. Answers every GET with a
+small directions payload, with injectable latency and failures.
+
+Run standalone with `python tests/fake_directions.py --port 8081` and point
+GOOGLE_MAPS_DIRECTIONS_URL at http://127.0.0.1:8081/maps/api/directions/json.
+"""
+import argparse
+import asyncio
+import json
+from urllib.parse import parse_qs, urlsplit
+
+
+def directions_payload(origin, destination, mode):
+    return {
+        "status": "OK",
+        "geocoded_waypoints": [{"geocoder_status": "OK"}, {"geocoder_status": "OK"}],
+        "routes": [{
+            "summary": "Stub route",
+            "overview_polyline": {"points": "_p~iF~ps|U_ulLnnqC_mqNvxq`@"},
+            "legs": [{
+                "start_address": origin,
+                "end_address": destination,
+                "distance": {"text": "0.5 mi", "value": 805},
+                "duration": {"text": "10 mins", "value": 600},
+                "steps": [{
+                    "html_instructions": f"Head toward <b>{destination}</b> ({mode})",
+                    "distance": {"text": "0.5 mi", "value": 805},
+                    "duration": {"text": "10 mins", "value": 600},
+                    "polyline": {"points": "_p~iF~ps|U_ulLnnqC"},
+                }],
+            }],
+        }],
+    }
+
+
+class FakeDirectionsServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, http_status=200, api_status="OK"):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.http_status = http_status
+        self.api_status = api_status
+        self.requests = 0
+        self.connections = 0
+        self._server = None
+        self._open = {}
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/maps/api/directions/json"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        # Close live connections too, so their handlers finish before the loop does
+        for writer in self._open.values():
+            writer.close()
+        await asyncio.gather(*self._open, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        task = asyncio.current_task()
+        self._open[task] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                query = parse_qs(urlsplit(request_line.split()[1].decode()).query)
+                payload = directions_payload(
+                    query.get('origin', [''])[0], query.get('destination', [''])[0], query.get('mode', [''])[0]
+                )
+                payload["status"] = self.api_status
+                body = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {self.http_status} Stub\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self._open[task]
+            writer.close()
+
+
+async def serve(args):
+    server = await FakeDirectionsServer(args.host, args.port, args.latency, args.http_status).start()
+    print(f"Fake directions API listening on {server.url}")
+    await server._server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to delay each response")
+    parser.add_argument('--http-status', type=int, default=200)
+    asyncio.run(serve(parser.parse_args()))
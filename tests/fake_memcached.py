@@ -0,0 +1,144 @@
+"""
+In-process fake memcached server speaking the binary protocol subset the
+service uses (GET, SET, ADD, DELETE, GETKQ, SETQ, NOOP and SASL PLAIN).
+
+Run standalone with `python tests/fake_memcached.py --port 11211`.
+"""
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from aiomemcached import (  # noqa: E402
+    HEADER, RESPONSE_MAGIC, STORE_EXTRAS,
+    OP_GET, OP_SET, OP_ADD, OP_DELETE, OP_NOOP, OP_GETKQ, OP_SETQ, OP_SASL_AUTH,
+    STATUS_OK, STATUS_KEY_NOT_FOUND, STATUS_KEY_EXISTS,
+)
+
+STATUS_AUTH_ERROR = 0x20
+STATUS_UNKNOWN_COMMAND = 0x81
+
+
+class FakeMemcachedServer:
+    def __init__(self, host='127.0.0.1', port=0, username=None, password=None, latency=0.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.store = {}
+        self.requests = 0
+        self.connections = 0
+        self._server = None
+        self._open = {}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        # Close live connections too, so their handlers finish before the loop does
+        for writer in self._open.values():
+            writer.close()
+        await asyncio.gather(*self._open, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def _get(self, key):
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        flags, value, expires = entry
+        if expires and expires <= time.monotonic():
+            del self.store[key]
+            return None
+        return flags, value
+
+    def _response(self, opcode, status=STATUS_OK, key=b'', value=b'', extras=b''):
+        body_length = len(extras) + len(key) + len(value)
+        return HEADER.pack(
+            RESPONSE_MAGIC, opcode, len(key), len(extras), 0, status, body_length, 0, 0
+        ) + extras + key + value
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        task = asyncio.current_task()
+        self._open[task] = writer
+        authenticated = not (self.username and self.password)
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                _, opcode, key_length, extras_length, _, _, body_length, _, _ = HEADER.unpack(header)
+                body = await reader.readexactly(body_length) if body_length else b''
+                extras = body[:extras_length]
+                key = body[extras_length:extras_length + key_length]
+                value = body[extras_length + key_length:]
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                if opcode == OP_SASL_AUTH:
+                    authenticated = value == f"\x00{self.username}\x00{self.password}".encode()
+                    status = STATUS_OK if authenticated else STATUS_AUTH_ERROR
+                    writer.write(self._response(opcode, status))
+                elif not authenticated:
+                    writer.write(self._response(opcode, STATUS_AUTH_ERROR))
+                elif opcode in (OP_GET, OP_GETKQ):
+                    entry = self._get(key)
+                    if entry is not None:
+                        response_key = key if opcode == OP_GETKQ else b''
+                        writer.write(self._response(
+                            opcode, key=response_key, value=entry[1], extras=struct.pack('!L', entry[0])
+                        ))
+                    elif opcode == OP_GET:
+                        writer.write(self._response(opcode, STATUS_KEY_NOT_FOUND))
+                elif opcode in (OP_SET, OP_SETQ, OP_ADD):
+                    flags, ttl = STORE_EXTRAS.unpack(extras)
+                    if opcode == OP_ADD and self._get(key) is not None:
+                        writer.write(self._response(opcode, STATUS_KEY_EXISTS))
+                        continue
+                    self.store[key] = (flags, value, time.monotonic() + ttl if ttl else 0)
+                    if opcode != OP_SETQ:
+                        writer.write(self._response(opcode))
+                elif opcode == OP_DELETE:
+                    found = self.store.pop(key, None) is not None
+                    writer.write(self._response(opcode, STATUS_OK if found else STATUS_KEY_NOT_FOUND))
+                elif opcode == OP_NOOP:
+                    writer.write(self._response(opcode))
+                else:
+                    writer.write(self._response(opcode, STATUS_UNKNOWN_COMMAND))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self._open[task]
+            writer.close()
+
+
+async def serve(args):
+    server = await FakeMemcachedServer(
+        args.host, args.port, args.username, args.password, args.latency
+    ).start()
+    print(f"Fake memcached listening on {server.host}:{server.port}")
+    await server._server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11211)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to delay each request")
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,83 @@
+import asyncio
+
+import admission
+from admission import AdaptiveConcurrencyLimit, AdmissionControlMiddleware, AdmissionController, TokenBucket
+
+
+def test_token_bucket_allows_a_burst_then_reports_the_wait():
+    bucket = TokenBucket(rate=2.0, capacity=3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(0.0) == 0.5
+    assert bucket.take(0.5) == 0.0
+
+
+def test_concurrency_limit_grows_when_fast_and_backs_off_when_slow():
+    limit = AdaptiveConcurrencyLimit(minimum=2, maximum=20, target_latency=0.1, initial=10)
+    for _ in range(50):
+        assert limit.try_acquire()
+        limit.release(0.01, now=0.0)
+    assert limit.limit > 13
+
+    grown = limit.limit
+    now = 0.0
+    for _ in range(200):
+        now += 1.0
+        limit.try_acquire()
+        limit.release(1.0, now=now)
+    assert limit.limit == 2
+
+    # Back-to-back slow completions only back off once per smoothed latency
+    limit = AdaptiveConcurrencyLimit(minimum=2, maximum=20, target_latency=0.1, initial=grown, smoothing=1.0)
+    for _ in range(5):
+        limit.try_acquire()
+        limit.release(1.0, now=10.0)
+    assert limit.limit == grown * limit.backoff
+
+
+def test_requests_over_the_limit_are_shed_instead_of_queued():
+    gate = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    controller = AdmissionController(rate=0, concurrency=AdaptiveConcurrencyLimit(minimum=1, maximum=1, initial=1))
+    middleware = AdmissionControlMiddleware(slow_app, controller)
+
+    async def call():
+        scope = {"type": "http", "path": "/nearest_station", "headers": [], "method": "POST"}
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware(scope, receive, send)
+        return sent[0]
+
+    async def scenario():
+        first = asyncio.ensure_future(call())
+        await asyncio.sleep(0)
+        shed = await call()
+        gate.set()
+        return await first, shed
+
+    admitted, shed = asyncio.run(scenario())
+    assert admitted["status"] == 200
+    assert shed["status"] == 429 and (b"retry-after", b"1") in shed["headers"]
+    assert controller.concurrency.inflight == 0
+
+
+def test_api_keys_are_rate_limited_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(admission, 'admission', AdmissionController(rate=0.5, burst=2))
+    location = {'latitude': 38.8265, 'longitude': -76.9115}
+    assert [client.post('/nearest_station', json=location).status_code for _ in range(2)] == [200, 200]
+    limited = client.post('/nearest_station', json=location)
+    assert limited.status_code == 429
+    assert limited.headers['retry-after'] == '2'
+    # Scrapes keep working, and unknown keys are left to authentication
+    assert client.get('/metrics').status_code == 200
+    assert client.post('/nearest_station', json=location, headers={'X-API-KEY': 'nope'}).status_code == 401
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from aiomemcached import AsyncMemcachedClient, MemcachedError
+from cache import LRUCache, TieredCache
+from fake_memcached import FakeMemcachedServer
+
+
+def test_client_round_trips_against_fake_server():
+    async def scenario():
+        async with FakeMemcachedServer(username='user', password='secret') as server:
+            client = AsyncMemcachedClient('127.0.0.1', server.port, 'user', 'secret', pool_size=2)
+            assert await client.get('missing') is None
+            assert await client.set('a', 'ä', time=60)
+            assert await client.get('a') == 'ä'
+            assert await client.set('b', b'\x00\x01')
+            assert await client.get('b') == b'\x00\x01'
+            assert await client.add('lock', 'locked', time=10)
+            assert not await client.add('lock', 'locked', time=10)
+            assert await client.delete('lock')
+            assert not await client.delete('lock')
+
+            assert await client.set_multi({'x': '1', 'y': '2'}, time=60)
+            assert await client.get_multi(['x', 'y', 'z']) == {'x': '1', 'y': '2'}
+
+            await asyncio.gather(*(client.get('a') for _ in range(20)))
+            assert server.connections <= 2
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_client_rejects_bad_credentials():
+    async def scenario():
+        async with FakeMemcachedServer(username='user', password='secret') as server:
+            client = AsyncMemcachedClient('127.0.0.1', server.port, 'user', 'wrong')
+            with pytest.raises(MemcachedError):
+                await client.get('a')
+
+    asyncio.run(scenario())
+
+
+def test_client_times_out_and_tiered_cache_falls_back():
+    async def scenario():
+        async with FakeMemcachedServer(latency=0.2) as server:
+            client = AsyncMemcachedClient('127.0.0.1', server.port, timeout=0.05)
+            with pytest.raises(asyncio.TimeoutError):
+                await client.get('a')
+
+            cache = TieredCache(LRUCache(), client)
+            await cache.set('a', 'v')
+            assert await cache.get('a') == 'v'
+            assert cache.stats()['l2']['errors'] == 1
+
+    asyncio.run(scenario())
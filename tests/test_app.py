@@ -0,0 +1,203 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import security
+from datasets import DatasetManager
+from find_outermost_stations import main as compile_sources
+from fake_directions import directions_payload
+
+
+def test_nearest_station(client):
+    response = client.post('/nearest_station', json={'latitude': 38.8265, 'longitude': -76.9115})
+    assert response.status_code == 200
+    assert response.json()['nearest_station']['properties']['name'] == 'Branch Ave'
+
+
+def test_batch_keeps_order_and_uses_bulk_cache_calls(client):
+    locations = [
+        {'latitude': 38.8265, 'longitude': -76.9115},
+        {'latitude': 95.0, 'longitude': 0.0},
+        {'latitude': 34.0522, 'longitude': -118.2437},
+        {'latitude': 39.9526, 'longitude': -75.1652},
+        {'latitude': 38.8265, 'longitude': -76.9115},
+    ]
+    response = client.post('/nearest_stations', json={'locations': locations})
+    assert response.status_code == 200
+    results = response.json()['results']
+
+    assert [r['status'] for r in results] == ['success', 'error', 'success', 'success', 'success']
+    assert results[0] == results[4]
+    assert results[0]['nearest_station']['properties']['name'] == 'Branch Ave'
+    assert results[2]['directions'] == 'Location is too far away for directions'
+    single = client.post('/nearest_station', json=locations[3]).json()
+    assert results[3]['nearest_station'] == single['nearest_station']
+    assert client.memcached.calls[:2] == ['get_multi', 'set_multi']
+
+
+def test_batch_misses_are_resolved_in_one_pass_per_region(client, monkeypatch):
+    from spatial import StationIndex
+    passes = []
+    nearest_many = StationIndex.nearest_many
+
+    def counting_nearest_many(self, locations, mode=None):
+        passes.append(len(locations))
+        return nearest_many(self, locations, mode)
+
+    def no_single_lookups(self, location, mode=None):
+        raise AssertionError("batch misses should not be looked up one by one")
+
+    monkeypatch.setattr(StationIndex, 'nearest_many', counting_nearest_many)
+    monkeypatch.setattr(StationIndex, 'nearest', no_single_lookups)
+    locations = [
+        {'latitude': 38.8265, 'longitude': -76.9115},
+        {'latitude': 38.9072, 'longitude': -77.0369},
+        {'latitude': 39.9526, 'longitude': -75.1652},
+        {'latitude': 38.8265, 'longitude': -76.9115},
+    ]
+    results = client.post('/nearest_stations', json={'locations': locations}).json()['results']
+    assert [r['status'] for r in results] == ['success'] * 4
+    assert results[0] == results[3]
+    assert sorted(passes) == [1, 2]
+    assert client.memcached.calls[:2] == ['get_multi', 'set_multi']
+
+
+def test_batch_rejects_oversized_requests(client):
+    import models
+    too_many = [{'latitude': 0.0, 'longitude': 0.0}] * (models.MAX_BATCH_SIZE + 1)
+    assert client.post('/nearest_stations', json={'locations': too_many}).status_code == 422
+    assert client.post('/nearest_stations', json={'locations': []}).status_code == 422
+
+
+def test_repeat_and_distant_lookups_skip_memcached(client):
+    location = {'latitude': 39.9526, 'longitude': -75.1652}
+    first = client.post('/nearest_station', json=location).json()
+    calls = len(client.memcached.calls)
+    assert client.post('/nearest_station', json=location).json() == first
+
+    distant = {'latitude': 34.0522, 'longitude': -118.2437}
+    assert client.post('/nearest_station', json=distant).status_code == 200
+    assert client.post('/nearest_station', json=distant).status_code == 200
+    assert len(client.memcached.calls) == calls
+    assert client.get('/cache/stats').json()['l1']['hits'] >= 2
+
+
+def test_cached_body_is_written_once_and_served_as_stored(client):
+    location = {'latitude': 38.8265, 'longitude': -76.9115}
+    response = client.post('/nearest_station', json=location)
+    assert client.memcached.calls.count('set') == 1
+
+    version = client.app.state.datasets.version
+    assert version
+    stored = client.memcached.store[f'n:{version}:38.8265,-76.9115']
+    assert stored == response.content
+    assert response.json()['directions'] is None
+
+
+class StubDirections:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_directions(self, start, end, mode='walking'):
+        self.calls += 1
+        return directions_payload(f"{start[0]},{start[1]}", end['properties']['name'], mode)
+
+    async def close(self):
+        pass
+
+
+def test_directions_are_cached_and_spliced_into_the_body(client, monkeypatch):
+    import app
+    stub = StubDirections()
+    monkeypatch.setattr(app.app.state, 'directions_client', stub)
+    location = {'latitude': 38.8265, 'longitude': -76.9115, 'include_directions': True}
+
+    first = client.post('/nearest_station', json=location).json()
+    assert first['directions']['status'] == "OK"
+    leg = first['directions']['routes'][0]['legs'][0]
+    assert leg['end_address'] == 'Branch Ave'
+    assert leg['steps'][0]['html_instructions'] == "Head toward <b>Branch Ave</b> (walking)"
+    assert leg['steps'][0]['instructions'] == "Head toward Branch Ave (walking)"
+    assert first['directions']['routes'][0]['overview_polyline'] == {"points": "_p~iF~ps|U_ulLnnqC_mqNvxq`@"}
+    assert client.post('/nearest_station', json=location).json() == first
+    assert stub.calls == 1
+
+
+def test_admin_reload_swaps_datasets_and_bypasses_old_cache_entries(client, monkeypatch, tmp_path):
+    stations = tmp_path / 'stations.geojson'
+    config = tmp_path / 'networks.json'
+
+    def write_station(name, lon, lat):
+        stations.write_text(json.dumps({"features": [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]},
+             "properties": {"NAME": name}},
+        ]}))
+
+    write_station("Old", -77.0, 38.9)
+    config.write_text(json.dumps({"networks": [{"name": "dc", "loader": "geojson", "path": "stations.geojson"}]}))
+    datasets = DatasetManager(str(config))
+    datasets.load()
+    monkeypatch.setattr(client.app.state, 'datasets', datasets)
+    monkeypatch.setattr(security, 'ADMIN_API_KEYS', frozenset({'admin-key'}))
+
+    location = {'latitude': 38.9, 'longitude': -77.01}
+    assert client.post('/nearest_station', json=location).json()['nearest_station']['properties']['name'] == "Old"
+    old_version = datasets.version
+
+    assert client.post('/admin/reload').status_code == 403
+    write_station("New", -77.01, 38.9)
+    response = client.post('/admin/reload', headers={'X-API-KEY': 'admin-key'})
+    assert response.status_code == 200 and response.json()['reloaded']
+    assert response.json()['version'] == datasets.version != old_version
+
+    assert client.post('/nearest_station', json=location).json()['nearest_station']['properties']['name'] == "New"
+    assert f'n:{old_version}:38.9000,-77.0100' in client.memcached.store
+    assert f'n:{datasets.version}:38.9000,-77.0100' in client.memcached.store
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_reload_picks_up_edited_sources_behind_a_compiled_snapshot(tmp_path, shared):
+    stations = tmp_path / 'stations.geojson'
+    config = tmp_path / 'networks.json'
+
+    def write_station(name):
+        stations.write_text(json.dumps({"features": [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-77.0, 38.9]},
+             "properties": {"NAME": name}},
+        ]}))
+
+    write_station("Old")
+    config.write_text(json.dumps({"snapshot": "stations.snapshot", "networks": [
+        {"name": "dc", "loader": "geojson", "path": "stations.geojson", "outliers": "dc_outliers.json"},
+    ]}))
+    compile_sources(['--config', str(config)])
+    datasets = DatasetManager(str(config), str(tmp_path / 'shared.snapshot') if shared else None)
+    datasets.load()
+
+    def nearest():
+        return datasets.registry.get('dc').stations.nearest((38.9, -77.0))[0]['name']
+
+    assert nearest() == "Old"
+    checked_from = []
+    changed = datasets.changed
+
+    def checking_changed():
+        checked_from.append(threading.current_thread())
+        return changed()
+
+    datasets.changed = checking_changed
+    assert not asyncio.run(datasets.reload(force=False))
+    # The files are hashed in a worker thread, not on the event loop
+    assert checked_from and threading.main_thread() not in checked_from
+    write_station("New")
+    assert asyncio.run(datasets.reload(force=False))
+    assert nearest() == "New"
+
+
+def test_shutdown_closes_the_memcached_client(client):
+    from fastapi.testclient import TestClient
+    with TestClient(client.app):
+        pass
+    assert client.memcached.calls[-1] == 'close'
@@ -0,0 +1,31 @@
+import asyncio
+import importlib
+import os
+import sys
+
+import security
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+import load  # noqa: E402
+import micro  # noqa: E402
+
+
+def test_micro_benchmarks_report_every_function():
+    results = micro.bench_size(200, min_time=0.001)
+    assert {result["name"] for result in results} >= {
+        "distances_miles", "nearest", "nearest_many", "k_nearest", "region_resolve", "region_resolve_many"
+    }
+    assert all(result["stations"] == 200 for result in results)
+    assert all(result["calls_per_s"] > 0 for result in results if "calls_per_s" in result)
+
+
+def test_load_mix_runs_against_fake_backends(client, monkeypatch):
+    module = importlib.import_module('app')
+    monkeypatch.setattr(security, 'VALID_API_KEYS', frozenset({load.API_KEY}))
+    monkeypatch.setattr(module.app.state, 'directions_client', module.app.state.directions_client)
+
+    result = asyncio.run(load.run_mix(module, "mixed", requests=40, concurrency=4,
+                                      memcached_latency=0, directions_latency=0))
+    assert result["requests"] == 40
+    assert result["statuses"] == {"200": 40}
+    assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"]
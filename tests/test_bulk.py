@@ -0,0 +1,69 @@
+import csv
+import io
+import json
+import os
+import random
+
+import bulk_nearest_stations
+from spatial import StationIndex
+from utils import load_geojson_data
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'networks.json')
+
+
+def write_points(path, rng, count):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'latitude', 'longitude'])
+        for i in range(count):
+            writer.writerow([i, round(rng.uniform(37.0, 42.0), 6), round(rng.uniform(-79.0, -73.0), 6)])
+        writer.writerow([count, 'not-a-number', -75.0])
+        writer.writerow([count + 1, 95.0, -75.0])
+
+
+def test_nearest_many_matches_nearest():
+    stations = load_geojson_data('Metro_Stations_Regional.geojson')
+    index = StationIndex(stations)
+    rng = random.Random(2)
+    locations = [(rng.uniform(38.0, 40.0), rng.uniform(-78.0, -76.0)) for _ in range(200)]
+    assert index.nearest_many(locations) == [index.nearest(location) for location in locations]
+
+
+def test_bulk_labels_match_the_api(tmp_path, client, capsys):
+    points = tmp_path / 'points.csv'
+    write_points(str(points), random.Random(4), 300)
+    output = tmp_path / 'labelled.csv'
+    bulk_nearest_stations.main([
+        str(points), '-o', str(output), '--config', CONFIG, '--workers', '2', '--chunk-size', '40'
+    ])
+    assert 'Done: 302 rows' in capsys.readouterr().err
+
+    rows = list(csv.DictReader(open(output)))
+    assert [row['id'] for row in rows] == [str(i) for i in range(302)]
+    assert rows[300]['error'] == rows[301]['error'] == 'Invalid coordinates.'
+    for row in rows[:300:15]:
+        body = client.post('/nearest_station', json={
+            'latitude': float(row['latitude']), 'longitude': float(row['longitude'])
+        }).json()
+        station = body['nearest_station']
+        name = station['properties']['name'] if 'properties' in station else station['name']
+        assert row['station'] == name
+        assert (row['distant'] == 'True') == isinstance(body['directions'], str)
+        if row['distant'] == 'False':
+            assert float(row['distance_miles']) == station['properties']['distance_miles']
+
+
+def test_bulk_streams_ndjson_in_one_process(tmp_path, capsys):
+    points = tmp_path / 'points.ndjson'
+    points.write_text('{"lat": 38.8265, "lon": -76.9115, "trip": "a"}\n\n{"lat": 34.05, "lon": -118.24}\n'
+                      '{"lat": 38.8\n[1, 2]\n')
+    output = tmp_path / 'labelled.ndjson'
+    bulk_nearest_stations.main([
+        str(points), '-o', str(output), '--config', CONFIG, '--lat-field', 'lat', '--lon-field', 'lon', '--workers', '1'
+    ])
+    first, second, truncated, array = [json.loads(line) for line in io.StringIO(output.read_text())]
+    assert first['trip'] == 'a' and first['station'] == 'Branch Ave' and first['distant'] is False
+    assert second['distant'] is True and second['network'] == 'dc_metro'
+    # Lines that are not JSON objects get an error row instead of stopping the run
+    assert truncated['input'] == '{"lat": 38.8' and truncated['error'] == "Invalid coordinates."
+    assert array['input'] == '[1, 2]' and array['error'] == "Invalid coordinates."
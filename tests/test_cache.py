@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from cache import LRUCache, TieredCache
+
+
+class FailingMemcached:
+    def __init__(self):
+        self.calls = 0
+
+    def __getattr__(self, name):
+        async def fail(*args):
+            self.calls += 1
+            raise ConnectionError("memcached is down")
+        return fail
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
+
+
+def test_lru_expires_entries():
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.set('a', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+    assert cache.add('a', 2) and not cache.add('a', 3)
+
+
+def test_tiered_cache_degrades_to_l1_when_memcached_is_down():
+    remote = FailingMemcached()
+    cache = TieredCache(LRUCache(), remote, retry_interval=60)
+    assert asyncio.run(cache.get('k')) is None
+    assert asyncio.run(cache.add('lock:k', 'locked', time=10))
+    assert not asyncio.run(cache.add('lock:k', 'locked', time=10))
+    asyncio.run(cache.set('k', 'v'))
+    assert cache.get_local('k') == 'v'
+    assert asyncio.run(cache.get_multi(['k', 'missing'])) == {'k': 'v'}
+    # The L2 is skipped entirely until the retry interval passes
+    assert remote.calls == 1
+    assert cache.stats()['l2']['available'] is False
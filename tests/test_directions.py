@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from directions import CircuitBreaker, DirectionsClient, DirectionsUnavailable
+from fake_directions import FakeDirectionsServer
+
+STATION = {"geometry": {"coordinates": [-75.1652, 39.9526]}}
+
+
+def test_client_reuses_connections_and_caps_concurrency():
+    async def scenario():
+        async with FakeDirectionsServer(latency=0.01) as server:
+            client = DirectionsClient(server.url, 'key', timeout=2, max_concurrency=3)
+            results = await asyncio.gather(*(
+                client.get_directions((39.95, -75.16), STATION) for _ in range(12)
+            ))
+            assert all(result["status"] == "OK" for result in results)
+            assert server.requests == 12
+            assert server.connections <= 3
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_circuit_opens_on_failures_and_fails_fast():
+    async def scenario():
+        async with FakeDirectionsServer(http_status=500) as server:
+            breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+            client = DirectionsClient(server.url, 'key', timeout=2, breaker=breaker)
+            for _ in range(4):
+                with pytest.raises(DirectionsUnavailable):
+                    await client.get_directions((39.95, -75.16), STATION)
+            assert server.requests == 2
+            assert breaker.state == CircuitBreaker.OPEN
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_circuit_half_opens_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_timeout_is_reported_as_unavailable():
+    async def scenario():
+        async with FakeDirectionsServer(latency=0.5) as server:
+            client = DirectionsClient(server.url, 'key', timeout=0.05)
+            with pytest.raises(DirectionsUnavailable):
+                await client.get_directions((39.95, -75.16), STATION)
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_only_upstream_failures_count_against_the_circuit():
+    async def scenario():
+        async with FakeDirectionsServer(latency=0.5) as server:
+            def half_open_client(**options):
+                breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+                breaker.record_failure()
+                breaker.opened_at -= 60
+                return DirectionsClient(server.url, 'key', breaker=breaker, **options)
+
+            async def cancelled_call(client):
+                seen = server.requests
+                call = asyncio.create_task(client.get_directions((39.95, -75.16), STATION))
+                # Cancel once the request is waiting on the upstream
+                while server.requests == seen:
+                    await asyncio.sleep(0.005)
+                call.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await call
+
+            # Malformed destination
+            client = half_open_client()
+            with pytest.raises(KeyError):
+                await client.get_directions((39.95, -75.16), {})
+            await client.close()
+            # No free slot; an explicit 0 is honoured rather than replaced by the default
+            client = half_open_client(timeout=0.01, max_concurrency=0)
+            assert client.max_concurrency == 0
+            with pytest.raises(DirectionsUnavailable):
+                await client.get_directions((39.95, -75.16), STATION)
+            await client.close()
+            # Cancelled while waiting on the upstream
+            client = half_open_client(timeout=2)
+            await cancelled_call(client)
+            await client.close()
+            # None of these says anything about the upstream: the trial slot is
+            # handed back instead of re-opening the circuit for another minute
+            assert client.breaker.state == CircuitBreaker.OPEN and client.breaker.allow()
+
+            # A burst of client disconnects does not open a closed circuit
+            client = DirectionsClient(server.url, 'key', timeout=2,
+                                      breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+            for _ in range(3):
+                await cancelled_call(client)
+            assert client.breaker.state == CircuitBreaker.CLOSED and client.breaker.failures == 0
+            await client.close()
+
+        # An upstream timeout does count
+        async with FakeDirectionsServer(latency=0.5) as server:
+            client = half_open_client(timeout=0.05)
+            with pytest.raises(DirectionsUnavailable):
+                await client.get_directions((39.95, -75.16), STATION)
+            assert client.breaker.state == CircuitBreaker.OPEN and not client.breaker.allow()
+            await client.close()
+
+    asyncio.run(scenario())
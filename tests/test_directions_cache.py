@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import orjson
+
+import directions_cache
+from cache import LRUCache, TieredCache
+from conftest import DictMemcached
+from directions import DirectionsUnavailable
+from directions_cache import (
+    cached_directions, decode_entry, encode_entry, needs_refresh, trim_directions, DirectionsEntry
+)
+from fake_directions import directions_payload
+from responses import nearest_station_body
+
+BODY = nearest_station_body({"type": "Feature", "geometry": {"type": "Point", "coordinates": [-75.1652, 39.9526]},
+                             "properties": {"name": "Suburban Station"}})
+KEY = "d:v1:39.9500,-75.1600:walking"
+
+
+class CountingDirections:
+    def __init__(self, latency=0.0, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    async def get_directions(self, start, end, mode='walking'):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise DirectionsUnavailable("upstream down")
+        return directions_payload(f"{start[0]},{start[1]}", end['properties']['name'], mode)
+
+
+def test_trimmed_entries_keep_returned_fields_and_are_much_smaller():
+    raw = directions_payload("39.95,-75.16", "Suburban Station", "walking")
+    raw["routes"][0]["legs"][0]["steps"] *= 50
+    trimmed = trim_directions(raw)
+    assert "geocoded_waypoints" not in trimmed
+    # Kept fields stay in Google's shape; the plain-text instructions are extra
+    assert trimmed["routes"][0]["overview_polyline"] == raw["routes"][0]["overview_polyline"]
+    step = trimmed["routes"][0]["legs"][0]["steps"][0]
+    assert step == {"html_instructions": "Head toward <b>Suburban Station</b> (walking)",
+                    "instructions": "Head toward Suburban Station (walking)",
+                    "distance": {"text": "0.5 mi", "value": 805}, "duration": {"text": "10 mins", "value": 600}}
+
+    entry = encode_entry(orjson.dumps(trimmed), 0.2, now=1000.0, soft_ttl=100, jitter=0)
+    assert len(entry) * 10 < len(orjson.dumps(raw))
+    assert decode_entry(entry) == DirectionsEntry(orjson.dumps(trimmed), 1100.0, 0.2)
+    # Entries in the old raw JSON format are treated as misses
+    assert decode_entry(orjson.dumps(raw)) is None
+
+
+def test_early_expiration_spreads_refreshes_before_the_soft_ttl():
+    entry = DirectionsEntry(b"{}", fresh_until=1000.0, fetch_seconds=1.0)
+    assert not needs_refresh(entry, now=900.0, beta=0)
+    assert needs_refresh(entry, now=1000.0, beta=0)
+    # One fetch time before expiry, about e^-1 of reads refresh early with beta=1
+    early = sum(needs_refresh(entry, now=999.0, beta=1.0) for _ in range(4000)) / 4000
+    assert 0.3 < early < 0.44
+    assert not any(needs_refresh(entry, now=950.0, beta=1.0) for _ in range(1000))
+
+
+def test_stale_entries_are_served_while_one_refresh_runs():
+    async def scenario():
+        cache = TieredCache(LRUCache(), DictMemcached())
+        client = CountingDirections(latency=0.02)
+        first = await cached_directions(cache, client, KEY, (39.95, -75.16), BODY)
+        assert client.calls == 1
+
+        # Make the entry stale, as if its soft TTL had passed
+        stale = encode_entry(first, 0.02, now=time.time() - 10, soft_ttl=1, jitter=0)
+        await cache.set(KEY, stale)
+        served = await asyncio.gather(*(cached_directions(cache, client, KEY, (39.95, -75.16), BODY)
+                                        for _ in range(20)))
+        assert all(body == first for body in served)
+        await asyncio.gather(*directions_cache._refreshes.values())
+        assert client.calls == 2
+        assert decode_entry(await cache.get(KEY)).fresh_until > time.time()
+
+    asyncio.run(scenario())
+
+
+def test_failed_refresh_keeps_the_stale_entry():
+    async def scenario():
+        cache = TieredCache(LRUCache(), DictMemcached())
+        directions = orjson.dumps(trim_directions(directions_payload("a", "b", "walking")))
+        stale = encode_entry(directions, 0.01, now=time.time() - 10, soft_ttl=1, jitter=0)
+        await cache.set(KEY, stale)
+        client = CountingDirections(fail=True)
+        assert await cached_directions(cache, client, KEY, (39.95, -75.16), BODY) == directions
+        await asyncio.gather(*directions_cache._refreshes.values())
+        assert client.calls == 1
+        assert await cache.get(KEY) == stale
+        # The refresh lock is released for the next attempt
+        assert await cache.get(f"refresh:{KEY}") is None
+
+    asyncio.run(scenario())
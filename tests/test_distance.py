@@ -0,0 +1,38 @@
+import random
+
+import numpy as np
+from geopy.distance import geodesic
+
+from distance import CoordinateArray, EXACT, FAST, distances_miles, verify_accuracy
+from utils import closest_outlier_key, load_outliers
+
+
+def random_coordinates(rng, count):
+    return CoordinateArray(
+        [rng.uniform(-89.9, 89.9) for _ in range(count)],
+        [rng.uniform(-180, 180) for _ in range(count)],
+    )
+
+
+def test_modes_stay_within_tolerance():
+    rng = random.Random(3)
+    coordinates = random_coordinates(rng, 200)
+    for _ in range(5):
+        location = (rng.uniform(-89.9, 89.9), rng.uniform(-180, 180))
+        assert verify_accuracy(location, coordinates, EXACT)
+        assert verify_accuracy(location, coordinates, FAST)
+
+
+def test_exact_mode_handles_coincident_and_antipodal_points():
+    coordinates = CoordinateArray([40.0, -40.0, 0.0], [-75.0, 105.0, 0.0])
+    distances = distances_miles((40.0, -75.0), coordinates, EXACT)
+    assert distances[0] == 0.0
+    assert np.isclose(distances[1], geodesic((40.0, -75.0), (-40.0, 105.0)).miles, atol=1e-6)
+    assert np.all(np.isfinite(distances))
+
+
+def test_closest_outlier_key():
+    septa = load_outliers('septa_outermost_stations.json')
+    dc_metro = load_outliers('dc_metro_outermost_stations.json')
+    assert closest_outlier_key((39.9526, -75.1652), septa) == 'northernmost'
+    assert closest_outlier_key((34.0522, -118.2437), dc_metro, mode=FAST) == 'westernmost'
@@ -0,0 +1,49 @@
+import json
+import logging
+import queue
+
+import middlewares
+from utils import BackgroundQueueHandler, LogFormatter
+
+
+def make_record(msg, args=()):
+    return logging.LogRecord("access", logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_dict_messages_are_formatted_as_json_lines():
+    formatter = LogFormatter()
+    entry = json.loads(formatter.format(make_record({"status": 200, "path": "/nearest_station"})))
+    assert entry["status"] == 200 and entry["level"] == "INFO" and entry["logger"] == "access"
+    assert formatter.format(make_record("Loaded %s", ("SEPTA",))).endswith("INFO - Loaded SEPTA")
+
+
+def test_full_queue_drops_records_instead_of_blocking():
+    handler = BackgroundQueueHandler(queue.Queue(maxsize=1))
+    record = make_record("first")
+    handler.handle(record)
+    handler.handle(make_record("second"))
+    assert handler.dropped == 1
+    # Records are queued untouched, to be formatted by the logging thread
+    assert handler.queue.get_nowait() is record
+
+
+def access_entries(caplog):
+    return [record.msg for record in caplog.records if record.name == "access"]
+
+
+def test_access_log_is_structured_and_redacts_api_keys(client, caplog):
+    caplog.set_level(logging.INFO, logger="access")
+    client.post('/nearest_station', json={'latitude': 38.8265, 'longitude': -76.9115},
+                headers={'X-API-KEY': 'test-key', 'Authorization': 'Bearer abcdefghijkl'})
+    entry, = access_entries(caplog)
+    assert entry["method"] == "POST" and entry["path"] == "/nearest_station" and entry["status"] == 200
+    assert entry["headers"]["x-api-key"] == "***"
+    assert entry["headers"]["authorization"] == "***ijkl"
+    assert "test-key" not in json.dumps(entry)
+
+
+def test_access_log_sampling(client, caplog, monkeypatch):
+    caplog.set_level(logging.INFO, logger="access")
+    monkeypatch.setattr(middlewares, 'ACCESS_LOG_SAMPLE_RATE', 0.0)
+    client.post('/nearest_station', json={'latitude': 38.8265, 'longitude': -76.9115})
+    assert access_entries(caplog) == []
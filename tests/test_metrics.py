@@ -0,0 +1,70 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from metrics import Metrics
+
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    raise AssertionError(f"{line_prefix} not in output")
+
+
+def test_counters_and_histograms_are_exact_under_threads():
+    metrics = Metrics()
+
+    def work():
+        for _ in range(2000):
+            metrics.api_calls.inc()
+            metrics.stage_seconds.observe("cache_get", 0.003)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    text = metrics.render()
+    assert sample(text, 'nearest_station_api_calls_total') == 16000
+    stage = 'nearest_station_stage_seconds'
+    assert sample(text, f'{stage}_bucket{{stage="cache_get",le="0.0025"}}') == 0
+    assert sample(text, f'{stage}_bucket{{stage="cache_get",le="0.005"}}') == 16000
+    assert sample(text, f'{stage}_bucket{{stage="cache_get",le="+Inf"}}') == 16000
+    assert sample(text, f'{stage}_count{{stage="cache_get"}}') == 16000
+    assert sample(text, f'{stage}_sum{{stage="cache_get"}}') == pytest.approx(48.0)
+    assert sample(text, f'{stage}_count{{stage="auth"}}') == 0
+
+
+def record_in_child(metrics):
+    metrics.api_calls.inc(3)
+    with metrics.stage("nearest_compute"):
+        pass
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_multiprocess_metrics_are_summed_across_workers(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    metrics.api_calls.inc(2)
+
+    # Forked like a gunicorn --preload worker: it must get its own file, not share the parent's
+    child = multiprocessing.get_context('fork').Process(target=record_in_child, args=(metrics,))
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+
+    assert len(list(tmp_path.glob('metrics_*.db'))) == 2
+    text = metrics.render()
+    assert sample(text, 'nearest_station_api_calls_total') == 5
+    assert sample(text, 'nearest_station_stage_seconds_count{stage="nearest_compute"}') == 1
+
+
+def test_metrics_endpoint_reports_request_stages(client):
+    client.post('/nearest_station', json={'latitude': 38.8265, 'longitude': -76.9115})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    for stage in ('auth', 'region_resolve', 'cache_get', 'nearest_compute', 'serialize'):
+        assert sample(response.text, f'nearest_station_stage_seconds_count{{stage="{stage}"}}') >= 1
@@ -0,0 +1,37 @@
+import json
+
+import middlewares
+
+
+def test_security_headers_are_set_on_responses(client):
+    response = client.post('/nearest_station', json={'latitude': 38.8265, 'longitude': -76.9115})
+    assert response.headers['x-frame-options'] == 'DENY'
+    assert response.headers['x-content-type-options'] == 'nosniff'
+    assert response.headers['content-security-policy'].startswith("default-src 'self'")
+
+
+def test_declared_oversized_body_is_rejected(client):
+    body = json.dumps({'latitude': 38.8265, 'longitude': -76.9115, 'padding': 'x' * middlewares.MAX_REQUEST_SIZE})
+    response = client.post('/nearest_station', content=body, headers={'content-type': 'application/json'})
+    assert response.status_code == 413
+    assert response.json() == {'detail': 'Request Entity Too Large'}
+
+
+def test_streamed_body_is_counted_without_content_length(client):
+    def chunks():
+        yield b'{"latitude": 38.8265, "longitude": -76.9115, "padding": "'
+        for _ in range(middlewares.MAX_REQUEST_SIZE // 65536 + 1):
+            yield b'x' * 65536
+        yield b'"}'
+
+    response = client.post('/nearest_station', content=chunks(), headers={'content-type': 'application/json'})
+    assert 'content-length' not in response.request.headers
+    assert response.status_code == 413
+    assert response.json() == {'detail': 'Request Entity Too Large'}
+
+    # Small streamed bodies still go through
+    response = client.post(
+        '/nearest_station', content=iter([b'{"latitude": 38.8265, ', b'"longitude": -76.9115}']),
+        headers={'content-type': 'application/json'}
+    )
+    assert response.status_code == 200
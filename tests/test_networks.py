@@ -0,0 +1,99 @@
+import json
+import os
+import random
+
+import pytest
+
+from networks import LOADERS, config_fingerprint, load_registry
+from rtree import RTree
+from snapshot import write_snapshot
+
+
+def random_box(rng):
+    south, west = rng.uniform(-60, 60), rng.uniform(-170, 170)
+    return (south, west, south + rng.uniform(0.1, 5), west + rng.uniform(0.1, 5))
+
+
+def test_rtree_matches_brute_force():
+    rng = random.Random(5)
+    boxes = [random_box(rng) for _ in range(200)]
+    tree = RTree(boxes, node_size=4)
+    for _ in range(300):
+        lat, lon = rng.uniform(-65, 65), rng.uniform(-175, 175)
+        expected = {i for i, (s, w, n, e) in enumerate(boxes) if s <= lat <= n and w <= lon <= e}
+        assert set(tree.query_point(lat, lon)) == expected
+        nearest = tree.nearest(lat, lon)
+        distances = [RTree._box_distance(box, lat, lon) for box in boxes]
+        assert distances[nearest] == min(distances)
+    assert RTree([]).query_point(0, 0) == [] and RTree([]).nearest(0, 0) is None
+
+
+def write_grid_networks(tmp_path, count):
+    """One small GeoJSON network per grid cell, about two degrees apart."""
+    entries = []
+    for n in range(count):
+        lat, lon = 30 + 2 * (n // 10), -120 + 2 * (n % 10)
+        features = [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon + dx, lat + dy]},
+             "properties": {"STATION": f"n{n}-{k}"}}
+            for k, (dx, dy) in enumerate([(0, 0), (0.1, 0), (0, 0.1)])
+        ]
+        (tmp_path / f"n{n}.geojson").write_text(json.dumps({"features": features}))
+        entries.append({"name": f"n{n}", "loader": "geojson", "path": f"n{n}.geojson",
+                        "name_property": "STATION", "buffer_miles": 30})
+    return entries
+
+
+def test_registry_routes_points_among_many_networks(tmp_path):
+    entries = write_grid_networks(tmp_path, 60)
+    entries.append({"name": "broken", "loader": "shapefile", "path": "nowhere"})
+    config = tmp_path / 'networks.json'
+    config.write_text(json.dumps({"networks": entries}))
+
+    registry = load_registry(str(config))
+    assert len(registry) == 60
+    network, is_distant, distance = registry.resolve((34.02, -113.98))
+    assert network.name == 'n23' and not is_distant and distance == 0.0
+    assert registry.resolve((34.5, -113.95))[0].name == 'n23'
+    assert registry.candidates((34.02, -113.98)) == [23]
+    assert network.outliers['northernmost']['name'] == 'n23-2'
+
+    network, is_distant, _ = registry.resolve((60.0, -100.0))
+    assert is_distant and network.name == 'n59'
+
+
+def test_snapshot_loader_and_custom_loaders(tmp_path, monkeypatch):
+    stations = [{"name": "A", "latitude": 40.0, "longitude": -75.0},
+                {"name": "B", "latitude": 40.2, "longitude": -75.1}]
+    write_snapshot(str(tmp_path / 'compiled.snapshot'), {"compiled": stations})
+    monkeypatch.setitem(LOADERS, 'inline', lambda path, entry: entry['stations'])
+    config = tmp_path / 'networks.json'
+    config.write_text(json.dumps({"networks": [
+        {"name": "from_snapshot", "loader": "snapshot", "path": "compiled.snapshot", "network": "compiled"},
+        {"name": "inline", "loader": "inline", "path": "", "stations": [
+            {"name": "C", "latitude": 10.0, "longitude": 10.0}]},
+    ]}))
+
+    registry = load_registry(str(config))
+    assert list(registry.get('from_snapshot').stations.stations) == stations
+    assert registry.resolve((40.1, -75.05))[0].name == 'from_snapshot'
+    assert registry.resolve((10.0, 10.0))[0].name == 'inline'
+
+
+def test_empty_registry_resolves_to_nothing():
+    from networks import NetworkRegistry
+    assert NetworkRegistry([]).resolve((40.0, -75.0)) == (None, True, pytest.approx(float('inf')))
+
+
+def test_fingerprint_follows_file_contents_not_modification_times(tmp_path):
+    stations = tmp_path / 'stations.geojson'
+    stations.write_text('{"features": []}')
+    config = tmp_path / 'networks.json'
+    config.write_text(json.dumps({"networks": [{"name": "dc", "loader": "geojson", "path": "stations.geojson"}]}))
+    fingerprint = config_fingerprint(str(config))
+
+    # A fresh checkout touches every file without changing it
+    os.utime(stations, ns=(1, 1))
+    assert config_fingerprint(str(config)) == fingerprint
+    stations.write_text('{"features": [] }')
+    assert config_fingerprint(str(config)) != fingerprint
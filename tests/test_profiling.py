@@ -0,0 +1,69 @@
+import threading
+import time
+
+import security
+from profiling import SamplingProfiler, server_timing_header
+
+LOCATION = {'latitude': 38.8265, 'longitude': -76.9115}
+
+
+def test_server_timing_header_sums_repeated_stages():
+    header = server_timing_header([("cache_get", 0.001), ("nearest_compute", 0.0025), ("cache_get", 0.0005)], 0.01)
+    assert header == "cache_get;dur=1.500, nearest_compute;dur=2.500, total;dur=10.000"
+
+
+def test_server_timing_is_only_sent_to_admin_keys(client, monkeypatch):
+    monkeypatch.setattr(security, 'VALID_API_KEYS', frozenset({'test-key', 'admin-key'}))
+    monkeypatch.setattr(security, 'ADMIN_API_KEYS', frozenset({'admin-key'}))
+
+    assert 'server-timing' not in client.post('/nearest_station', json=LOCATION).headers
+
+    response = client.post('/nearest_station', json=LOCATION, headers={'X-API-KEY': 'admin-key'})
+    assert response.status_code == 200
+    stages = [entry.split(';')[0] for entry in response.headers['server-timing'].split(', ')]
+    assert stages[0] == 'auth' and stages[-1] == 'total'
+    # A cached location still goes through the cache lookup, but not the computation
+    assert 'cache_get' in stages and 'nearest_compute' not in stages
+
+    response = client.post('/nearest_station', json={'latitude': 38.9, 'longitude': -77.03},
+                           headers={'X-API-KEY': 'admin-key'})
+    assert {'region_resolve', 'nearest_compute', 'serialize'} <= {
+        entry.split(';')[0] for entry in response.headers['server-timing'].split(', ')
+    }
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_collapses_thread_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stop.set()
+    worker.join()
+
+    assert profiler.samples > 0
+    lines = profiler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy and "busy_loop (test_profiling.py:" in busy[0]
+    assert int(busy[0].rsplit(" ", 1)[1]) > 0
+
+
+def test_profile_endpoint_requires_an_admin_key(client, monkeypatch):
+    monkeypatch.setattr(security, 'ADMIN_API_KEYS', frozenset({'admin-key'}))
+    assert client.get('/admin/profile', params={'seconds': 0.05}).status_code == 403
+
+    response = client.get('/admin/profile', params={'seconds': 0.1, 'include_idle': True},
+                          headers={'X-API-KEY': 'admin-key'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert int(response.headers['x-profile-samples']) > 0
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in response.text.splitlines())
+    assert client.get('/admin/profile', params={'seconds': 10 ** 6},
+                      headers={'X-API-KEY': 'admin-key'}).status_code == 422
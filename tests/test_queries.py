@@ -0,0 +1,49 @@
+from table import StationTable
+
+
+def test_table_filters_match_list_values_case_insensitively():
+    table = StationTable([
+        {"name": "A", "properties": {"LINE": "red, green"}},
+        {"name": "B", "properties": {"LINE": "Red"}},
+        {"name": "C", "properties": {"LINE": "blue", "ZIP": 20001}},
+    ])
+    assert table.mask(None) is None
+    assert list(table.mask({"line": "red"})) == [True, True, False]
+    assert list(table.mask({"LINE": ["green", "blue"]})) == [True, False, True]
+    assert list(table.mask({"LINE": "blue", "zip": "20001"})) == [False, False, True]
+    assert not table.mask({"PLATFORM": "1"}).any()
+    assert table.attributes(2) == {"LINE": "blue", "ZIP": 20001}
+
+
+def test_unique_column_index_grows_with_the_row_count():
+    table = StationTable([{"name": f"Station {i}"} for i in range(20000)])
+    assert list(table.mask({"name": ["station 7", "Station 19999"]}).nonzero()[0]) == [7, 19999]
+    postings = table._postings["name"]
+    assert sum(ids.nbytes for ids in postings.values()) == 20000 * 4
+
+
+def test_k_nearest_endpoint_filters_by_line(client):
+    response = client.post('/stations/nearest', json={
+        'latitude': 38.8977, 'longitude': -77.0365, 'k': 4, 'filters': {'LINE': 'red'}
+    })
+    assert response.status_code == 200
+    collection = response.json()
+    assert collection['type'] == 'FeatureCollection'
+    features = collection['features']
+    assert len(features) == 4
+    assert all('red' in f['properties']['attributes']['LINE'] for f in features)
+    assert all(f['properties']['network'] == 'dc_metro' for f in features)
+    distances = [f['properties']['distance_miles'] for f in features]
+    assert distances == sorted(distances)
+
+
+def test_radius_endpoint_caps_results(client):
+    query = {'latitude': 38.8977, 'longitude': -77.0365, 'radius_miles': 5}
+    everything = client.post('/stations/within', json=query).json()
+    assert not everything['truncated'] and len(everything['features']) > 3
+    capped = client.post('/stations/within', json=dict(query, limit=3)).json()
+    assert capped['truncated'] and capped['features'] == everything['features'][:3]
+
+    assert client.post('/stations/within', json=dict(query, radius_miles=10000)).status_code == 422
+    assert client.post('/stations/nearest', json=dict(query, k=0)).status_code == 422
+    assert client.post('/stations/nearest', json=dict(query, network='nowhere')).status_code == 404
@@ -0,0 +1,43 @@
+import numpy as np
+from geopy.distance import geodesic
+
+from regions import RegionResolver, ServiceRegion, convex_hull
+from utils import load_geojson_data, load_kml_data
+
+
+def test_convex_hull_drops_interior_points():
+    hull = convex_hull([(0, 0), (2, 0), (1, 1), (2, 2), (0, 2), (1, 0)])
+    assert hull == [(0, 0), (2, 0), (2, 2), (0, 2)]
+
+
+def test_distance_to_hull_is_zero_inside_and_geodesic_outside():
+    square = [
+        {"latitude": 40.0, "longitude": -75.0}, {"latitude": 40.0, "longitude": -74.0},
+        {"latitude": 41.0, "longitude": -74.0}, {"latitude": 41.0, "longitude": -75.0},
+    ]
+    region = ServiceRegion('square', square, buffer_miles=50)
+    distances = region.distances_miles([40.5, 40.5, 39.0], [-74.5, -73.0, -74.5])
+    assert distances[0] == 0.0
+    assert np.isclose(distances[1], geodesic((40.5, -73.0), (40.5, -74.0)).miles, rtol=0.01)
+    assert np.isclose(distances[2], geodesic((39.0, -74.5), (40.0, -74.5)).miles, rtol=0.01)
+
+
+def test_resolver_picks_network_and_flags_distant_locations():
+    septa = ServiceRegion('septa', load_kml_data('SEPTARegionalRailStations2016/doc.kml'))
+    dc_metro = ServiceRegion('dc_metro', load_geojson_data('Metro_Stations_Regional.geojson'))
+    resolver = RegionResolver([septa, dc_metro])
+
+    locations = [(39.9526, -75.1652), (38.9072, -77.0369), (34.0522, -118.2437), (39.29, -76.61)]
+    results = resolver.resolve_many(locations)
+    assert [(region.name, is_distant) for region, is_distant, _ in results] == [
+        ('septa', False), ('dc_metro', False), ('dc_metro', True), ('dc_metro', False),
+    ]
+    assert results[0][2] == 0.0
+    assert resolver.resolve(locations[2])[:2] == results[2][:2]
+
+
+def test_empty_region_is_never_closest():
+    region = ServiceRegion('empty', [])
+    other = ServiceRegion('other', [{"latitude": 40.0, "longitude": -75.0}])
+    region_, is_distant, _ = RegionResolver([region, other]).resolve((40.1, -75.1))
+    assert region_ is other and not is_distant
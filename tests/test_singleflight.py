@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import utils
+from cache import LRUCache, TieredCache
+from singleflight import SingleFlight
+
+
+class SlowMemcached:
+    def __init__(self, leased=False):
+        self.values = {}
+        self.sets = 0
+        self.leased = leased
+
+    async def get(self, key):
+        await asyncio.sleep(0.01)
+        return self.values.get(key)
+
+    async def set(self, key, value, time=0):
+        self.sets += 1
+        self.values[key] = value
+        return True
+
+    async def add(self, key, value, time=0):
+        return not self.leased
+
+    async def delete(self, key):
+        return True
+
+
+def test_single_flight_shares_one_call():
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do('k', work, 21) for _ in range(10)))
+        assert results == [42] * 10
+        assert len(flights) == 0
+        assert flights.coalesced == 9
+        assert await flights.do('k', work, 1) == 2
+
+    asyncio.run(scenario())
+    assert calls == [21, 1]
+
+
+def test_concurrent_lookups_compute_once_and_never_give_up():
+    stations = [{"name": "A", "latitude": 40.0, "longitude": -75.0}]
+
+    async def scenario(remote, use_lease):
+        cache = TieredCache(LRUCache(), remote)
+        return await asyncio.gather(*(
+            utils.find_nearest_station((40.1, -75.1), stations, cache, use_lease=use_lease, lease_wait=0.01)
+            for _ in range(25)
+        ))
+
+    remote = SlowMemcached()
+    results = asyncio.run(scenario(remote, use_lease=True))
+    assert all(json.loads(result)['nearest_station']['properties']['name'] == 'A' for result in results)
+    assert remote.sets == 1
+
+    # A lease held by another replica delays this one briefly but still answers
+    remote = SlowMemcached(leased=True)
+    results = asyncio.run(scenario(remote, use_lease=True))
+    assert all(result is not None for result in results)
+    assert remote.sets == 1
@@ -0,0 +1,128 @@
+import json
+import os
+import random
+
+from find_outermost_stations import find_outermost_stations, main as compile_sources
+from snapshot import load_snapshot, write_snapshot
+from spatial import StationIndex
+from tiles import MAX_STATIONS
+from networks import config_fingerprint, load_network, load_registry, load_shared_registry
+from utils import load_geojson_data
+
+
+def test_snapshot_round_trips_stations_outliers_and_tiles(tmp_path):
+    stations = load_geojson_data('Metro_Stations_Regional.geojson')
+    stations[0] = dict(stations[0], name="Branch Ave – ünïcode")
+    path = str(tmp_path / 'stations.snapshot')
+    write_snapshot(path, {"septa": stations[:10], "dc_metro": stations}, tile_options={})
+
+    snapshot = load_snapshot(path)
+    network = snapshot.networks['dc_metro']
+    assert list(network.stations) == stations
+    assert network.stations[-1] == stations[-1] and network.stations[2:4] == stations[2:4]
+    assert network.outliers == find_outermost_stations(stations)
+    snapshots = {path: snapshot}
+    entry = {"name": "dc_metro", "loader": "geojson", "path": "missing.geojson", "snapshot": path}
+    assert load_network(entry, '', snapshots).stations.stations is network.stations
+
+    index = StationIndex(network.stations, network.tile_map, network.coordinates)
+    assert network.tile_map.lookup((38.9, -77.0)) is not None
+    assert index.nearest((38.9, -77.0)) == StationIndex(stations).nearest((38.9, -77.0))
+    # The stored KD-tree is the one the index would build for itself
+    order, vectors = StationIndex(stations).kd_tree
+    assert (network.kd_tree[0] == order).all() and (network.kd_tree[1] == vectors).all()
+
+
+def test_networks_too_big_for_a_tile_map_are_compiled_without_one(tmp_path):
+    rng = random.Random(3)
+    big = [{"name": f"S{i}", "latitude": rng.uniform(38.0, 40.0), "longitude": rng.uniform(-78.0, -75.0)}
+           for i in range(MAX_STATIONS + 100)]
+    small = load_geojson_data('Metro_Stations_Regional.geojson')
+    path = str(tmp_path / 'stations.snapshot')
+    write_snapshot(path, {"big": big, "dc_metro": small}, tile_options={})
+
+    snapshot = load_snapshot(path)
+    assert snapshot.networks['big'].tile_map is None
+    assert snapshot.networks['dc_metro'].tile_map is not None
+    network = snapshot.networks['big']
+    index = StationIndex(network.stations, network.tile_map, network.coordinates, network.kd_tree)
+    for location in [(38.5, -77.0), (39.9, -75.2)]:
+        assert index.nearest(location) == StationIndex(big).nearest(location)
+
+
+def test_missing_or_foreign_snapshot_falls_back(tmp_path):
+    assert load_snapshot(str(tmp_path / 'missing.snapshot')) is None
+    other = tmp_path / 'other.snapshot'
+    other.write_bytes(b'not a snapshot at all')
+    assert load_snapshot(str(other)) is None
+
+
+def write_station(path, name, lon, lat):
+    path.write_text(json.dumps({"features": [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": {"NAME": name}},
+    ]}))
+
+
+def test_config_snapshot_is_only_used_while_it_matches_the_sources(tmp_path):
+    config = tmp_path / 'networks.json'
+    config.write_text(json.dumps({"snapshot": "stations.snapshot", "networks": [
+        {"name": "dc", "loader": "geojson", "path": "stations.geojson", "outliers": "dc_outliers.json"},
+    ]}))
+    write_station(tmp_path / 'stations.geojson', "Old", -77.0, 38.9)
+    compile_sources(['--config', str(config)])
+    snapshot = load_snapshot(str(tmp_path / 'stations.snapshot'))
+    assert snapshot.created == config_fingerprint(str(config))
+    first = (tmp_path / 'stations.snapshot').read_bytes()
+    compile_sources(['--config', str(config)])
+    assert (tmp_path / 'stations.snapshot').read_bytes() == first
+
+    network = load_registry(str(config)).get('dc')
+    assert type(network.stations.stations).__name__ == 'SnapshotStations'
+
+    # An edited source wins over the snapshot built from the old one
+    write_station(tmp_path / 'stations.geojson', "New", -77.0, 38.9)
+    network = load_registry(str(config)).get('dc')
+    assert network.stations.nearest((38.9, -77.0))[0]['name'] == "New"
+
+
+def test_shared_registry_is_compiled_from_the_sources(tmp_path):
+    config = tmp_path / 'networks.json'
+    config.write_text(json.dumps({"snapshot": "stations.snapshot", "networks": [
+        {"name": "dc", "loader": "geojson", "path": "stations.geojson"},
+    ]}))
+    write_station(tmp_path / 'stations.geojson', "Old", -77.0, 38.9)
+    # A snapshot that claims to match the sources but holds other data
+    write_snapshot(str(tmp_path / 'stations.snapshot'), {"dc": [
+        {"name": "Stale", "latitude": 38.9, "longitude": -77.0},
+    ]}, created=config_fingerprint(str(config)))
+    shared = str(tmp_path / 'shared.snapshot')
+
+    assert load_shared_registry(str(config), shared).get('dc').stations.nearest((38.9, -77.0))[0]['name'] == "Old"
+    write_station(tmp_path / 'stations.geojson', "New", -77.0, 38.9)
+    assert load_shared_registry(str(config), shared).get('dc').stations.nearest((38.9, -77.0))[0]['name'] == "New"
+
+
+def test_shared_registry_is_compiled_once_and_matches_sources(tmp_path):
+    config = tmp_path / 'networks.json'
+    config.write_text(json.dumps({"networks": [
+        {"name": "dc_metro", "loader": "geojson", "path": os.path.abspath('Metro_Stations_Regional.geojson'),
+         "label": "DC Metro"},
+    ]}))
+    shared = str(tmp_path / 'shared.snapshot')
+
+    registry = load_shared_registry(str(config), shared)
+    compiled = os.stat(shared).st_mtime_ns
+    assert load_shared_registry(str(config), shared).get('dc_metro').label == "DC Metro"
+    assert os.stat(shared).st_mtime_ns == compiled
+
+    source = load_registry(str(config)).get('dc_metro')
+    network = registry.get('dc_metro')
+    assert network.outliers == source.outliers
+    for location in [(38.9, -77.0), (39.2, -76.6), (38.85, -77.3)]:
+        assert network.stations.nearest(location) == source.stations.nearest(location)
+
+    # Changing the config recompiles the shared file
+    fingerprint = load_snapshot(shared).created
+    config.write_text(config.read_text().replace('"DC Metro"', '"Metrorail"'))
+    assert load_shared_registry(str(config), shared).get('dc_metro').label == "Metrorail"
+    assert load_snapshot(shared).created != fingerprint
@@ -0,0 +1,75 @@
+import random
+
+from geopy.distance import geodesic
+
+from spatial import StationIndex
+from utils import load_kml_data, load_geojson_data
+
+
+def brute_force_nearest(location, stations):
+    nearest_station = None
+    min_distance = float('inf')
+    for station in stations:
+        distance = geodesic(location, (station['latitude'], station['longitude'])).miles
+        if distance < min_distance:
+            min_distance = distance
+            nearest_station = station
+    return nearest_station, min_distance
+
+
+def assert_same_nearest(result, expected):
+    assert result[0] is expected[0]
+    assert abs(result[1] - expected[1]) < 1e-6
+
+
+def test_index_matches_brute_force_on_real_stations():
+    stations = load_kml_data('SEPTARegionalRailStations2016/doc.kml') + \
+        load_geojson_data('Metro_Stations_Regional.geojson')
+    index = StationIndex(stations)
+    rng = random.Random(7)
+    for _ in range(100):
+        location = (round(rng.uniform(37.5, 41.5), 4), round(rng.uniform(-78.5, -73.5), 4))
+        assert_same_nearest(index.nearest(location), brute_force_nearest(location, stations))
+
+
+def test_index_matches_brute_force_worldwide_with_duplicates():
+    rng = random.Random(11)
+    stations = [
+        {"name": f"s{i}", "latitude": rng.uniform(-89, 89), "longitude": rng.uniform(-180, 180)}
+        for i in range(120)
+    ]
+    stations += [dict(stations[3], name="dup")]
+    index = StationIndex(stations)
+    for _ in range(40):
+        location = (rng.uniform(-90, 90), rng.uniform(-180, 180))
+        assert_same_nearest(index.nearest(location), brute_force_nearest(location, stations))
+    assert index.nearest((stations[3]['latitude'], stations[3]['longitude']))[0]['name'] == "s3"
+
+
+def test_empty_index():
+    assert StationIndex([]).nearest((40.0, -75.0)) == (None, float('inf'))
+
+
+def test_k_nearest_and_within_match_brute_force_with_masks():
+    import numpy as np
+    from distance import CoordinateArray, distances_miles
+
+    stations = load_geojson_data('Metro_Stations_Regional.geojson')
+    index = StationIndex(stations)
+    coordinates = CoordinateArray.from_stations(stations)
+    rng = random.Random(13)
+    for _ in range(30):
+        location = (rng.uniform(38.7, 39.1), rng.uniform(-77.3, -76.8))
+        mask = np.array([rng.random() < 0.5 for _ in stations])
+        distances = distances_miles(location, coordinates)
+        order = [i for i in np.argsort(distances, kind='stable') if mask[i]]
+
+        indices, found = index.k_nearest(location, 7, mask=mask)
+        assert list(indices) == order[:7]
+        assert np.allclose(found, distances[order[:7]])
+
+        indices, found = index.within(location, 3.0, mask=mask)
+        assert list(indices) == [i for i in order if distances[i] <= 3.0]
+
+    assert len(index.k_nearest((38.9, -77.0), 500)[0]) == len(stations)
+    assert len(index.k_nearest((38.9, -77.0), 3, mask=np.zeros(len(stations), dtype=bool))[0]) == 0
@@ -0,0 +1,38 @@
+import random
+
+
+from snapshot import load_snapshot, write_snapshot
+from spatial import StationIndex
+from tiles import compute_tile_map
+from utils import load_kml_data
+
+
+def test_tile_lookup_matches_index():
+    stations = load_kml_data('SEPTARegionalRailStations2016/doc.kml')
+    tile_map = compute_tile_map(stations, cell=0.02)
+
+    tiled = StationIndex(stations, tile_map)
+    plain = StationIndex(stations)
+    rng = random.Random(5)
+    hits = 0
+    for _ in range(400):
+        location = (round(rng.uniform(39.5, 40.5), 4), round(rng.uniform(-76.0, -74.5), 4))
+        hits += tile_map.lookup(location) is not None
+        assert tiled.nearest(location) == plain.nearest(location)
+    assert hits > 350
+
+
+def test_tile_map_round_trips_through_the_snapshot(tmp_path):
+    stations = [{"name": "A", "latitude": 40.0, "longitude": -75.0},
+                {"name": "B", "latitude": 40.1, "longitude": -75.1}]
+    built = compute_tile_map(stations)
+    assert built.lookup((40.05, -75.05)).tolist() == [0, 1]
+    assert built.lookup((10.0, 10.0)) is None
+
+    path = str(tmp_path / 'stations.snapshot')
+    write_snapshot(path, {"pair": stations}, tile_options={})
+    tile_map = load_snapshot(path).networks['pair'].tile_map
+    assert tile_map.params() == built.params()
+    assert (tile_map.offsets == built.offsets).all() and (tile_map.indices == built.indices).all()
+    assert tile_map.lookup((40.05, -75.05)).tolist() == [0, 1]
+    assert tile_map.lookup((10.0, 10.0)) is None
@@ -0,0 +1,132 @@
+import asyncio
+import random
+import time
+from collections import Counter
+
+from cache import LRUCache, TieredCache
+from conftest import DictMemcached
+from directions_cache import decode_entry
+from fake_directions import directions_payload
+from utils import directions_cache_key, location_cache_key
+from warming import CacheWarmer, HeavyHitters
+
+NEARBY = [(38.8265, -76.9115), (39.9526, -75.1652), (38.9072, -77.0369)]
+DISTANT = (34.0522, -118.2437)
+
+
+class StubDirections:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_directions(self, start, end, mode='walking'):
+        self.calls += 1
+        return directions_payload(f"{start[0]},{start[1]}", end['properties']['name'], mode)
+
+
+def test_heavy_hitters_keep_frequent_keys_within_the_error_bound():
+    rng = random.Random(0)
+    stream = [int(rng.paretovariate(1.0)) for _ in range(50000)] + list(range(10 ** 6, 10 ** 6 + 20000))
+    rng.shuffle(stream)
+    hitters = HeavyHitters(50)
+    for key in stream:
+        hitters.add(key)
+    true_counts = Counter(stream)
+
+    assert len(hitters) <= 100
+    assert hitters.error <= len(stream) / 51
+    top = dict(hitters.top(10))
+    assert set(top) == {key for key, _ in true_counts.most_common(10)}
+    for key, count in top.items():
+        assert true_counts[key] - hitters.error <= count <= true_counts[key]
+
+    hitters.decay(0.5)
+    assert dict(hitters.top(1)) == {1: top[1] / 2}
+
+
+def test_hot_list_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'hot.json')
+    warmer = CacheWarmer(top_k=10, path=path)
+    for _ in range(3):
+        warmer.record(NEARBY[0], include_directions=True)
+    warmer.record(NEARBY[1])
+    warmer.save()
+
+    restarted = CacheWarmer(top_k=10, path=path)
+    assert restarted.load()
+    assert restarted.locations.top() == [(NEARBY[0], 3), (NEARBY[1], 1)]
+    assert restarted.directions.top() == [(NEARBY[0], 3)]
+    assert not CacheWarmer(path=str(tmp_path / 'missing.json')).load()
+
+
+def test_workers_merge_their_hot_lists_into_one_file(tmp_path):
+    path = str(tmp_path / 'hot.json')
+    first, second = CacheWarmer(top_k=10, path=path, decay=0.5), CacheWarmer(top_k=10, path=path, decay=0.5)
+    for _ in range(4):
+        first.record(NEARBY[0])
+    second.record(NEARBY[1])
+    first.save()
+    second.save()
+    second.save()
+
+    merged = CacheWarmer(top_k=10, path=path)
+    assert merged.load()
+    # The first worker's location survives the second worker's saves, decayed but not summed
+    assert merged.locations.top() == [(NEARBY[0], 1), (NEARBY[1], 1)]
+
+
+def test_warming_fills_the_cache_and_caps_upstream_calls(client, tmp_path):
+    registry = client.app.state.datasets.registry
+    warmer = CacheWarmer(top_k=10, path=str(tmp_path / 'hot.json'), warm_directions=True, upstream_rate=20)
+    for location in NEARBY:
+        warmer.record(location, include_directions=True)
+    warmer.record(DISTANT)
+
+    async def scenario():
+        cache = TieredCache(LRUCache(), DictMemcached())
+        directions = StubDirections()
+        started = time.monotonic()
+        stats = await warmer.warm(registry, cache, directions)
+        elapsed = time.monotonic() - started
+        assert stats == {"computed": 3, "cached": 0, "distant": 1, "directions": 3}
+        # The first call goes straight out, the other two wait for tokens at 20 per second
+        assert elapsed >= 2 / 20 * 0.9
+        for location in NEARBY:
+            assert await cache.get(location_cache_key(location, registry.version))
+            assert decode_entry(await cache.get(directions_cache_key(location, version=registry.version)))
+
+        assert await warmer.warm(registry, cache, directions) == {
+            "computed": 0, "cached": 3, "distant": 1, "directions": 0
+        }
+        assert directions.calls == 3
+
+    asyncio.run(scenario())
+
+
+def test_directions_being_fetched_by_another_worker_are_skipped(client, tmp_path):
+    registry = client.app.state.datasets.registry
+    warmer = CacheWarmer(top_k=10, path=str(tmp_path / 'hot.json'), warm_directions=True, upstream_rate=100)
+    for location in NEARBY:
+        warmer.record(location, include_directions=True)
+
+    async def scenario():
+        cache = TieredCache(LRUCache(), DictMemcached())
+        busy = directions_cache_key(NEARBY[0], version=registry.version)
+        assert await cache.add(f"refresh:{busy}", "1", time=30)
+        directions = StubDirections()
+        assert (await warmer.warm(registry, cache, directions))["directions"] == 2
+        assert await cache.get(busy) is None
+        # Locks taken by the warmer itself are released
+        for location in NEARBY[1:]:
+            assert await cache.get(f"refresh:{directions_cache_key(location, version=registry.version)}") is None
+
+    asyncio.run(scenario())
+
+
+def test_requests_are_counted_by_rounded_location(client):
+    client.post('/nearest_station', json={'latitude': 38.82651, 'longitude': -76.91149, 'include_directions': False})
+    client.post('/nearest_stations', json={'locations': [
+        {'latitude': 38.82649, 'longitude': -76.9115}, {'latitude': 34.0522, 'longitude': -118.2437},
+    ]})
+    warmer = client.app.state.warmer
+    # Distant batch items are not worth warming, so they are not counted
+    assert warmer.locations.top() == [((38.8265, -76.9115), 2)]